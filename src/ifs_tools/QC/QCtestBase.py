@@ -1,6 +1,15 @@
+import os
+
+import numpy as np
 import yaml
 
 from ifs_tools.html_tools.utils import HTMLPage
+from ifs_tools.QC.header_rules import HeaderRuleSet
+from ifs_tools.QC.trends import TREND_KEYWORDS
+from ifs_tools.plot_tools.renderer import PlotRenderer, wait_plots
+from ifs_tools.stats_tools.cube_stats import DEFAULT_MAX_MEMORY
+from ifs_tools.stats_tools.preview import DEFAULT_PREVIEW_SIZE, PreviewPyramid
+from ifs_tools.stats_tools.raw_stats import DEFAULT_WORKERS
 
 class QCtestBase(object):
     """Base class for Quality Control plots."""
@@ -11,6 +20,23 @@ class QCtestBase(object):
         self.name = kwargs.get("name", "*name*?")
         self.survey = kwargs.get("survey", "*unknown*?")
         self.html = kwargs.get("html", False)
+        # Memory cap (bytes) used by tests reading large extensions
+        self.max_memory = kwargs.get("max_memory", None) or DEFAULT_MAX_MEMORY
+        # Images are plotted at full resolution instead of using previews
+        self.full_resolution = kwargs.get("full_resolution", False)
+        self.preview_size = (kwargs.get("preview_size", None)
+                             or DEFAULT_PREVIEW_SIZE)
+        # Threads used by the tests that split the frames into regions
+        self.stats_workers = (kwargs.get("stats_workers", None)
+                              or DEFAULT_WORKERS)
+
+        # Measurements of the tests (see ifs_tools.profiling.recorder)
+        self.recorder = kwargs.get("recorder", None)
+        # Figures are rendered inline unless a renderer is shared
+        self.renderer = kwargs.get("renderer", None) or PlotRenderer(workers=0)
+        self.pending_plots = []
+        # Scalar metrics aggregated across files (see ifs_tools.QC.trends)
+        self.metrics = {}
 
         if self.html:
             self.html_page = HTMLPage(
@@ -24,18 +50,97 @@ class QCtestBase(object):
             content = yaml.safe_load(file)
         return content
 
+    def record_metric(self, name, value):
+        """Record a scalar metric of the file for the night trends."""
+        if value is None or isinstance(value, (bool, np.bool_)):
+            return
+        try:
+            self.metrics[name] = float(value)
+        except (TypeError, ValueError):
+            pass
+
+    def record_header_metrics(self, hdul_idx=0, keys=TREND_KEYWORDS):
+        """Record the numeric values of the header keywords ``keys``.
+
+        They are read from the header, independently of the keywords listed
+        by the rules of the header tests.
+        """
+        header = self.data_container.get_header(hdul_idx)
+        for key in keys:
+            value = header.get(key)
+            if isinstance(value, (int, float, np.number)):
+                self.record_metric(key, value)
+
+    def save_plot(self, kind, filename, figsize, savefig_kwargs=None,
+                  **data):
+        """Submit a figure to the renderer.
+
+        Parameters
+        ----------
+        kind : str
+            Name of the figure (see ``ifs_tools.plot_tools.qc_plots``).
+        filename : str
+            Name of the PNG file within the output directory.
+        figsize : tuple
+            Size of the figure in inches.
+        savefig_kwargs : dict, optional
+            Extra arguments of ``Figure.savefig``.
+        **data :
+            Plot data passed to the plotting function.
+
+        Returns
+        -------
+        output : str
+            Path to the PNG file, written once ``wait_plots`` returns.
+        """
+        output = os.path.join(self.output, filename)
+        self.pending_plots.append((output, self.renderer.submit(
+            kind, output, figsize, savefig_kwargs=savefig_kwargs, **data)))
+        return output
+
+    def wait_plots(self):
+        """Wait for the figures submitted by the tests.
+
+        Returns
+        -------
+        failed : list
+            Paths to the figures that could not be rendered.
+        """
+        pending, self.pending_plots = self.pending_plots, []
+        return wait_plots(pending)
+
+    def get_preview_pyramid(self, hdul_idx):
+        return self.data_container.memoize(
+            ("preview_pyramid", hdul_idx), PreviewPyramid,
+            self.data_container.get_section(hdul_idx),
+            max_memory=self.max_memory)
+
+    def get_image_preview(self, hdul_idx, method="mean"):
+        """Image of an extension reduced to the display resolution.
+
+        Returns
+        -------
+        image : np.ndarray
+        factor : int
+            Reduction factor of the image (1 if ``self.full_resolution``).
+        """
+        if self.full_resolution:
+            return self.data_container.get_data(hdul_idx), 1
+        preview = self.get_preview_pyramid(hdul_idx).get_preview(
+            self.preview_size, method=method)
+        # The pyramid may have grown with a new level
+        self.data_container.products.refresh(("preview_pyramid", hdul_idx))
+        return preview
+
+    def get_image_percentiles(self, hdul_idx, q):
+        """Percentiles of an image (estimated on a subsample by default)."""
+        if self.full_resolution:
+            return np.nanpercentile(self.data_container.get_data(hdul_idx),
+                                    q)
+        return self.get_preview_pyramid(hdul_idx).get_percentiles(q)
+
     def check_header(self, key_dict, hdul_idx=0):
-        info = self.data_container.get_from_header(key_dict.keys(),
-                                         hdul_idx=hdul_idx)
-        checks = []
-        for k, v, in info.items():
-            okey = True
-            if type(v) is not str and key_dict[k] != "None":
-                okey = key_dict[k][0] < v < key_dict[k][1]
-            elif type(v) is str and key_dict[k] != "None":
-                okey = v == key_dict[k][0]
-            else:
-                okey = "N/A"
-            checks.append((k, v, okey))
-            # print(f"{k}: {v} -- Okey: {okey}")
-        return checks
\ No newline at end of file
+        if not isinstance(key_dict, HeaderRuleSet):
+            key_dict = HeaderRuleSet(key_dict)
+        return key_dict.check_header(
+            self.data_container.get_header(hdul_idx))
@@ -0,0 +1,148 @@
+"""
+Compiled header rules used by the header QC checks.
+
+The rules of a qc_params YAML file are compiled once into a
+:class:`HeaderRuleSet`, which evaluates them over a batch of headers at the
+same time using a columnar table of keyword values.
+
+Rule syntax (per keyword):
+
+- ``None``: the keyword is only reported.
+- ``[lo, hi]``: numerical values must satisfy ``lo < value < hi``; string
+  values must be equal to ``lo``. Non-numerical bounds (e.g. ``[A, B]``)
+  never accept numerical values.
+- ``value``: the keyword must be equal to ``value``.
+"""
+
+from functools import lru_cache
+import numbers
+import os
+
+import numpy as np
+import yaml
+
+NO_RULE = "None"
+
+_is_str = np.frompyfunc(lambda v: isinstance(v, str), 1, 1)
+_is_real = np.frompyfunc(lambda v: isinstance(v, numbers.Real), 1, 1)
+
+
+def _numeric_bound(value):
+    """Bound of a range rule as a float (NaN if it is not a number)."""
+    if isinstance(value, numbers.Real):
+        return float(value)
+    return np.nan
+
+
+class HeaderRuleSet(object):
+    """Set of header rules compiled into arrays."""
+    def __init__(self, rules):
+        self.keys = list(rules.keys())
+        self.range_idx, self.equal_idx = [], []
+        lo, hi = [], []
+        # Reference value for the equality comparisons of each keyword
+        self.reference = np.empty(len(self.keys), dtype=object)
+        for i, rule in enumerate(rules.values()):
+            if rule == NO_RULE or rule is None:
+                continue
+            if isinstance(rule, (list, tuple)):
+                self.range_idx.append(i)
+                lo.append(_numeric_bound(rule[0]) if len(rule) > 1
+                          else np.nan)
+                hi.append(_numeric_bound(rule[1]) if len(rule) > 1
+                          else np.nan)
+                self.reference[i] = rule[0]
+            else:
+                self.equal_idx.append(i)
+                self.reference[i] = rule
+        self.range_idx = np.array(self.range_idx, dtype=int)
+        self.equal_idx = np.array(self.equal_idx, dtype=int)
+        self.lo = np.array(lo, dtype=float)
+        self.hi = np.array(hi, dtype=float)
+        self.has_rule = np.zeros(len(self.keys), dtype=bool)
+        self.has_rule[self.range_idx] = True
+        self.has_rule[self.equal_idx] = True
+
+    @classmethod
+    def from_yml(cls, file_path):
+        with open(file_path, 'r') as file:
+            rules = yaml.safe_load(file)
+        return cls(rules)
+
+    def header_table(self, headers):
+        """Columnar table of the keyword values of a list of headers.
+
+        Returns
+        -------
+        values : np.ndarray
+            Object array with shape (n_headers, n_keys). Missing keywords are
+            set to None.
+        """
+        values = np.empty((len(headers), len(self.keys)), dtype=object)
+        for i, header in enumerate(headers):
+            values[i] = [header.get(k, None) for k in self.keys]
+        return values
+
+    def evaluate(self, headers):
+        """Evaluate the rules over a list of headers.
+
+        Returns
+        -------
+        values : np.ndarray
+            Keyword values, see :meth:`header_table`.
+        okay : np.ndarray
+            Boolean array with the same shape as ``values``. Keywords
+            without a rule are always okay (see ``has_rule``).
+        """
+        values = self.header_table(headers)
+        okay = np.ones(values.shape, dtype=bool)
+        if values.size == 0:
+            return values, okay
+        is_str = _is_str(values).astype(bool)
+
+        # Equality rules (and string values of range rules)
+        rule_idx = np.concatenate([self.range_idx, self.equal_idx])
+        okay[:, rule_idx] = (values[:, rule_idx]
+                             == self.reference[np.newaxis, rule_idx])
+
+        # Numerical values are compared to the [lo, hi] ranges
+        range_values = values[:, self.range_idx]
+        numeric = _is_real(range_values).astype(bool)
+        range_numbers = np.full(range_values.shape, np.nan)
+        range_numbers[numeric] = range_values[numeric].astype(float)
+        with np.errstate(invalid="ignore"):
+            in_range = (self.lo < range_numbers) & (range_numbers < self.hi)
+        okay[:, self.range_idx] = np.where(is_str[:, self.range_idx],
+                                           okay[:, self.range_idx], in_range)
+        return values, okay
+
+    def check_headers(self, headers):
+        """Check a list of headers.
+
+        Returns
+        -------
+        checks : list
+            For every header, a list of ``(key, value, okay)`` tuples, where
+            ``okay`` is "N/A" for keywords without a rule.
+        """
+        values, okay = self.evaluate(headers)
+        checks = []
+        for header_values, header_okay in zip(values, okay):
+            checks.append([
+                (k, v, bool(o) if r else "N/A") for k, v, o, r in zip(
+                    self.keys, header_values, header_okay, self.has_rule)])
+        return checks
+
+    def check_header(self, header):
+        return self.check_headers([header])[0]
+
+
+@lru_cache(maxsize=None)
+def _load_rule_set(file_path, mtime):
+    return HeaderRuleSet.from_yml(file_path)
+
+
+def load_rule_set(file_path):
+    """Load a compiled rule set, reusing it until the file is modified."""
+    return _load_rule_set(os.path.abspath(file_path),
+                          os.path.getmtime(file_path))
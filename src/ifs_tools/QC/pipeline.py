@@ -0,0 +1,152 @@
+"""
+Pipeline overlapping the I/O and the computation of consecutive files.
+
+Files flow through the following stages, connected by bounded queues:
+
+1. discover: any iterable of ``(index, path)`` pairs.
+2. open: open the file, read its headers and the extensions needed by the
+   tests (background thread).
+3. compute and render: apply the QC tests (calling thread, since matplotlib
+   figures are built here).
+4. write: save the report and publish it (background thread).
+
+While the tests of a file are computed, the next files are read in the
+background, up to ``prefetch`` files and ``max_buffer_bytes`` bytes of data
+read in advance.
+"""
+
+import queue
+import threading
+import traceback
+
+# Default memory (bytes) used by the files read in advance
+DEFAULT_BUFFER_BYTES = 1024 * 2**20
+
+
+class QCPipeline(object):
+    """Run the stages of the QC of several files concurrently.
+
+    Parameters
+    ----------
+    open_stage : callable
+        ``open_stage(index, path, budget)`` returns ``(state, nbytes)``,
+        where ``nbytes`` is the amount of data read into memory, which
+        should not exceed ``budget`` bytes.
+    compute_stage : callable
+        ``compute_stage(state)`` applies the tests and returns the new state.
+    write_stage : callable
+        ``write_stage(state)`` writes the products and returns the result of
+        the file.
+    cleanup : callable, optional
+        ``cleanup(state)`` is called when a stage fails (e.g. to close the
+        file).
+    prefetch : int
+        Maximum number of files opened in advance.
+    max_buffer_bytes : int
+        Maximum amount of data read in advance. A new file is only opened
+        when the data buffered is below this limit, and it is given the rest
+        of the limit as budget.
+    callback : callable, optional
+        ``callback(index, result)`` is called as soon as each file is
+        written.
+    """
+    def __init__(self, open_stage, compute_stage, write_stage, cleanup=None,
+                 prefetch=2, max_buffer_bytes=DEFAULT_BUFFER_BYTES,
+                 callback=None):
+        self.open_stage = open_stage
+        self.compute_stage = compute_stage
+        self.write_stage = write_stage
+        self.cleanup = cleanup
+        self.prefetch = max(int(prefetch), 1)
+        self.max_buffer_bytes = max_buffer_bytes
+        self.callback = callback
+        self.buffered_bytes = 0
+        self._buffer_lock = threading.Condition()
+
+    def _fail(self, stage, index, state):
+        traceback.print_exc()
+        print(f"[ERROR] QC {stage} stage failed for file {index}")
+        if state is not None and self.cleanup is not None:
+            try:
+                self.cleanup(state)
+            except Exception:
+                traceback.print_exc()
+
+    def _release(self, nbytes):
+        with self._buffer_lock:
+            self.buffered_bytes -= nbytes
+            self._buffer_lock.notify_all()
+
+    def _open_files(self, files, open_queue):
+        try:
+            for index, path in files:
+                with self._buffer_lock:
+                    self._buffer_lock.wait_for(
+                        lambda: self.buffered_bytes < self.max_buffer_bytes)
+                    budget = self.max_buffer_bytes - self.buffered_bytes
+                try:
+                    state, nbytes = self.open_stage(index, path, budget)
+                except Exception:
+                    self._fail("open", index, None)
+                    state, nbytes = None, 0
+                with self._buffer_lock:
+                    self.buffered_bytes += nbytes
+                open_queue.put((index, state, nbytes))
+        except Exception:
+            traceback.print_exc()
+            print("[ERROR] QC pipeline could not list the next files")
+        finally:
+            # The end marker is always sent, so that run() returns
+            open_queue.put(None)
+
+    def _write_files(self, write_queue, results):
+        while True:
+            item = write_queue.get()
+            if item is None:
+                return
+            index, state = item
+            result = None
+            if state is not None:
+                try:
+                    result = self.write_stage(state)
+                except Exception:
+                    self._fail("write", index, state)
+            results[index] = result
+            if self.callback is not None:
+                self.callback(index, result)
+
+    def run(self, files):
+        """Run the pipeline over an iterable of ``(index, path)`` pairs.
+
+        Returns
+        -------
+        results : dict
+            Result of each file index (None for failed files).
+        """
+        results = {}
+        open_queue = queue.Queue(maxsize=self.prefetch)
+        write_queue = queue.Queue(maxsize=self.prefetch)
+        reader = threading.Thread(target=self._open_files,
+                                  args=(files, open_queue), daemon=True)
+        writer = threading.Thread(target=self._write_files,
+                                  args=(write_queue, results), daemon=True)
+        reader.start()
+        writer.start()
+        while True:
+            item = open_queue.get()
+            if item is None:
+                break
+            index, state, nbytes = item
+            if state is not None:
+                try:
+                    state = self.compute_stage(state)
+                except Exception:
+                    self._fail("compute", index, state)
+                    state = None
+            # Data read in advance is released by the tests
+            self._release(nbytes)
+            write_queue.put((index, state))
+        write_queue.put(None)
+        reader.join()
+        writer.join()
+        return results
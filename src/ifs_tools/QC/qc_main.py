@@ -1,10 +1,32 @@
 #!/usr/bin/env python3
 
 import argparse
+import copy
+from concurrent.futures import (FIRST_COMPLETED, ProcessPoolExecutor,
+                                as_completed, wait)
+import inspect
 import os
 import shutil
+import time
+import traceback
 
+import numpy as np
+
+from ifs_tools.data_readers.fits_headers import read_fits_headers
+from ifs_tools.data_readers.header_catalog import HeaderCatalog
+from ifs_tools.data_readers.tile_compression import DEFAULT_WORKERS
+from ifs_tools.html_tools.master_index import MasterIndex, get_night
 from ifs_tools.html_tools.utils import HTMLPage
+from ifs_tools.QC.header_rules import load_rule_set
+from ifs_tools.QC.pipeline import QCPipeline
+from ifs_tools.QC.registry import (get_qc_class, get_test_spec,
+                                   only_header_tests, plan_tests)
+from ifs_tools.QC.result_cache import ResultCache, config_hash, output_name
+from ifs_tools.QC.trends import DEFAULT_THRESHOLD, TrendStore
+from ifs_tools.QC.watch import DirectoryWatcher, warm_up_worker
+from ifs_tools.plot_tools.renderer import PlotRenderer
+from ifs_tools.profiling.recorder import RunRecorder, measure
+# Importing the survey modules registers their QC tests
 import ifs_tools.QC as qc
 
 def makedir(path, overwrite=True):
@@ -21,6 +43,24 @@ def makedir(path, overwrite=True):
         os.mkdir(path)
         return True
 
+# Renderer of the figures shared by every file of the current process
+_plot_renderer = None
+
+def get_plot_renderer(args):
+    global _plot_renderer
+    if _plot_renderer is None:
+        _plot_renderer = PlotRenderer(workers=args.render_workers,
+                                      dpi=args.dpi,
+                                      compress_level=args.png_compression,
+                                      reuse_figures=args.reuse_figures)
+    return _plot_renderer
+
+def close_plot_renderer():
+    global _plot_renderer
+    if _plot_renderer is not None:
+        _plot_renderer.close()
+        _plot_renderer = None
+
 def is_html_page(path):
     page = os.path.join(path, "index.html")
     ispage = os.path.isfile(page)
@@ -29,21 +69,449 @@ def is_html_page(path):
     else:
         return None
 
+def screen_headers(qc_class, tests, paths):
+    """Evaluate the header tests over all the files in a single batch.
+
+    Returns
+    -------
+    checks : list
+        For every file, a dictionary with the checks of each test, or None if
+        the headers of the file could not be read.
+    """
+    print(f"Screening the headers of {len(paths)} files")
+    specs = [get_test_spec(qc_class, test) for test in tests]
+    last_hdu = max(max(spec.headers, default=0) for spec in specs)
+    headers, readable = [], []
+    for path in paths:
+        try:
+            headers.append(read_fits_headers(path, hdul_idx=last_hdu))
+            readable.append(True)
+        except Exception as e:
+            print(f"[ERROR] Could not read the header of {path}: {e}")
+            readable.append(False)
+    test_checks = {}
+    for spec in specs:
+        rule_set = load_rule_set(spec.rules)
+        hdul_idx = spec.headers[0] if spec.headers else 0
+        test_checks[spec.name] = iter(rule_set.check_headers(
+            [file_headers[hdul_idx] for file_headers in headers]))
+    return [{test: next(test_checks[test]) for test in tests}
+            if ok else None for ok in readable]
+
+def product_options(args):
+    """Options of the run that change the products of the tests.
+
+    Tests run without HTML report do not record their report sections, so
+    ``html`` is one of them.
+    """
+    return {"html": args.html, "max_memory": args.max_memory,
+            "full_resolution": args.full_resolution,
+            "dpi": args.dpi, "png_compression": args.png_compression}
+
+def open_qc_file(index, path, args, preload=False, max_preload=None):
+    """Create the QC tests of a file.
+
+    Parameters
+    ----------
+    index : int
+        Position of the file within the input list.
+    path : str
+        Path to the file.
+    args : argparse.Namespace
+        Input arguments of the run.
+    preload : bool, optional
+        If True, the data of the extensions used by the tests that are not
+        cached is read into memory.
+    max_preload : int, optional
+        Maximum amount of data (bytes) read into memory. Extensions that do
+        not fit are read lazily by the tests.
+
+    Returns
+    -------
+    qc_tests : QCtestBase
+    cache : ResultCache or None
+    nbytes : int
+        Amount of data read into memory.
+    """
+    if args.watch:
+        print(f"\nChecking {args.qcmode} {index+1}: {path}\n")
+    else:
+        print(f"\nChecking {args.qcmode} {index+1} out of {len(args.file_path)}\n")
+    qc_class = get_qc_class(args.survey, args.qcmode)
+    outdir = os.path.join(args.output, output_name(path))
+    makedir(outdir, overwrite=args.overwrite)
+    if args.cache:
+        cache = ResultCache(outdir, path, content_hash=args.hash)
+    else:
+        cache = None
+    recorder = None
+    if args.instrument:
+        recorder = RunRecorder(profile_dir=outdir if args.profile else None)
+    qc_tests = qc_class(path, output=outdir,
+                        html=args.html,
+                        header_only=only_header_tests(
+                            qc_class, args.qctest),
+                        max_memory=args.max_memory * 2**20,
+                        full_resolution=args.full_resolution,
+                        cache_bytes=args.product_cache * 2**20,
+                        renderer=get_plot_renderer(args),
+                        recorder=recorder,
+                        stats_workers=args.stats_workers,
+                        decompress_workers=args.decompress_workers,
+                        decompressed_cache=args.decompressed_cache)
+    nbytes = 0
+    if preload:
+        module = inspect.getmodule(qc_class)
+        options = product_options(args)
+        for test in args.qctest:
+            if (cache is not None and cache.get(
+                    test, config_hash(module, test, options)) is not None):
+                continue
+            for hdul_idx in get_test_spec(qc_class, test).hdus or ():
+                budget = (None if max_preload is None
+                          else max_preload - nbytes)
+                nbytes += qc_tests.data_container.preload(
+                    hdul_idx, max_bytes=budget)
+    return qc_tests, cache, nbytes
+
+def apply_qc_tests(qc_tests, cache, args, header_checks=None):
+    """Apply the requested QC tests (or reuse their cached results).
+
+    Returns
+    -------
+    night : str
+        Observing night of the file.
+    """
+    qc_class = type(qc_tests)
+    module = inspect.getmodule(qc_class)
+    options = product_options(args)
+    # Sections of the report added by each test
+    test_sections = {}
+    for test, release in plan_tests(qc_class, args.qctest):
+        config = config_hash(module, test, options)
+        entry = cache.get(test, config) if cache is not None else None
+        if entry is not None:
+            print(f"\nUsing cached results of **{test}**\n")
+            test_sections[test] = entry["sections"]
+            qc_tests.metrics.update(entry.get("metrics", {}))
+            if qc_tests.recorder is not None:
+                qc_tests.recorder.add_cached(test)
+        else:
+            print(f"\nApplying **{test}**\n")
+            if args.html:
+                n_sections = len(qc_tests.html_page.sections)
+            test_method = getattr(qc_tests, test)
+            recorded = set(qc_tests.metrics)
+            with measure(qc_tests.recorder, "test", test,
+                         profile=args.profile) as record:
+                if header_checks is not None:
+                    output = test_method(checks=header_checks[test])
+                else:
+                    output = test_method()
+            if record is not None:
+                print(f"...Check completed in {record['wall']:.2f} s...\n")
+            else:
+                print("...Check completed...\n")
+            test_sections[test] = []
+            if args.html:
+                test_sections[test] = qc_tests.html_page.sections[
+                    n_sections:]
+            if cache is not None:
+                cache.put(test, config, products=output,
+                          sections=test_sections[test],
+                          metrics={name: value for name, value in
+                                   qc_tests.metrics.items()
+                                   if name not in recorded})
+        for hdul_idx in release:
+            qc_tests.data_container.release_hdu(hdul_idx)
+    if args.html:
+        # Keep the order of the requested tests in the report
+        qc_tests.html_page.sections = [
+            section for test in args.qctest
+            for section in test_sections[test]]
+    header = qc_tests.data_container.get_from_header(
+        ["DATE-OBS", "UT", "CAMERA", "DETECTOR"])
+    if args.trends and qc_tests.metrics:
+        TrendStore(args.output).append(
+            qc_tests.data_container.path, qc_tests.metrics,
+            date_obs=header["DATE-OBS"], ut=header["UT"],
+            camera=header["CAMERA"] or header["DETECTOR"])
+    return get_night(header["DATE-OBS"], header["UT"])
+
+def write_qc_report(qc_tests, cache, args, night):
+    """Close the file, wait for its figures and save its HTML report.
+
+    Returns
+    -------
+    reference : tuple or None
+        Relative path and title of the file HTML report and observing night
+        of the file, or None if no HTML report was requested.
+    """
+    qc_tests.data_container.close_hdul()
+    recorder = qc_tests.recorder
+    with measure(recorder, "render", "wait_plots"):
+        failed = qc_tests.wait_plots()
+    if failed and cache is not None:
+        # Apply again the tests whose figures are missing in the next run
+        cache.evict_products(failed)
+    if recorder is not None:
+        if args.html and args.performance_report:
+            # Opt-in: the timings differ from run to run
+            qc_tests.html_page.add_table_section(
+                title="Performance", data=recorder.summary_table())
+        recorder.write_log(args.run_log, run=args.run_id,
+                           file=qc_tests.data_container.path)
+    if args.html:
+        qc_tests.html_page.save_page(
+            os.path.join(qc_tests.output, f"index_{args.qcmode}.html"))
+        return (os.path.join(os.path.basename(qc_tests.output),
+                             f"index_{args.qcmode}.html"),
+                qc_tests.html_page.title, night)
+    return None
+
+def run_qc_file(index, path, args, header_checks=None):
+    """Apply all the requested QC tests to a single file.
+
+    Failures are caught so that they do not affect the rest of the files.
+
+    Parameters
+    ----------
+    index : int
+        Position of the file within the input list.
+    path : str
+        Path to the file.
+    args : argparse.Namespace
+        Input arguments of the run.
+    header_checks : dict, optional
+        Precomputed results of the header tests (see ``screen_headers``).
+
+    Returns
+    -------
+    reference : tuple or None
+        See ``write_qc_report``. None if the file failed.
+    """
+    qc_tests = None
+    try:
+        qc_tests, cache, _ = open_qc_file(index, path, args)
+        night = apply_qc_tests(qc_tests, cache, args, header_checks)
+        return write_qc_report(qc_tests, cache, args, night)
+    except Exception:
+        traceback.print_exc()
+        print(f"[ERROR] QC failed for file {path}")
+        if qc_tests is not None:
+            qc_tests.data_container.close_hdul()
+        return None
+
+def run_qc_pipeline(args, header_checks, callback=None):
+    """Run the QC of every file overlapping the I/O of consecutive files.
+
+    See ``ifs_tools.QC.pipeline``.
+    """
+    def open_stage(index, path, budget):
+        qc_tests, cache, nbytes = open_qc_file(index, path, args,
+                                               preload=True,
+                                               max_preload=budget)
+        return (qc_tests, cache, header_checks[index]), nbytes
+
+    def compute_stage(state):
+        qc_tests, cache, checks = state
+        return qc_tests, cache, apply_qc_tests(qc_tests, cache, args, checks)
+
+    def write_stage(state):
+        qc_tests, cache, night = state
+        return write_qc_report(qc_tests, cache, args, night)
+
+    def cleanup(state):
+        state[0].data_container.close_hdul()
+
+    pipeline = QCPipeline(open_stage, compute_stage, write_stage,
+                          cleanup=cleanup, prefetch=args.prefetch,
+                          max_buffer_bytes=args.prefetch_memory * 2**20,
+                          callback=callback)
+    results = pipeline.run(enumerate(args.file_path))
+    return [results.get(i) for i in range(len(args.file_path))]
+
+def run_qc_files(args, callback=None):
+    """Run the QC of every input file.
+
+    Files are processed serially, using a process pool (``args.workers``)
+    or using a pipeline that reads the next files while the current one is
+    processed (``args.pipeline``).
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+        Input arguments of the run.
+    callback : callable, optional
+        Function called as ``callback(index, reference)`` as soon as each
+        file is completed.
+
+    Returns
+    -------
+    results : list
+        Output of ``run_qc_file`` following the order of the input files.
+    """
+    qc_class = get_qc_class(args.survey, args.qcmode)
+    if only_header_tests(qc_class, args.qctest):
+        header_checks = screen_headers(qc_class, args.qctest, args.file_path)
+    else:
+        header_checks = [None] * len(args.file_path)
+
+    if args.pipeline:
+        print(f"Running the QC pipeline with {args.prefetch} files prefetched")
+        return run_qc_pipeline(args, header_checks, callback=callback)
+
+    results = [None] * len(args.file_path)
+    if args.workers is None or args.workers <= 1:
+        for i, (path, checks) in enumerate(zip(args.file_path,
+                                               header_checks)):
+            results[i] = run_qc_file(i, path, args, checks)
+            if callback is not None:
+                callback(i, results[i])
+        return results
+
+    print(f"Distributing {len(args.file_path)} files among {args.workers} workers")
+    # Each worker renders its own figures
+    args = copy.copy(args)
+    args.render_workers = 0
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = {executor.submit(run_qc_file, i, path, args, checks): i
+                   for i, (path, checks) in enumerate(
+                       zip(args.file_path, header_checks))}
+        for future in as_completed(futures):
+            i = futures[future]
+            try:
+                results[i] = future.result()
+            except Exception:
+                # The worker process itself crashed
+                traceback.print_exc()
+                print(f"[ERROR] QC failed for file {args.file_path[i]}")
+            if callback is not None:
+                callback(i, results[i])
+    return results
+
+def run_qc_watch(args, callback=None):
+    """Apply the QC to new files as they are written in the input directories.
+
+    Files are processed by a pool of ``args.workers`` processes started (and
+    warmed up) in advance. The function only returns on KeyboardInterrupt.
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+        Input arguments of the run. ``args.file_path`` are the directories
+        to watch.
+    callback : callable, optional
+        Function called as ``callback(path, reference)`` as soon as each
+        file is completed, which must publish its report.
+    """
+    watcher = DirectoryWatcher(args.file_path, pattern=args.watch_pattern,
+                               stable_time=args.stable_time,
+                               skip_existing=args.skip_existing)
+    # Each worker renders its own figures
+    worker_args = copy.copy(args)
+    worker_args.render_workers = 0
+    n_workers = max(args.workers or 1, 1)
+    executor = ProcessPoolExecutor(max_workers=n_workers,
+                                   initializer=warm_up_worker,
+                                   initargs=(args.survey, args.qcmode))
+    # Start the workers before the first file arrives
+    wait([executor.submit(time.sleep, 0.1) for _ in range(n_workers)])
+    print(f"Watching {', '.join(watcher.paths)} with {n_workers} workers"
+          + " (Ctrl+C to stop)")
+
+    futures = {}
+    latencies = []
+    index = 0
+    try:
+        while True:
+            for path, arrival in watcher.poll():
+                print(f"[WATCH] New file {path}")
+                future = executor.submit(run_qc_file, index, path,
+                                         worker_args)
+                futures[future] = (index, path, arrival, time.time())
+                index += 1
+            if not futures:
+                time.sleep(args.poll_interval)
+                continue
+            done, _ = wait(futures, timeout=args.poll_interval,
+                           return_when=FIRST_COMPLETED)
+            for future in done:
+                i, path, arrival, ready = futures.pop(future)
+                try:
+                    reference = future.result()
+                except Exception:
+                    traceback.print_exc()
+                    print(f"[ERROR] QC failed for file {path}")
+                    reference = None
+                processed = time.time()
+                if callback is not None:
+                    callback(path, reference)
+                published = time.time()
+                if reference is None:
+                    continue
+                latencies.append(published - arrival)
+                print(f"[WATCH] {os.path.basename(path)} published "
+                      + f"{published - arrival:.1f} s after arrival "
+                      + f"(write {ready - arrival:.1f} s, "
+                      + f"QC {processed - ready:.1f} s, "
+                      + f"publish {published - processed:.1f} s); "
+                      + f"median {np.median(latencies):.1f} s, "
+                      + f"max {np.max(latencies):.1f} s "
+                      + f"over {len(latencies)} files; "
+                      + f"{len(futures)} files in the queue")
+                if args.cadence is not None and latencies[-1] > args.cadence:
+                    print(f"[WARNING] Latency above the cadence of "
+                          + f"{args.cadence} s, the QC is not keeping up")
+    except KeyboardInterrupt:
+        print("\nStopping the watch, files still in the queue are dropped")
+        for future in futures:
+            future.cancel()
+    finally:
+        executor.shutdown(wait=True)
+    if latencies:
+        print(f"Published {len(latencies)} files, latency: "
+              + f"median {np.median(latencies):.1f} s, "
+              + f"max {np.max(latencies):.1f} s")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
-    parser.add_argument("file_path", metavar="N", type=str, nargs="+",
-                        help="Path to file(s)")
+    parser.add_argument("file_path", metavar="N", type=str, nargs="*",
+                        help="Path to file(s). With --catalog, directories (or files) to add to the catalog")
     parser.add_argument("--search_in", type=str, help="If selected, will search for all fits file within the given directory",
                         dest="search_in", action=argparse.BooleanOptionalAction,
                         default=False)
+    parser.add_argument("--watch", action=argparse.BooleanOptionalAction,
+                        help="Keep watching the input directories and apply the QC to new files as they are written (default=False)",
+                        dest="watch", default=False)
+    parser.add_argument("--poll_interval", type=float,
+                        help="Time (s) between checks of the watched directories (default=1)",
+                        dest="poll_interval", default=1.0)
+    parser.add_argument("--stable_time", type=float,
+                        help="Time (s) without size changes after which a watched file is considered complete when its FITS structure cannot be checked (default=5)",
+                        dest="stable_time", default=5.0)
+    parser.add_argument("--watch_pattern", type=str,
+                        help="Pattern of the file names to watch (default=*.fit*)",
+                        dest="watch_pattern", default="*.fit*")
+    parser.add_argument("--skip_existing", action=argparse.BooleanOptionalAction,
+                        help="Only watch files created after the start (default=False)",
+                        dest="skip_existing", default=False)
+    parser.add_argument("--cadence", type=float,
+                        help="Exposure cadence (s), a warning is shown when a file takes longer to be published",
+                        dest="cadence", default=None)
+    parser.add_argument("--catalog", type=str,
+                        help="SQLite catalog of headers used to select the input files, updated with the input paths",
+                        dest="catalog", default=None)
+    parser.add_argument("--select", type=str,
+                        help="SQL condition selecting the files of the catalog, e.g. \"OBSTYPE = 'BIAS' AND night = '20240101'\"",
+                        dest="select", default=None)
     parser.add_argument("--survey", type=str, help="Survey/instrument to be used (default=weave)",
                         dest="survey", required=True)
     parser.add_argument("--qctest", nargs="+", help="QC test function to be applied to the data",
                     dest="qctest", required=True)
     parser.add_argument("--qcmode", type=str, help="QC test level of every qc test: raw, cube, or prod",
                     dest="qcmode", required=True)
-    parser.add_argument("--output", nargs=1, help="Output directory to store QC products of all files.",
+    parser.add_argument("--output", type=str, help="Output directory to store QC products of all files.",
                     dest="output", default=os.path.join(os.getcwd(), "output"))
     parser.add_argument("--overwrite", action=argparse.BooleanOptionalAction,
                         help="Overwrite output products from previous runs (default is False)",
@@ -51,10 +519,98 @@ if __name__ == "__main__":
     parser.add_argument("--html", action=argparse.BooleanOptionalAction,
                     help="Create an HTML file to visualize the results (default=True)",
                     dest="html", default=True)
+    parser.add_argument("--workers", type=int,
+                        help="Number of processes used to QC the files in parallel (default=1)",
+                        dest="workers", default=1)
+    parser.add_argument("--pipeline", action=argparse.BooleanOptionalAction,
+                        help="Read the next files while the tests of the current one are applied (default=False)",
+                        dest="pipeline", default=False)
+    parser.add_argument("--prefetch", type=int,
+                        help="Number of files read in advance in pipeline mode (default=2)",
+                        dest="prefetch", default=2)
+    parser.add_argument("--prefetch_memory", type=float,
+                        help="Maximum data (MB) read in advance in pipeline mode (default=1024)",
+                        dest="prefetch_memory", default=1024)
+    parser.add_argument("--render_workers", type=int,
+                        help="Number of processes rendering the figures while the tests continue, 0 renders them inline (default=1). Ignored with --workers",
+                        dest="render_workers", default=1)
+    parser.add_argument("--dpi", type=float,
+                        help="Resolution of the figures (default=figure resolution)",
+                        dest="dpi", default=None)
+    parser.add_argument("--png_compression", type=int, choices=range(10),
+                        help="zlib compression level of the figures, lower is faster (default=6)",
+                        dest="png_compression", default=None)
+    parser.add_argument("--reuse_figures", action=argparse.BooleanOptionalAction,
+                        help="Reuse the figure objects across files (default=False)",
+                        dest="reuse_figures", default=False)
+    parser.add_argument("--instrument", action=argparse.BooleanOptionalAction,
+                        help="Measure the time, memory and bytes read by each test and reader operation (default=True)",
+                        dest="instrument", default=True)
+    parser.add_argument("--performance_report", action=argparse.BooleanOptionalAction,
+                        help="Add the measurements as a Performance table to each file report, which is then no longer reproducible (default=False)",
+                        dest="performance_report", default=False)
+    parser.add_argument("--run_log", type=str,
+                        help="JSON-lines file where the measurements are appended (default=<output>/run_log.jsonl)",
+                        dest="run_log", default=None)
+    parser.add_argument("--profile", action=argparse.BooleanOptionalAction,
+                        help="Profile each test with cProfile, saving profile_<test>.prof in the output directory of each file (default=False)",
+                        dest="profile", default=False)
+    parser.add_argument("--decompress_workers", type=int,
+                        help=f"Number of threads decompressing tile-compressed (.fz) images (default={DEFAULT_WORKERS}, divided among the --workers processes)",
+                        dest="decompress_workers", default=None)
+    parser.add_argument("--stats_workers", type=int,
+                        help=f"Number of threads computing the statistics of the regions of each frame (default={DEFAULT_WORKERS}, divided among the --workers processes)",
+                        dest="stats_workers", default=None)
+    parser.add_argument("--decompressed_cache", type=str,
+                        help="Directory where uncompressed copies of tile-compressed files are written and reused in later runs (default=None, no copies)",
+                        dest="decompressed_cache", default=None)
+    parser.add_argument("--max_memory", type=float,
+                        help="Memory cap (MB) used by tests that stream large extensions (default=256)",
+                        dest="max_memory", default=256)
+    parser.add_argument("--product_cache", type=float,
+                        help="Memory budget (MB) of the products shared between the tests of a file (default=512)",
+                        dest="product_cache", default=512)
+    parser.add_argument("--full_resolution", action=argparse.BooleanOptionalAction,
+                        help="Plot images at full resolution instead of using downsampled previews (default=False)",
+                        dest="full_resolution", default=False)
+    parser.add_argument("--cache", action=argparse.BooleanOptionalAction,
+                        help="Reuse the results of tests already applied to unchanged files (default=True)",
+                        dest="cache", default=True)
+    parser.add_argument("--hash", action=argparse.BooleanOptionalAction,
+                        help="Identify unchanged files using a hash of their content besides their size and modification time (default=False)",
+                        dest="hash", default=False)
+    parser.add_argument("--trends", action=argparse.BooleanOptionalAction,
+                        help="Store the scalar metrics of every file and make the trend pages of each night and camera (default=True)",
+                        dest="trends", default=True)
+    parser.add_argument("--outlier_threshold", type=float,
+                        help=f"Deviation (robust sigma) from the night median above which a metric is flagged (default={DEFAULT_THRESHOLD})",
+                        dest="outlier_threshold", default=DEFAULT_THRESHOLD)
+    parser.add_argument("--rebuild_index", action=argparse.BooleanOptionalAction,
+                        help="Render the HTML pages of every night in the master index, not only those updated (default=False)",
+                        dest="rebuild_index", default=False)
     print("\n\n\nParsing input arguments")
     args = parser.parse_args()
 
-    if args.search_in:
+    if not args.file_path and args.catalog is None:
+        parser.error("provide the input files or a --catalog")
+    if args.pipeline and args.workers is not None and args.workers > 1:
+        parser.error("--pipeline runs in a single process, it can not be "
+                     "combined with --workers")
+    if args.watch:
+        for path in args.file_path:
+            if not os.path.isdir(path):
+                raise NotADirectoryError(f"{path} is not a directory")
+    elif args.catalog is not None:
+        with HeaderCatalog(args.catalog) as catalog:
+            if args.file_path:
+                print(f"Updating the header catalog {args.catalog}")
+                catalog.update(args.file_path)
+            print(f"Selecting files from the catalog: {args.select}")
+            args.file_path = catalog.select(args.select)
+        if not args.file_path:
+            print("No file fulfils the selection")
+            raise SystemExit(0)
+    elif args.search_in:
         if len(args.file_path) != 1:
             raise NotImplementedError("Provide only one directory")
         from glob import glob
@@ -67,60 +623,92 @@ if __name__ == "__main__":
     n_files = len(args.file_path)
     n_qc_test = len(args.qctest)
 
-    print(f"Number of input files: {n_files}",
+    print(f"Number of input {'directories' if args.watch else 'files'}: {n_files}",
           f"\nSurvey: {args.survey}",
           f"\nNumber of QC tests: {n_qc_test}",
           f"\nOutput directory: {args.output}")
     makedir(args.output, overwrite=args.overwrite)
 
-    print(f"Checking survey module: {args.survey}")
-    survey_in = hasattr(qc, args.survey)
-    if not survey_in:
-        raise ImportError("Input survey module not found")
-    else:
-        survey_module = getattr(qc, args.survey)
-        print("Survey module found")
-    
-    print(f"Checking QC data level: {args.qcmode}")
-    data_lvl_module = hasattr(survey_module, f"{args.qcmode}_qc")
-    if not data_lvl_module:
-        raise ImportError(f"Input QC {args.qcmode} module not found")
-    else:
-        module = getattr(survey_module, f"{args.qcmode}_qc")
-        print(f"QC {args.qcmode} module found")
+    # Identifier of the run in the run log
+    args.run_id = time.strftime("%Y%m%dT%H%M%S") + f"_{os.getpid()}"
+    if args.run_log is None:
+        args.run_log = os.path.join(args.output, "run_log.jsonl")
+    if args.profile or args.performance_report:
+        args.instrument = True
+    # The cores are shared by the processes of the pool
+    threads = max(min(DEFAULT_WORKERS,
+                      (os.cpu_count() or 1) // max(args.workers, 1)), 1)
+    if args.decompress_workers is None:
+        args.decompress_workers = threads
+    if args.stats_workers is None:
+        args.stats_workers = threads
 
-    # Prepare HTML master page
+    print(f"Checking QC tests of survey {args.survey} and level {args.qcmode}")
+    qc_class = get_qc_class(args.survey, args.qcmode)
+    plan = plan_tests(qc_class, args.qctest)
+    print("Execution order of the QC tests: "
+          + ", ".join(test for test, _ in plan))
+    if only_header_tests(qc_class, args.qctest):
+        print("All QC tests only require headers, data will not be loaded")
+
+    # Prepare HTML master index
+    callback = None
     if args.html:
+        master_index = MasterIndex(args.output)
         page_path = is_html_page(args.output)
-        if page_path is None or args.overwrite:
-            print("Initialising master HTML page")
-            master_page = HTMLPage(title=f"QC reports")
-        else:
-            print("Using existing HTML report")
-            master_page = HTMLPage(path=page_path)
+        if master_index.is_empty() and page_path is not None:
+            print("Including the reports of the existing HTML master page")
+            master_index.import_page(HTMLPage(path=page_path))
 
-    # Run the tests
-    for i, path in enumerate(args.file_path):
-        print(f"\nChecking {args.qcmode} {i+1} out of {len(args.file_path)}\n")
-        outdir = os.path.join(args.output, os.path.basename(path + f"_{i}"))
-        makedir(outdir, overwrite=args.overwrite)
+        trend_store = None
+        if args.trends:
+            trend_store = TrendStore(args.output,
+                                     threshold=args.outlier_threshold)
 
-        qc_tests = module.QC_tests(path, output=outdir,
-                                   html=args.html)
-        for test in args.qctest:
-            print(f"\nApplying **{test}**\n")
-            test_method = getattr(qc_tests, test)
-            output = test_method()
-            print("...Check completed...\n")
-        qc_tests.data_container.close_hdul()
-        if args.html:
-            qc_tests.html_page.save_page(
-                os.path.join(outdir, f"index_{args.qcmode}.html"))
-            master_page.add_reference(
-                os.path.join(os.path.basename(outdir), f"index_{args.qcmode}.html"),
-                            qc_tests.html_page.title)
+        def render_trends(nights, history=True):
+            if trend_store is None:
+                return
+            for shard, href, name, night in trend_store.render_nights(
+                    nights, history=history):
+                master_index.add(shard, href, name, night)
+
+        # Night of the last file published in watch mode
+        watch_night = [None]
+
+        def callback(index, reference):
+            # Every completed file is immediately saved in the index
+            if reference is not None:
+                master_index.add(args.file_path[index], *reference)
+
+        def publish(path, reference):
+            # Watch mode: the pages of the night are rendered for each file,
+            # and the long-term trends when the night changes
+            if reference is not None:
+                night = reference[2]
+                if (trend_store is not None
+                        and watch_night[0] not in (None, night)):
+                    trend_store.render_histories()
+                watch_night[0] = night
+                master_index.add(path, *reference)
+                render_trends([night], history=False)
+                master_index.render()
+
+    # Run the tests
+    if args.watch:
+        run_qc_watch(args, callback=publish if args.html else None)
+    else:
+        run_qc_files(args, callback=callback)
+    close_plot_renderer()
     if args.html:
-        master_page.save_page(os.path.join(args.output, "index.html"))
+        if args.rebuild_index:
+            render_trends(master_index.nights())
+            master_index.render(master_index.nights())
+        else:
+            render_trends(master_index.updated_nights)
+            master_index.render()
+        if trend_store is not None:
+            # Long-term trends left pending in watch mode
+            trend_store.render_histories()
 
     if len(os.listdir(args.output)) == 0:
         print("No product was made, removing output directory")
@@ -0,0 +1,150 @@
+"""
+Registry of QC test classes and declarations of the data read by each test.
+
+QC test classes are registered per survey and data level with
+:func:`register_qc_class`, and their test methods declare the HDUs (data
+and headers) they read and the derived products they produce with the
+:func:`qc_test` decorator. :func:`plan_tests` uses these declarations to
+order the requested tests so that every extension is read once, and to
+release its data as soon as its last consumer has finished.
+"""
+
+import inspect
+
+# QC test classes of each (survey, data level)
+QC_CLASSES = {}
+
+
+class QCTestSpec(object):
+    """Declaration of the data used by a QC test.
+
+    Parameters
+    ----------
+    name : str
+        Name of the test method.
+    hdus : tuple or None
+        Indices of the HDUs whose data are read. None means unknown, i.e.
+        the test may read any extension.
+    headers : tuple
+        Indices of the HDUs whose headers are read.
+    products : tuple
+        Names of the derived products computed (see ``ReaderBase.memoize``).
+    requires : tuple
+        Names of the tests that must run before this one.
+    rules : str, optional
+        Path to the rules file of header tests.
+    """
+    def __init__(self, name, hdus=(), headers=(0,), products=(),
+                 requires=(), rules=None):
+        self.name = name
+        self.hdus = None if hdus is None else tuple(hdus)
+        self.headers = tuple(headers)
+        self.products = tuple(products)
+        self.requires = tuple(requires)
+        self.rules = rules
+
+    @property
+    def header_only(self):
+        return self.hdus is not None and len(self.hdus) == 0
+
+    def __repr__(self):
+        return (f"QCTestSpec({self.name}, hdus={self.hdus}, "
+                f"headers={self.headers}, products={self.products})")
+
+
+def qc_test(hdus=(), headers=(0,), products=(), requires=(), rules=None):
+    """Decorator declaring the data read by a QC test method."""
+    def decorator(func):
+        func.qc_spec = QCTestSpec(func.__name__, hdus=hdus, headers=headers,
+                                  products=products, requires=requires,
+                                  rules=rules)
+        return func
+    return decorator
+
+
+def register_qc_class(survey, data_level):
+    """Class decorator registering the QC tests of a survey and data level."""
+    def decorator(cls):
+        QC_CLASSES[(survey, data_level)] = cls
+        return cls
+    return decorator
+
+
+def get_qc_class(survey, data_level):
+    if (survey, data_level) not in QC_CLASSES:
+        raise ImportError(
+            f"No QC tests registered for survey {survey} and level {data_level}")
+    return QC_CLASSES[(survey, data_level)]
+
+
+def get_test_specs(qc_class):
+    """Declared QC tests of a class."""
+    return {name: member.qc_spec
+            for name, member in inspect.getmembers(qc_class)
+            if hasattr(member, "qc_spec")}
+
+
+def get_test_spec(qc_class, test):
+    """Declaration of a test. Undeclared tests may read any extension."""
+    method = getattr(qc_class, test, None)
+    if method is None:
+        raise AttributeError(f"{qc_class.__name__} has no test {test}")
+    return getattr(method, "qc_spec", QCTestSpec(test, hdus=None))
+
+
+def only_header_tests(qc_class, tests):
+    """Check whether all the tests only read headers."""
+    return all(get_test_spec(qc_class, test).header_only for test in tests)
+
+
+def plan_tests(qc_class, tests):
+    """Order a list of tests and decide when to release each extension.
+
+    Tests are sorted by the first HDU whose data they read (header-only
+    tests first), keeping the input order otherwise and running required
+    tests first, so that the consumers of each extension are consecutive.
+
+    Returns
+    -------
+    plan : list
+        ``(test, release)`` pairs, where ``release`` lists the HDUs whose
+        data and derived products are no longer needed after the test.
+    """
+    specs = [get_test_spec(qc_class, test) for test in tests]
+
+    def priority(position):
+        hdus = specs[position].hdus
+        if hdus is None:
+            # Unknown data, run last
+            return (float("inf"), position)
+        return (min(hdus, default=-1), position)
+
+    pending = sorted(range(len(specs)), key=priority)
+    ordered = []
+    while pending:
+        for position in pending:
+            unmet = [req for req in specs[position].requires
+                     if req in tests and req not in
+                     [specs[p].name for p in ordered]]
+            if not unmet:
+                break
+        else:
+            raise ValueError(f"Circular requirements among tests {tests}")
+        pending.remove(position)
+        ordered.append(position)
+
+    # Last consumer of each extension
+    last_use = {}
+    unknown = False
+    for step, position in enumerate(ordered):
+        if specs[position].hdus is None:
+            unknown = True
+            continue
+        for hdu in specs[position].hdus:
+            last_use[hdu] = step
+    plan = []
+    for step, position in enumerate(ordered):
+        release = [] if unknown else sorted(
+            hdu for hdu, last in last_use.items() if last == step)
+        plan.append((specs[position].name, release))
+    return plan
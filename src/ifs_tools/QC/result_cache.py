@@ -0,0 +1,141 @@
+"""
+Persistent cache of QC results used to skip unchanged (file, test) pairs.
+
+Each output directory of a file stores a small JSON file with the identity
+of the input file (size, modification time and, optionally, a content hash)
+and, for every test already run, the hash of its configuration, the products
+written to disk, the sections added to the HTML report and the metrics
+recorded for the night trends. The cache is saved
+after every test so that interrupted runs resume where they stopped.
+"""
+
+from glob import glob
+import hashlib
+import json
+import os
+
+CACHE_FILENAME = ".qc_cache.json"
+# Increased whenever the format of the entries changes
+CACHE_VERSION = 1
+
+
+def file_hash(path, chunk_size=2**20):
+    """SHA-256 hash of the content of a file."""
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def file_identity(path, content_hash=False):
+    """Properties used to decide whether a file has changed."""
+    stat = os.stat(path)
+    identity = {"path": os.path.abspath(path), "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns}
+    if content_hash:
+        identity["sha256"] = file_hash(path)
+    return identity
+
+
+def output_name(path):
+    """Name of the output directory of an input file.
+
+    It only depends on the absolute path of the file, so the products and
+    cache of a file are found again whatever the other input files.
+    """
+    digest = hashlib.sha1(os.path.abspath(path).encode()).hexdigest()[:10]
+    return f"{os.path.basename(path)}_{digest}"
+
+
+def config_hash(module, test, options=None):
+    """Hash of the configuration of a QC test.
+
+    It includes the name of the QC module and the test, the content of the
+    module qc_params files and the run options that change the products
+    (``options``, a JSON-serializable dictionary).
+    """
+    sha = hashlib.sha256(f"{module.__name__}.{test}".encode())
+    sha.update(json.dumps(options or {}, sort_keys=True).encode())
+    params_dir = os.path.join(os.path.dirname(module.__file__), "qc_params")
+    for path in sorted(glob(os.path.join(params_dir, "*.yml"))):
+        sha.update(os.path.basename(path).encode())
+        with open(path, "rb") as f:
+            sha.update(f.read())
+    return sha.hexdigest()
+
+
+class ResultCache(object):
+    """Cache of the QC results of a single file.
+
+    Parameters
+    ----------
+    output_dir : str
+        Directory that stores the products of the file.
+    path : str
+        Path to the input file.
+    content_hash : bool, optional
+        If True, the file identity also includes a hash of its content.
+    """
+    def __init__(self, output_dir, path, content_hash=False):
+        self.output_dir = output_dir
+        self.cache_path = os.path.join(output_dir, CACHE_FILENAME)
+        self.identity = file_identity(path, content_hash=content_hash)
+        self.entries = {}
+        if os.path.isfile(self.cache_path):
+            try:
+                with open(self.cache_path, "r") as f:
+                    content = json.load(f)
+            except (OSError, ValueError):
+                print(f"[WARNING] Ignoring corrupted cache {self.cache_path}")
+                content = {}
+            if (content.get("version") == CACHE_VERSION
+                    and content.get("identity") == self.identity):
+                self.entries = content.get("entries", {})
+            elif content:
+                print("Input file or cache format changed, evicting cached results")
+
+    def get(self, test, config):
+        """Return the cached entry of a test, or None if it is not valid."""
+        entry = self.entries.get(test)
+        if entry is None:
+            return None
+        valid = entry["config"] == config and all(
+            os.path.isfile(os.path.join(self.output_dir, product))
+            for product in entry["products"])
+        if not valid:
+            self.evict(test)
+            return None
+        return entry
+
+    def put(self, test, config, products=None, sections=(), metrics=None):
+        """Store the results of a test and save the cache."""
+        if products is None:
+            products = []
+        elif isinstance(products, str):
+            products = [products]
+        self.entries[test] = {
+            "config": config,
+            "products": [os.path.relpath(p, self.output_dir)
+                         for p in products],
+            "sections": list(sections),
+            "metrics": dict(metrics or {})}
+        self.save()
+
+    def evict(self, test):
+        if self.entries.pop(test, None) is not None:
+            self.save()
+
+    def evict_products(self, products):
+        """Evict the tests that made any of the given products."""
+        products = {os.path.relpath(p, self.output_dir) for p in products}
+        for test, entry in list(self.entries.items()):
+            if products.intersection(entry["products"]):
+                self.evict(test)
+
+    def save(self):
+        tmp_path = self.cache_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"version": CACHE_VERSION, "identity": self.identity,
+                       "entries": self.entries}, f)
+        os.replace(tmp_path, self.cache_path)
@@ -0,0 +1,401 @@
+"""
+Night-level trends of the scalar metrics of the QC.
+
+QC tests record scalar metrics (``QCtestBase.record_metric``), e.g. numeric
+header values such as CCDTEMP, AIRMASS or SEEINGB/SEEINGE and the mean and
+sigma of the frames. Every file appends a row to the columnar shard of its
+night and camera (``trends/<night>/<camera>/``), where each metric is a
+binary column of float64 values (``<metric>.f8``), ``time.f8`` holds the
+start of the exposures (Unix time) and ``files.jsonl`` the paths of the
+files. Appending a file only writes a few bytes to each column, and a night
+is read without touching the rest of the history.
+
+For every night and camera, the metrics are plotted against time and values
+more than ``threshold`` robust standard deviations (median absolute
+deviation) away from the median of the night are flagged. The median and
+deviation of each night are written to the ``summary.json`` file of its
+shard, and the summaries of every night of a camera give its long-term
+trends, rendered once per batch of nights.
+"""
+
+import contextlib
+from datetime import datetime, timezone
+from glob import glob
+import json
+import os
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows, appends are not locked
+    fcntl = None
+
+from ifs_tools.html_tools.master_index import get_night
+from ifs_tools.html_tools.utils import HTMLPage
+from ifs_tools.plot_tools.renderer import render_plot
+
+TRENDS_DIR = "trends"
+FILES_NAME = "files.jsonl"
+SUMMARY_NAME = "summary.json"
+TIME_COLUMN = "time"
+COLUMN_DTYPE = np.dtype("<f8")
+COLUMN_SUFFIX = ".f8"
+UNKNOWN_CAMERA = "unknown"
+# Header keywords recorded as metrics by the header tests
+TREND_KEYWORDS = ("CCDTEMP", "AIRMASS", "ZDSTART", "ZDEND", "SEEINGB",
+                  "SEEINGE")
+# Robust deviation (in sigma) above which a value is flagged
+DEFAULT_THRESHOLD = 3.5
+
+
+def observation_time(date_obs, ut=None):
+    """Unix time of a DATE-OBS value (completed with UT if it is a date)."""
+    if not date_obs:
+        return np.nan
+    date_obs = str(date_obs).strip()
+    if "T" not in date_obs and ut:
+        date_obs = f"{date_obs}T{str(ut).strip()}"
+    try:
+        date = datetime.fromisoformat(date_obs)
+    except ValueError:
+        return np.nan
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return date.timestamp()
+
+
+def robust_deviation(values):
+    """Median, robust sigma (1.4826 MAD) and deviation of every value.
+
+    Returns
+    -------
+    median, sigma : float
+    deviation : np.ndarray
+        Absolute distance to the median in units of sigma (infinite for
+        values different from the median when sigma is 0, NaN for NaNs).
+    """
+    finite = np.isfinite(values)
+    if not finite.any():
+        return np.nan, np.nan, np.full(values.shape, np.nan)
+    median = np.median(values[finite])
+    sigma = 1.4826 * np.median(np.abs(values[finite] - median))
+    distance = np.abs(values - median)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        if sigma > 0:
+            deviation = distance / sigma
+        else:
+            deviation = np.where(distance > 0, np.inf, 0.)
+    deviation[~finite] = np.nan
+    return median, sigma, deviation
+
+
+@contextlib.contextmanager
+def locked(path):
+    """Exclusive lock on a file, so that several processes can append."""
+    with open(path, "a") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class TrendStore(object):
+    """Append-only columnar store of the QC metrics of an output directory.
+
+    Parameters
+    ----------
+    output_dir : str
+        Output directory of the QC runs.
+    threshold : float, optional
+        Deviation (robust sigma) above which a value is flagged as outlier.
+    """
+    def __init__(self, output_dir, threshold=DEFAULT_THRESHOLD):
+        self.output_dir = output_dir
+        self.trends_dir = os.path.join(output_dir, TRENDS_DIR)
+        self.threshold = threshold
+        # Cameras whose long-term trends changed since they were rendered
+        self.pending_history = set()
+
+    def shard_dir(self, night, camera):
+        return os.path.join(self.trends_dir, night, camera)
+
+    def cameras(self, night):
+        return sorted(os.path.basename(os.path.dirname(path)) for path in
+                      glob(os.path.join(self.trends_dir, night, "*",
+                                        FILES_NAME)))
+
+    def column_path(self, shard, name):
+        return os.path.join(shard, name.replace(os.sep, "_") + COLUMN_SUFFIX)
+
+    def append(self, file_path, metrics, date_obs=None, ut=None,
+               camera=None):
+        """Append the metrics of a file to the shard of its night and camera.
+
+        Parameters
+        ----------
+        file_path : str
+            Path to the file.
+        metrics : dict
+            Value of each metric.
+        date_obs, ut : str, optional
+            DATE-OBS and UT keywords of the file.
+        camera : str, optional
+            Camera (or detector) of the file.
+
+        Returns
+        -------
+        night, camera : str
+        """
+        night = get_night(date_obs, ut)
+        camera = str(camera).strip() if camera else UNKNOWN_CAMERA
+        shard = self.shard_dir(night, camera)
+        os.makedirs(shard, exist_ok=True)
+        row = {name: float(value) for name, value in metrics.items()}
+        row[TIME_COLUMN] = observation_time(date_obs, ut)
+        with locked(os.path.join(shard, ".lock")):
+            n_rows = self.n_rows(shard)
+            names = set(row).union(
+                os.path.basename(path)[:-len(COLUMN_SUFFIX)] for path in
+                glob(os.path.join(shard, "*" + COLUMN_SUFFIX)))
+            for name in names:
+                path = self.column_path(shard, name)
+                with open(path, "ab") as f:
+                    # Columns of new metrics (or left incomplete by an
+                    # interrupted append) are padded with NaNs
+                    size = f.tell() // COLUMN_DTYPE.itemsize
+                    if size > n_rows:
+                        f.truncate(n_rows * COLUMN_DTYPE.itemsize)
+                        f.seek(0, os.SEEK_END)
+                    values = [np.nan] * (n_rows - min(size, n_rows))
+                    values.append(row.get(name, np.nan))
+                    f.write(np.asarray(values, dtype=COLUMN_DTYPE).tobytes())
+            # The row is complete once the file is listed
+            with open(os.path.join(shard, FILES_NAME), "a") as f:
+                f.write(json.dumps({"file": os.path.abspath(file_path)})
+                        + "\n")
+        return night, camera
+
+    def n_rows(self, shard):
+        """Number of complete rows of a shard."""
+        path = os.path.join(shard, FILES_NAME)
+        if not os.path.isfile(path):
+            return 0
+        with open(path, "r") as f:
+            return sum(1 for line in f if line.strip())
+
+    def load(self, night, camera):
+        """Metrics of a night and camera, keeping the latest row of each file.
+
+        Shards containing several rows of the same file are compacted.
+
+        Returns
+        -------
+        files : list of str
+        columns : dict
+            Array of values of each column (including ``time``), sorted by
+            time.
+        """
+        shard = self.shard_dir(night, camera)
+        with locked(os.path.join(shard, ".lock")):
+            with open(os.path.join(shard, FILES_NAME), "r") as f:
+                files = [json.loads(line)["file"] for line in f
+                         if line.strip()]
+            # Files processed several times
+            latest = {path: i for i, path in enumerate(files)}
+            rows = np.array(sorted(latest.values()), dtype=int)
+            columns = {}
+            for path in glob(os.path.join(shard, "*" + COLUMN_SUFFIX)):
+                values = np.fromfile(path, dtype=COLUMN_DTYPE)
+                if values.size < len(files):
+                    values = np.concatenate([values, np.full(
+                        len(files) - values.size, np.nan)])
+                columns[os.path.basename(path)[:-len(COLUMN_SUFFIX)]] = (
+                    values[rows])
+            n_lines = len(files)
+            files = [files[i] for i in rows]
+            if len(files) < n_lines:
+                self.compact(shard, files, columns)
+        order = np.argsort(columns[TIME_COLUMN], kind="stable")
+        return ([files[i] for i in order],
+                {name: values[order] for name, values in columns.items()})
+
+    def compact(self, shard, files, columns):
+        """Rewrite a shard with the given rows (the shard must be locked)."""
+        for name, values in columns.items():
+            path = self.column_path(shard, name)
+            values.astype(COLUMN_DTYPE).tofile(path + ".tmp")
+            os.replace(path + ".tmp", path)
+        path = os.path.join(shard, FILES_NAME)
+        with open(path + ".tmp", "w") as f:
+            f.writelines(json.dumps({"file": file}) + "\n" for file in files)
+        os.replace(path + ".tmp", path)
+
+    def flag_outliers(self, files, columns):
+        """Summary and outliers of each metric.
+
+        Returns
+        -------
+        summary : dict
+            ``(median, sigma, n_values)`` of each metric.
+        flags : dict
+            Boolean array of each metric, True for outliers.
+        outliers : list
+            ``(file, metric, value, deviation)`` of the flagged values.
+        """
+        summary, flags, outliers = {}, {}, []
+        for name, values in columns.items():
+            if name == TIME_COLUMN:
+                continue
+            median, sigma, deviation = robust_deviation(values)
+            flags[name] = deviation > self.threshold
+            summary[name] = (median, sigma, int(np.isfinite(values).sum()))
+            outliers.extend((files[i], name, values[i], deviation[i])
+                            for i in np.flatnonzero(flags[name]))
+        return summary, flags, outliers
+
+    def render(self, night, camera):
+        """Write the trend page of a night and camera.
+
+        The summary of the night is saved for the long-term trends of the
+        camera (see ``render_histories``).
+
+        Returns
+        -------
+        href : str
+            Path to the page relative to the output directory.
+        n_outliers : int
+        """
+        shard = self.shard_dir(night, camera)
+        files, columns = self.load(night, camera)
+        summary, flags, outliers = self.flag_outliers(files, columns)
+        metrics = sorted(summary)
+        page = HTMLPage(
+            title=f"QC trends of night {night} ({camera}), {len(files)} files")
+        page.add_reference(os.path.join("..", "..", f"history_{camera}.html"),
+                           f"Long-term trends of {camera}")
+        if metrics:
+            time = columns[TIME_COLUMN]
+            render_plot("metric_trends", os.path.join(shard, "trends.png"),
+                        (10, 2 * len(metrics)), dict(
+                            time=time,
+                            metrics=[(name, columns[name], flags[name])
+                                     for name in metrics],
+                            title=f"Night {night} ({camera})"),
+                        bbox_inches="tight")
+            page.add_plot_section("Trends", "trends.png")
+        page.add_table_section(
+            title=f"Outliers (deviation > {self.threshold} sigma)",
+            data=[["File", "Metric", "Value", "Deviation (sigma)"]] + [
+                [os.path.basename(path), name, f"{value:.4g}",
+                 f"{deviation:.1f}"]
+                for path, name, value, deviation in outliers])
+        page.add_table_section(
+            title="Summary",
+            data=[["Metric", "Median", "Robust sigma", "N"]] + [
+                [name, f"{summary[name][0]:.4g}", f"{summary[name][1]:.4g}",
+                 summary[name][2]] for name in metrics])
+        page.save_page(os.path.join(shard, "index_trends.html"))
+
+        summary_path = os.path.join(shard, SUMMARY_NAME)
+        with open(summary_path + ".tmp", "w") as f:
+            json.dump({"night": night, "n_files": len(files),
+                       "metrics": summary}, f)
+        os.replace(summary_path + ".tmp", summary_path)
+        self.pending_history.add(camera)
+        print(f"Trends of night {night} ({camera}): {len(files)} files, "
+              + f"{len(outliers)} outliers")
+        return (os.path.relpath(os.path.join(shard, "index_trends.html"),
+                                self.output_dir), len(outliers))
+
+    def load_history(self, camera):
+        """Summary of every night of a camera, sorted by night."""
+        history = []
+        for path in sorted(glob(os.path.join(self.trends_dir, "*", camera,
+                                             SUMMARY_NAME))):
+            with open(path, "r") as f:
+                history.append(json.load(f))
+        return history
+
+    def render_history(self, camera):
+        """Write the page with the nightly medians of a camera."""
+        history = [entry for entry in self.load_history(camera)
+                   if entry["night"].isdigit()]
+        metrics = sorted(set(name for entry in history
+                             for name in entry["metrics"]))
+        page = HTMLPage(title=f"Long-term QC trends ({camera})")
+        if history and metrics:
+            nights = np.array([np.datetime64(
+                f"{n[:4]}-{n[4:6]}-{n[6:]}") for n in
+                (entry["night"] for entry in history)])
+            render_plot(
+                "metric_history",
+                os.path.join(self.trends_dir, f"history_{camera}.png"),
+                (10, 2 * len(metrics)), dict(
+                    nights=nights,
+                    metrics=[(name, *[np.array(
+                        [entry["metrics"].get(name, [np.nan] * 2)[i]
+                         for entry in history], dtype=float)
+                        for i in (0, 1)]) for name in metrics],
+                    title=camera),
+                bbox_inches="tight")
+            page.add_plot_section("Nightly median and robust sigma",
+                                  f"history_{camera}.png")
+        for entry in history:
+            page.add_reference(
+                os.path.join(entry["night"], camera, "index_trends.html"),
+                f"Night {entry['night']} ({entry['n_files']} files)")
+        page.save_page(os.path.join(self.trends_dir,
+                                    f"history_{camera}.html"))
+
+    def render_histories(self):
+        """Write the long-term trends of the cameras with new summaries."""
+        for camera in sorted(self.pending_history):
+            self.render_history(camera)
+        self.pending_history.clear()
+
+    def render_nights(self, nights, history=True):
+        """Render every camera of the given nights.
+
+        If ``history`` is True, the long-term trends of the cameras are
+        rendered afterwards. Otherwise they are left pending.
+
+        Returns
+        -------
+        pages : list
+            ``(shard_dir, href, name, night)`` of each trend page.
+        """
+        pages = []
+        for night in sorted(nights):
+            for camera in self.cameras(night):
+                href, n_outliers = self.render(night, camera)
+                pages.append((self.shard_dir(night, camera), href,
+                              f"Trends of {camera} ({n_outliers} outliers)",
+                              night))
+        if history:
+            self.render_histories()
+        return pages
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(
+        description="Render the QC trends of an output directory")
+    parser.add_argument("output", type=str,
+                        help="Output directory of the QC runs")
+    parser.add_argument("--nights", type=str, nargs="+", default=None,
+                        help="Nights to render (default=all)")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help=f"Outlier threshold in robust sigma (default={DEFAULT_THRESHOLD})")
+    args = parser.parse_args()
+    store = TrendStore(args.output, threshold=args.threshold)
+    nights = args.nights
+    if nights is None:
+        nights = [os.path.basename(path) for path in
+                  glob(os.path.join(store.trends_dir, "*"))
+                  if os.path.isdir(path)]
+    store.render_nights(nights)
@@ -0,0 +1,188 @@
+"""
+Detection of new FITS files for the real-time QC (``qc_main --watch``).
+
+Directories are polled for files matching a pattern. A new file is only
+handed to the QC once its write is complete, i.e. when either
+
+- its FITS structure is complete (every header has its END card, the data
+  units declared by the headers are present and, if the primary header
+  provides NEXTEND, every extension is there) and its size did not change
+  since the previous poll, or
+- its size and modification time did not change for ``stable_time`` seconds
+  (e.g. compressed files whose structure cannot be checked cheaply).
+
+Only the directories whose modification time changed are listed again, so
+files are noticed when they are created or renamed into a directory, which
+is how files are normally delivered. Files overwritten in place are not
+detected.
+"""
+
+import fnmatch
+import os
+import signal
+import time
+
+from ifs_tools.data_readers.fits_headers import (data_size, open_fits_file,
+                                                 read_header)
+from ifs_tools.QC.registry import get_qc_class
+
+
+def warm_up_worker(survey, qcmode):
+    """Initializer of the QC worker processes.
+
+    Loads the QC tests of the survey and the lazily imported parts of
+    astropy and matplotlib, and draws an empty figure (font cache), so the
+    first frame does not pay for them. Ctrl+C is left to the main process,
+    which stops the workers.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    import ifs_tools.QC  # noqa: F401, registers the QC tests
+    import astropy.wcs  # noqa: F401
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    get_qc_class(survey, qcmode)
+    fig = Figure(figsize=(1, 1))
+    FigureCanvasAgg(fig)
+    fig.add_subplot(111).set_title("warm up")
+    fig.canvas.draw()
+
+
+def fits_complete(path):
+    """Check whether all the HDUs of a FITS file have been written.
+
+    Returns
+    -------
+    complete : bool or None
+        None if the structure of the file cannot be checked (gzip-compressed
+        files).
+    """
+    if str(path).endswith(".gz"):
+        return None
+    try:
+        size = os.path.getsize(path)
+        n_hdus, n_expected = 0, 1
+        with open_fits_file(path) as f:
+            while True:
+                header = read_header(f)
+                if header is None:
+                    break
+                if n_hdus == 0:
+                    n_expected += header.get("NEXTEND", 0)
+                n_hdus += 1
+                end = f.tell() + data_size(header)
+                if end > size:
+                    return False
+                f.seek(end)
+    except Exception:
+        # Truncated or partially written header
+        return False
+    return n_hdus >= n_expected
+
+
+class DirectoryWatcher(object):
+    """Poll a set of directories for new (or updated) complete files.
+
+    Parameters
+    ----------
+    paths : list of str
+        Directories to watch (including their subdirectories).
+    pattern : str, optional
+        Pattern of the file names.
+    stable_time : float, optional
+        Time (s) after which a file whose size does not change is considered
+        complete even if its FITS structure could not be checked.
+    skip_existing : bool, optional
+        If True, the files present when the watcher is created are ignored.
+    """
+    def __init__(self, paths, pattern="*.fit*", stable_time=5.0,
+                 skip_existing=False):
+        self.paths = [os.path.abspath(path) for path in paths]
+        self.pattern = pattern
+        self.stable_time = stable_time
+        # Modification time of each directory, only modified ones are listed
+        self.dir_mtimes = {}
+        self.subdirs = {}
+        # Files being written: path -> [size, mtime, arrival, last change]
+        self.pending = {}
+        # Files already handed to the QC: path -> (size, mtime)
+        self.done = {}
+        if skip_existing:
+            for path, stat in self.scan():
+                self.done[path] = (stat.st_size, stat.st_mtime)
+
+    def _scan_dir(self, path, found):
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            self.dir_mtimes.pop(path, None)
+            self.subdirs.pop(path, None)
+            return
+        if self.dir_mtimes.get(path) != mtime:
+            self.dir_mtimes[path] = mtime
+            self.subdirs[path] = []
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    if entry.is_dir():
+                        self.subdirs[path].append(entry.path)
+                    elif (entry.is_file()
+                          and fnmatch.fnmatch(entry.name, self.pattern)):
+                        found.append(entry.path)
+        for subdir in self.subdirs[path]:
+            self._scan_dir(subdir, found)
+
+    def scan(self):
+        """Files of the directories whose content changed since last scan.
+
+        Returns
+        -------
+        files : list
+            List of ``(path, os.stat_result)``.
+        """
+        found = []
+        for path in self.paths:
+            self._scan_dir(path, found)
+        files = []
+        for path in found:
+            try:
+                files.append((path, os.stat(path)))
+            except OSError:
+                # Removed or renamed meanwhile
+                pass
+        return files
+
+    def poll(self):
+        """Look for new files and return those whose write is complete.
+
+        Returns
+        -------
+        ready : list
+            List of ``(path, arrival)``, where ``arrival`` is the time at
+            which the file was detected (at most one poll interval after it
+            appeared).
+        """
+        now = time.time()
+        for path, stat in self.scan():
+            if (path not in self.pending and self.done.get(path)
+                    != (stat.st_size, stat.st_mtime)):
+                self.pending[path] = [-1, -1, now, now]
+
+        ready = []
+        for path, state in list(self.pending.items()):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                del self.pending[path]
+                continue
+            size, mtime, arrival, last_change = state
+            unchanged = (stat.st_size, stat.st_mtime) == (size, mtime)
+            if not unchanged:
+                state[:2] = stat.st_size, stat.st_mtime
+                state[3] = now
+                # Wait at least one poll with the same size
+                continue
+            if (fits_complete(path)
+                    or now - last_change >= self.stable_time):
+                del self.pending[path]
+                self.done[path] = (stat.st_size, stat.st_mtime)
+                ready.append((path, arrival))
+        return ready
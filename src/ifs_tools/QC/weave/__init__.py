@@ -1,3 +1,3 @@
-from ifs_tools.QC.weave import cube_qc, raw_qc
+from ifs_tools.QC.weave import cube_qc, prod_qc, raw_qc
 
-__all__ = [cube_qc, raw_qc]
\ No newline at end of file
+__all__ = [cube_qc, prod_qc, raw_qc]
\ No newline at end of file
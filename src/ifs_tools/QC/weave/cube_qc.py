@@ -6,101 +6,122 @@ import os
 import shutil
 
 # Basic
-from matplotlib import pyplot as plt
-from matplotlib.colors import LogNorm
-
 import numpy as np
 
 from astropy.wcs import WCS
 
 # WEAVE
 from ifs_tools.QC.QCtestBase import QCtestBase
+from ifs_tools.QC.header_rules import load_rule_set
+from ifs_tools.QC.registry import qc_test, register_qc_class
 from ifs_tools.data_readers.weave.weave_cube import WEAVECube
+from ifs_tools.stats_tools.cube_stats import cube_spaxel_statistics
 
 file_dir = os.path.dirname(__file__)
 
+@register_qc_class("weave", "cube")
 class QC_tests(QCtestBase):
     """
     Class containing tests.
     """
-    def __init__(self, path_to_cube, output=None, **kwargs):
-        self.data_container = WEAVECube(path_to_cube, load_hdul=True)
+    def __init__(self, path_to_cube, output=None, header_only=False, **kwargs):
+        self.data_container = WEAVECube(path_to_cube, load_hdul=True,
+                                        header_only=header_only,
+                                        cache_bytes=kwargs.get("cache_bytes"),
+                                        recorder=kwargs.get("recorder"),
+                                        decompress_workers=kwargs.get(
+                                            "decompress_workers"),
+                                        decompressed_cache=kwargs.get(
+                                            "decompressed_cache"))
         super().__init__(data_level="cube",
-                         name=self.data_container.hdul.filename(),
+                         name=self.data_container.path,
                          survey="weave",
                          **kwargs)
         self.output = output
-        
+
+    def get_spaxel_statistics(self):
+        """Per-spaxel median, mean, NaN fraction and S/N of the cube.
+
+        The statistics are computed once, in a single pass over the flux and
+        IVAR extensions using at most ``self.max_memory`` bytes.
+        """
+        return self.data_container.memoize(
+            ("spaxel_statistics", 1), cube_spaxel_statistics,
+            self.data_container.get_section(1),
+            self.data_container.get_section(2),
+            max_memory=self.max_memory)
 
     def load_yml_file(self, file_path):
         with open(file_path, 'r') as file:
             content = yaml.safe_load(file)
         return content
 
-    def check_detector(self):
-        detector_kw = self.load_yml_file(os.path.join(file_dir, "qc_params", "check_detector.yml"))
-        checks = self.check_header(detector_kw)
+    @qc_test(rules=os.path.join(file_dir, "qc_params", "check_detector.yml"))
+    def check_detector(self, checks=None):
+        if checks is None:
+            checks = self.check_header(
+                load_rule_set(self.check_detector.qc_spec.rules))
+        self.record_header_metrics()
         if self.html:
             self.html_page.add_table_section(title="Detector checks",
                                              data=checks)
 
-    def check_observation(self):
-        observation_kw = self.load_yml_file(os.path.join(file_dir, "qc_params", "check_observation.yml"))
-        checks = self.check_header(observation_kw)
+    @qc_test(rules=os.path.join(file_dir, "qc_params",
+                                "check_observation.yml"))
+    def check_observation(self, checks=None):
+        if checks is None:
+            checks = self.check_header(
+                load_rule_set(self.check_observation.qc_spec.rules))
+        self.record_header_metrics()
         if self.html:
             self.html_page.add_table_section(title="Observation checks",
                                              data=checks)
     
+    @qc_test(hdus=(6,), headers=(6,), products=("wcs", "preview_pyramid"))
     def check_white_image(self, metadata=["CHIPNAME", "CRVAL1", "CRVAL2"]):
-        white_image = self.data_container.hdul[6].data
-        wcs = WCS(self.data_container.hdul[6].header)
+        white_image, factor = self.get_image_preview(6)
+        wcs = self.data_container.get_wcs(6)
+        if factor > 1:
+            wcs = wcs.celestial.slice((slice(None, None, factor),
+                                       slice(None, None, factor)))
         
         t = ""
         for key in metadata:
-            t += f"{key}: {self.data_container.hdul[6].header[key]}" + "\n"
-        fig = plt.figure(figsize=(10, 10))
-        ax = fig.add_subplot(111, projection=wcs.celestial)
-        ax.set_title(t)
-        mappable = ax.imshow(white_image, cmap='Spectral', norm=LogNorm())
-        plt.colorbar(mappable, ax=ax, label=self.data_container.hdul[6].header.get(
-            'BUNIT', "Unknown BUNIT"))
-        output = os.path.join(self.output, "white_image.png")
-        fig.savefig(output)
-        plt.close(fig)
+            t += f"{key}: {self.data_container.get_header(6)[key]}" + "\n"
+        output = self.save_plot(
+            "white_image", "white_image.png", figsize=(10, 10),
+            image=white_image, wcs=wcs.celestial, title=t,
+            label=self.data_container.get_header(6).get(
+                'BUNIT', "Unknown BUNIT"))
         if self.html:
             self.html_page.add_plot_section("White image", os.path.basename(output))
         return output
 
 
+    @qc_test(hdus=(1, 2), headers=(1,),
+             products=("spaxel_statistics", "wcs", "wavelength"))
     def check_pct_spectra(self, percent=[50, 60, 70, 80, 90, 95]):
-        median_cube = np.nanmedian(self.data_container.hdul[1].data, axis=0)
+        stats = self.get_spaxel_statistics()
+        self.record_metric("median_flux", np.nanmedian(stats["median"]))
+        if "snr" in stats:
+            self.record_metric("median_snr", np.nanmedian(stats["snr"]))
+        median_cube = stats["median"].copy()
         median_cube[~np.isfinite(median_cube)] = 0
         # Get the wavelength array
-        wcs = WCS(self.data_container.hdul[1].header)
-        wavelength = wcs.spectral.array_index_to_world_values(
-            np.arange(0, self.data_container.hdul[1].header['NAXIS3'])
-            ) * 1e10  # to AA
+        wavelength = self.data_container.get_wavelength(1) * 1e10  # to AA
         # Rank spaxels
         rank = np.argsort(median_cube.flatten())
 
-        fig, axs = plt.subplots(nrows=len(percent), ncols=1, sharex=True,
-                                figsize=(12, 3 * len(percent)))
-        for pct, ax in zip(percent, axs):
+        spectra = []
+        for pct in percent:
             pos = rank[int(pct * rank.size / 100)]
             cube_pos = np.unravel_index(pos, shape=median_cube.shape)
-            spectra = self.data_container.hdul[1].data[:, cube_pos[0], cube_pos[1]]
-            ivar = self.data_container.hdul[2].data[:, cube_pos[0], cube_pos[1]]
-            ax.fill_between(wavelength, spectra - 1/ivar**0.5,
-                            spectra + 1/ivar**0.5, alpha=0.5, color='r')
-            ax.plot(wavelength, spectra, lw=0.7, color="k")
-            ax.axhline(np.nanmedian(spectra), c='k', alpha=0.3)
-            ax.set_ylabel(f"Flux [{pct}]", fontsize=8)
-            ax.annotate(f"Rank: {pct}", xy=(0.05, 0.95), xycoords='axes fraction',
-                        va='top', ha='left')
-        output = os.path.join(self.output, "pct_spectra.png")
-        fig.savefig(output)
-        plt.close(fig)
+            spectra.append((pct,
+                            self.data_container.read_spectrum(1, *cube_pos),
+                            self.data_container.read_spectrum(2, *cube_pos)))
+        output = self.save_plot("ranked_spectra", "pct_spectra.png",
+                                figsize=(12, 3 * len(percent)),
+                                wavelength=wavelength, spectra=spectra)
         if self.html:
             self.html_page.add_plot_section("Ranked spectra", os.path.basename(output))
         return output
-
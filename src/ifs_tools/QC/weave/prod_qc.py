@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+
+import fnmatch
+import os
+
+import yaml
+
+# WEAVE
+from ifs_tools.QC.QCtestBase import QCtestBase
+from ifs_tools.QC.header_rules import NO_RULE, load_rule_set
+from ifs_tools.QC.registry import qc_test, register_qc_class
+from ifs_tools.data_readers.weave.weave_prod import WEAVEProd
+from ifs_tools.stats_tools.table_stats import (ERROR_PERCENTILES, LOG_BINS,
+                                               table_column_statistics)
+
+file_dir = os.path.dirname(__file__)
+
+# Names of the error column of a column
+ERROR_PATTERNS = ("ERR_{}", "{}_ERR", "{}_ERROR", "{}ERR")
+
+
+@register_qc_class("weave", "prod")
+class QC_tests(QCtestBase):
+    """
+    Class containing tests.
+    """
+    def __init__(self, path_to_prod, output=None, header_only=False,
+                 **kwargs):
+        self.data_container = WEAVEProd(path_to_prod, load_hdul=True,
+                                        header_only=header_only,
+                                        cache_bytes=kwargs.get("cache_bytes"),
+                                        recorder=kwargs.get("recorder"),
+                                        decompress_workers=kwargs.get(
+                                            "decompress_workers"),
+                                        decompressed_cache=kwargs.get(
+                                            "decompressed_cache"))
+        super().__init__(data_level="prod",
+                         name=self.data_container.path,
+                         survey="weave",
+                         **kwargs)
+        self.output = output
+
+    @qc_test(rules=os.path.join(file_dir, "qc_params", "check_prod.yml"))
+    def check_primary(self, checks=None):
+        if checks is None:
+            checks = self.check_header(
+                load_rule_set(self.check_primary.qc_spec.rules))
+        self.record_header_metrics()
+        if self.html:
+            self.html_page.add_table_section(title="Primary Header checks",
+                                             data=checks)
+
+    def select_columns(self, hdul_idx, rules):
+        """Columns of a table matching the rules, and their error columns.
+
+        Returns
+        -------
+        ranges : dict
+            Valid range (or None) of each matched column.
+        errors : dict
+            Error column of the matched columns that have one.
+        """
+        extname = self.data_container.get_hdu(hdul_idx).name
+        names = self.data_container.get_column_names(hdul_idx)
+        upper = {name.upper(): name for name in names}
+        error_of = {}
+        for name in names:
+            for pattern in ERROR_PATTERNS:
+                error_name = upper.get(pattern.format(name.upper()))
+                if error_name is not None and error_name != name:
+                    error_of.setdefault(name, error_name)
+                    break
+        error_names = set(error_of.values())
+        ranges, errors = {}, {}
+        for name in names:
+            if name in error_names:
+                continue
+            for pattern, rule in rules.items():
+                if fnmatch.fnmatchcase(f"{extname}.{name}".upper(),
+                                       pattern.upper()):
+                    ranges[name] = (None if rule is None or rule == NO_RULE
+                                    else tuple(rule))
+                    if name in error_of:
+                        errors[name] = error_of[name]
+                    break
+        return ranges, errors
+
+    def get_column_statistics(self, hdul_idx, ranges, errors):
+        """Statistics of some columns of a table (see ``select_columns``).
+
+        Only these columns are read, in a single pass over the rows using at
+        most ``self.max_memory`` bytes.
+        """
+        columns = list(ranges) + list(errors.values())
+        chunks = (chunk for _, chunk in self.data_container.iter_row_chunks(
+            hdul_idx, columns, max_memory=self.max_memory))
+        return self.data_container.memoize(
+            ("column_statistics", hdul_idx), table_column_statistics, chunks,
+            ranges={k: v for k, v in ranges.items() if v is not None},
+            errors=errors)
+
+    @qc_test(hdus=None, products=("column_statistics",),
+             rules=os.path.join(file_dir, "qc_params", "check_columns.yml"))
+    def check_columns(self, max_nan_fraction=0.5, max_out_fraction=0.01):
+        with open(self.check_columns.qc_spec.rules, 'r') as file:
+            rules = yaml.safe_load(file) or {}
+        outputs = []
+        for hdul_idx in self.data_container.get_table_hdus():
+            extname = (self.data_container.get_hdu(hdul_idx).name
+                       or f"HDU{hdul_idx}")
+            ranges, errors = self.select_columns(hdul_idx, rules)
+            if not ranges:
+                continue
+            stats = self.get_column_statistics(hdul_idx, ranges, errors)
+            n_rows = self.data_container.get_n_rows(hdul_idx)
+            column_table = [["Column", "Unit", "NaN (%)", "Min", "Max",
+                             "Mean", "Valid range", "Out of range (%)",
+                             "Okay"]]
+            error_table = [["Column", "Error column", "Non-positive (%)",
+                            "NaN (%)", "Missing (%)"]
+                           + [f"P{q}" for q in ERROR_PERCENTILES]
+                           + ["Median S/N"]]
+            panels = []
+            for name, valid_range in ranges.items():
+                if name not in stats:
+                    # Non-numeric column
+                    continue
+                s = stats[name]
+                okay = bool(s["nan_fraction"] <= max_nan_fraction
+                            and (valid_range is None
+                                 or s["out_fraction"] <= max_out_fraction))
+                unit = self.data_container.get_column_format(
+                    hdul_idx, name)["tunit"]
+                column_table.append([
+                    name, unit, f"{100 * s['nan_fraction']:.2f}",
+                    f"{s['min']:.4g}", f"{s['max']:.4g}", f"{s['mean']:.4g}",
+                    "N/A" if valid_range is None else str(list(valid_range)),
+                    "N/A" if valid_range is None
+                    else f"{100 * s['out_fraction']:.2f}", okay])
+                self.record_metric(f"{extname}_{name}_nan_fraction",
+                                   s["nan_fraction"])
+                if name not in errors or errors[name] not in stats:
+                    continue
+                e = stats[errors[name]]
+                percentiles = e["error_percentiles"]
+                error_table.append([
+                    name, errors[name],
+                    f"{100 * e['nonpositive_fraction']:.2f}",
+                    f"{100 * e['nan_fraction']:.2f}",
+                    f"{100 * e['missing_fraction']:.2f}"]
+                    + [f"{percentiles[q]:.4g}" for q in ERROR_PERCENTILES]
+                    + [f"{e['median_snr']:.4g}"])
+                self.record_metric(f"{extname}_{errors[name]}_median",
+                                   percentiles[50])
+                panels.append(dict(name=name, error_name=errors[name],
+                                   error_hist=e["error_hist"],
+                                   snr_hist=e["snr_hist"]))
+
+            if self.html:
+                self.html_page.add_table_section(
+                    title=f"{extname} columns ({n_rows} rows)",
+                    data=column_table)
+                if len(error_table) > 1:
+                    self.html_page.add_table_section(
+                        title=f"{extname} errors", data=error_table)
+            if panels:
+                output = self.save_plot(
+                    "error_distributions", f"errors_{extname}.png",
+                    figsize=(12, 3 * len(panels)),
+                    savefig_kwargs=dict(bbox_inches='tight'),
+                    edges=LOG_BINS, panels=panels, title=extname)
+                if self.html:
+                    self.html_page.add_plot_section(
+                        f"{extname} error distributions",
+                        os.path.basename(output))
+                outputs.append(output)
+        return outputs
@@ -6,17 +6,18 @@ import os
 import shutil
 
 # Basic
-from matplotlib import pyplot as plt
-from matplotlib.colors import LogNorm
-
 import numpy as np
 
 from astropy.wcs import WCS
 
 # WEAVE
 from ifs_tools.QC.QCtestBase import QCtestBase
+from ifs_tools.QC.header_rules import load_rule_set
+from ifs_tools.QC.registry import qc_test, register_qc_class
 from ifs_tools.data_readers.weave.weave_raw import WEAVERaw
 from ifs_tools.html_tools.utils import HTMLPage
+from ifs_tools.stats_tools.preview import get_reduction_factor
+from ifs_tools.stats_tools.raw_stats import raw_frame_statistics
 
 file_dir = os.path.dirname(__file__)
 
@@ -31,114 +32,171 @@ def makedir(path, overwrite=True):
     else:
         os.mkdir(path)
 
+@register_qc_class("weave", "raw")
 class QC_tests(QCtestBase):
     """
     Class containing tests.
     """
-    def __init__(self, path_to_raw, output=None, **kwargs):
-        self.data_container = WEAVERaw(path_to_raw, load_hdul=True)
+    def __init__(self, path_to_raw, output=None, header_only=False, **kwargs):
+        self.data_container = WEAVERaw(path_to_raw, load_hdul=True,
+                                       header_only=header_only,
+                                       cache_bytes=kwargs.get("cache_bytes"),
+                                       recorder=kwargs.get("recorder"),
+                                       decompress_workers=kwargs.get(
+                                           "decompress_workers"),
+                                       decompressed_cache=kwargs.get(
+                                           "decompressed_cache"))
         super().__init__(data_level="raw",
-                         name=self.data_container.hdul.filename(),
+                         name=self.data_container.path,
                          survey="weave",
                          **kwargs)
         self.output = output
 
-    def check_primary(self):
-        detector_kw = self.load_yml_file(os.path.join(file_dir, "qc_params", "check_raw.yml"))
-        checks = self.check_header(detector_kw)
+    @qc_test(rules=os.path.join(file_dir, "qc_params", "check_raw.yml"))
+    def check_primary(self, checks=None):
+        if checks is None:
+            checks = self.check_header(
+                load_rule_set(self.check_primary.qc_spec.rules))
+        self.record_header_metrics()
         if self.html:
             self.html_page.add_table_section(title="Primary Header checks",
                                              data=checks)
     
+    def get_raw_statistics(self, hdul_index):
+        """Row, column, amplifier and pixel statistics, histogram and
+        preview of a CCD.
+
+        The frame is read once into memory if it fits in ``max_memory``, or
+        lazily in strips otherwise, and they are computed in a single pass
+        over strips of rows, split among ``self.stats_workers`` threads, for
+        both ``check_raw`` and ``check_histogram``.
+        """
+        key = ("raw_statistics", hdul_index)
+        if key in self.data_container.products:
+            return self.data_container.products.get(key)
+        self.data_container.preload(hdul_index, max_bytes=self.max_memory)
+        data = self.data_container.get_section(hdul_index)
+        max_memory = None
+        if hdul_index not in self.data_container.preloaded:
+            max_memory = self.max_memory
+        preview_factor = None
+        if not self.full_resolution:
+            preview_factor = get_reduction_factor(data.shape,
+                                                  self.preview_size)
+        return self.data_container.memoize(
+            key, raw_frame_statistics, data,
+            header=self.data_container.get_header(hdul_index),
+            workers=self.stats_workers, histogram=True, hist_bins=100,
+            hist_range=(-1000, 70000), preview_factor=preview_factor,
+            max_memory=max_memory)
+
+    @qc_test(hdus=(1, 2), headers=(1, 2), products=("raw_statistics",))
     def check_raw(self):
-        fig, axs = plt.subplots(nrows=2, ncols=1,
-                                figsize=(10, 20),
-                                gridspec_kw=dict(wspace=0.5))
-
-        for ax, hdul_index in zip(axs, [1, 2]):
-            data = self.data_container.hdul[hdul_index].data
-            name = self.data_container.hdul[hdul_index].name
-            ax.set_title(name)
-            mappable = ax.imshow(data, cmap='nipy_spectral',
-                                 norm=LogNorm(vmin=np.nanpercentile(data, 1),
-                                              vmax=np.nanpercentile(data, 99)),
-                                 origin='lower')
-
+        panels, profiles = [], []
+        amplifier_table = [["CCD", "Amplifier", "Layout",
+                            "Overscan level (ADU)", "Overscan sigma (ADU)",
+                            "Data level (ADU)"]]
+        pixel_table = [["CCD", "Hot pixels", "Cosmic-ray pixels",
+                        "Saturated (%)", "Bad columns", "Bad rows"]]
+        for hdul_index in [1, 2]:
+            stats = self.get_raw_statistics(hdul_index)
+            # Only some rows and columns are read, unless the full image is
+            # displayed
+            data = self.data_container.get_section(hdul_index)
+            name = self.data_container.get_hdu(hdul_index).name
+            if self.full_resolution:
+                image, factor = self.data_container.get_data(hdul_index), 1
+            else:
+                image = stats["preview"]
+                factor = get_reduction_factor(data.shape, self.preview_size)
+            percentiles = stats["histogram"].result()["percentiles"]
+            vmin, vmax = percentiles[1], percentiles[99]
+            if factor > 1:
+                extent = (-0.5, image.shape[1] * factor - 0.5,
+                          -0.5, image.shape[0] * factor - 0.5)
+            else:
+                extent = None
+
+            # Central row and column, and the most deviant ones
             column_index = data.shape[1] // 2
-            random_column = np.random.randint(data.shape[1])
-
+            worst_column = stats["worst_column"]
             row_index = data.shape[0] // 2
-            random_raw = np.random.randint(data.shape[0])
-
-            ax.axhline(row_index, color='k', ls='--', lw=2)
-            ax.axvline(column_index, color='k', ls='--', lw=2)
-
-            ax.axhline(random_raw, color='b', ls='--', lw=2)
-            ax.axvline(random_column, color='b', ls='--', lw=2)
-
-            inax = ax.inset_axes((1.05, 0, 0.15, 1))
-            inax.plot(data[:, column_index], np.arange(data[:, column_index].size),
-                      c='k', lw=0.7)
-            inax.set_ylim(ax.get_ylim())
-            inax.set_yticklabels([])  
-
-            inax = ax.inset_axes((1.25, 0, 0.15, 1))
-            inax.plot(data[:, random_column],
-                       np.arange(data[:, column_index].size),
-                       c='b', lw=0.7)
-            inax.set_ylim(ax.get_ylim())
-            inax.set_yticklabels([])  
-
-            inax = ax.inset_axes((0, 1.05, 1, 0.15))
-            inax.plot(data[row_index, :], c='k', lw=0.7)
-            inax.set_xlim(ax.get_ylim())
-            inax.set_xticklabels([])
-
-            inax = ax.inset_axes((0, 1.25, 1, 0.15))
-            inax.plot(data[random_raw, :], c='b', lw=0.7)
-            inax.set_xlim(ax.get_ylim())
-            inax.set_xticklabels([])
-
-            plt.colorbar(mappable, ax=ax, label=self.data_container.hdul[1].header.get(
-            'BUNIT', "Unknown BUNIT"), location='left')
-        output = os.path.join(self.output, "raw_image.png")
-        fig.savefig(output, bbox_inches='tight')
-        plt.close(fig)
+            worst_row = stats["worst_row"]
+
+            panels.append(dict(
+                name=name,
+                image=image, extent=extent, shape=data.shape,
+                vmin=vmin, vmax=vmax,
+                label=self.data_container.get_header(1).get(
+                    'BUNIT', "Unknown BUNIT"),
+                rows=[(row_index, data[row_index, :], 'k'),
+                      (worst_row, data[worst_row, :], 'b')],
+                columns=[(column_index, data[:, column_index], 'k'),
+                         (worst_column, data[:, worst_column], 'b')]))
+            profiles.append(dict(
+                name=name, method=stats["method"],
+                column_profile=stats["column_profile"],
+                row_profile=stats["row_profile"],
+                bad_columns=stats["bad_columns"],
+                bad_rows=stats["bad_rows"]))
+
+            for amplifier in stats["amplifiers"]:
+                amplifier_table.append([
+                    name, amplifier["name"],
+                    "guessed" if amplifier["guessed"] else "header",
+                    f"{amplifier['overscan_level']:.1f}",
+                    f"{amplifier['overscan_sigma']:.2f}",
+                    f"{amplifier['data_level']:.1f}"])
+                self.record_metric(f"{name}_{amplifier['name']}_overscan",
+                                   amplifier["overscan_level"])
+            pixel_table.append([
+                name, stats["n_hot"], stats["n_cosmic"],
+                f"{100 * stats['saturated_fraction']:.4f}",
+                len(stats["bad_columns"]), len(stats["bad_rows"])])
+            for key in ("n_hot", "n_cosmic", "saturated_fraction"):
+                self.record_metric(f"{name}_{key}", stats[key])
+            self.record_metric(f"{name}_n_bad_columns",
+                               len(stats["bad_columns"]))
+
+        output = self.save_plot("raw_display", "raw_image.png",
+                                figsize=(10, 20),
+                                savefig_kwargs=dict(bbox_inches='tight'),
+                                panels=panels)
+        profile_output = self.save_plot("raw_profiles", "raw_profiles.png",
+                                        figsize=(15, 5 * len(profiles)),
+                                        savefig_kwargs=dict(
+                                            bbox_inches='tight'),
+                                        panels=profiles)
         if self.html:
             self.html_page.add_plot_section(
                 "Raw display", os.path.basename(output))
-        return output
-
+            self.html_page.add_plot_section(
+                "Row and column profiles", os.path.basename(profile_output))
+            self.html_page.add_table_section(title="Amplifier levels",
+                                             data=amplifier_table)
+            self.html_page.add_table_section(title="Pixel statistics",
+                                             data=pixel_table)
+        return [output, profile_output]
+
+    @qc_test(hdus=(1, 2), headers=(1, 2), products=("raw_statistics",))
     def check_histogram(self):
         nsigma = 3
-        fig, axs = plt.subplots(nrows=2, ncols=2,
-                                figsize=(15, 10))
-        for ax_pair, hdul_index in zip(axs, [1, 2]):
-            data = self.data_container.hdul[hdul_index].data
-            ax = ax_pair[0]
-            h, xedges, _ = ax.hist(
-                data.flatten(), bins=100,
-                range=[-1000, 70000], log=True)
-            ax.set_xlabel("Counts/ADU")
-            
-            xbins = (xedges[:-1] + xedges[1:]) / 2
-            norm = np.sum(h)
-            mean = np.sum(h * xbins) / norm
-            sigma = np.sqrt(np.sum(h * (xbins - mean)**2) / norm)
-
-            inax = ax_pair[1]
-            inax.set_title(f"mean={mean:.1f} +- {nsigma}*{sigma:.1f}")
-            h, xedges, _ = inax.hist(
-                data.flatten(), bins=100,
-                range=[mean - nsigma * sigma,
-                       mean + nsigma * sigma],
-                       log=True)
-            inax.set_xlim(mean - 5 * sigma, mean + 5 * sigma)
-            inax.set_xlabel("Counts/ADU")
-            inax.set_yscale('log')
-        output = os.path.join(self.output, "raw_hist.png")
-        fig.savefig(output, bbox_inches='tight')
-        plt.close(fig)
+        panels = []
+        for hdul_index in [1, 2]:
+            # Histograms are accumulated with the raw statistics
+            stats = self.get_raw_statistics(hdul_index)["histogram"].result(
+                nsigma=nsigma)
+            name = self.data_container.get_hdu(hdul_index).name
+            self.record_metric(f"{name}_mean", stats["mean"])
+            self.record_metric(f"{name}_sigma", stats["sigma"])
+            panels.append(dict(coarse=stats["coarse"], zoom=stats["zoom"],
+                               percentiles=stats["percentiles"],
+                               mean=stats["mean"], sigma=stats["sigma"],
+                               nsigma=nsigma))
+        output = self.save_plot("histograms", "raw_hist.png",
+                                figsize=(15, 10),
+                                savefig_kwargs=dict(bbox_inches='tight'),
+                                panels=panels)
         if self.html:
             self.html_page.add_plot_section("Raw histogram", os.path.basename(output))
         return output
@@ -0,0 +1,295 @@
+"""
+Benchmark of the WEAVE QC on synthetic data.
+
+Synthetic raw frames and LIFU cubes (see ``ifs_tools.benchmarks.synthetic``)
+are generated and the following quantities are measured:
+
+- the time of every QC test of ``raw_qc`` and ``cube_qc`` (best of
+  ``repeat`` runs, figures included), following the order planned by
+  ``qc_main``, and its peak of memory allocated (tracemalloc, in a separate
+  run so that it does not affect the times),
+- the wall and CPU time, and the peak resident memory of full ``qc_main``
+  runs on all the files.
+
+Results can be saved as JSON and compared with those of a previous run to
+spot regressions:
+
+    python -m ifs_tools.benchmarks.qc_benchmark --save before.json
+    python -m ifs_tools.benchmarks.qc_benchmark --compare before.json
+"""
+
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+import ifs_tools.QC  # noqa: F401, registers the QC tests
+from ifs_tools.QC.registry import get_qc_class, get_test_specs, plan_tests
+from ifs_tools.benchmarks.synthetic import make_dataset
+
+
+def time_qc_tests(survey, data_level, path, output_dir, tests=None, repeat=3,
+                  memory=True):
+    """Time each QC test applied to a file.
+
+    Parameters
+    ----------
+    survey, data_level : str
+        QC class of the file.
+    path : str
+        Path to the file.
+    output_dir : str
+        Directory where the products are written.
+    tests : list, optional
+        Tests to be applied. Default is every declared test of the class.
+    repeat : int, optional
+        Number of runs, the best time is reported.
+    memory : bool, optional
+        If True, the peak memory allocated by each test is measured in an
+        additional run.
+
+    Returns
+    -------
+    results : dict
+        For each test (and for opening and closing the file), the ``time``
+        (s), the ``times`` of every run and the ``peak_memory`` (bytes).
+    """
+    qc_class = get_qc_class(survey, data_level)
+    if tests is None:
+        tests = sorted(get_test_specs(qc_class))
+    plan = plan_tests(qc_class, tests)
+    steps = ["open"] + [test for test, _ in plan] + ["close"]
+    results = {step: {"times": [], "peak_memory": None} for step in steps}
+
+    def run(measure):
+        qc_tests = measure("open", lambda: qc_class(path, output=output_dir,
+                                                    html=True))
+        for test, release in plan:
+            def apply():
+                getattr(qc_tests, test)()
+                qc_tests.wait_plots()
+            measure(test, apply)
+            for hdul_idx in release:
+                qc_tests.data_container.release_hdu(hdul_idx)
+        measure("close", qc_tests.data_container.close_hdul)
+
+    def measure_time(step, func):
+        start = time.perf_counter()
+        output = func()
+        results[step]["times"].append(time.perf_counter() - start)
+        return output
+
+    def measure_memory(step, func):
+        current = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        output = func()
+        results[step]["peak_memory"] = max(
+            tracemalloc.get_traced_memory()[1] - current, 0)
+        return output
+
+    for _ in range(repeat):
+        run(measure_time)
+    if memory:
+        tracemalloc.start()
+        try:
+            run(measure_memory)
+        finally:
+            tracemalloc.stop()
+    for step in steps:
+        results[step]["time"] = min(results[step]["times"])
+    return results
+
+
+def run_qc_main(files, survey, data_level, tests, output_dir, extra_args=()):
+    """Time a full ``qc_main`` run in a new process.
+
+    Returns
+    -------
+    results : dict
+        ``wall`` and ``cpu`` time (s) and ``max_rss`` (bytes) of the
+        ``qc_main`` process (without the figure rendering processes), and
+        its exit ``status``.
+    """
+    command = [sys.executable, "-m", "ifs_tools.QC.qc_main", *files,
+               "--survey", survey, "--qcmode", data_level,
+               "--qctest", *tests, "--output", output_dir,
+               "--overwrite", "--no-cache", *extra_args]
+    log_path = output_dir.rstrip(os.sep) + ".log"
+    with open(log_path, "w") as log:
+        start = time.perf_counter()
+        process = subprocess.Popen(command, stdout=log,
+                                   stderr=subprocess.STDOUT)
+        _, status, usage = os.wait4(process.pid, 0)
+        wall = time.perf_counter() - start
+    process.returncode = os.waitstatus_to_exitcode(status)
+    if process.returncode != 0:
+        print(f"[WARNING] qc_main failed, see {log_path}")
+    # ru_maxrss is given in kB (bytes on macOS)
+    max_rss = usage.ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+    return {"wall": wall, "cpu": usage.ru_utime + usage.ru_stime,
+            "max_rss": max_rss, "status": process.returncode}
+
+
+def get_metadata(args):
+    import astropy
+    import matplotlib
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+            cwd=os.path.dirname(__file__)).stdout.strip()
+    except OSError:
+        commit = ""
+    return {"date": time.strftime("%Y-%m-%dT%H:%M:%S"), "commit": commit,
+            "python": platform.python_version(), "numpy": np.__version__,
+            "astropy": astropy.__version__,
+            "matplotlib": matplotlib.__version__,
+            "machine": platform.machine(), "cpus": os.cpu_count(),
+            "raw_shape": list(args.raw_shape),
+            "cube_shape": list(args.cube_shape),
+            "n_raw": args.n_raw, "n_cubes": args.n_cubes,
+            "repeat": args.repeat}
+
+
+def print_results(results):
+    print(f"\n{'Test':<40} {'time (s)':>10} {'MB/s':>10} {'peak (MB)':>10}")
+    for name, entry in results["tests"].items():
+        peak = entry["peak_memory"]
+        peak = f"{peak / 2**20:10.1f}" if peak is not None else f"{'-':>10}"
+        print(f"{name:<40} {entry['time']:10.3f} "
+              + f"{entry['file_size'] / 2**20 / entry['time']:10.1f} {peak}")
+    if results["qc_main"]:
+        print(f"\n{'qc_main run':<40} {'wall (s)':>10} {'cpu (s)':>10} "
+              + f"{'RSS (MB)':>10} {'files/s':>10}")
+        for name, entry in results["qc_main"].items():
+            print(f"{name:<40} {entry['wall']:10.2f} {entry['cpu']:10.2f} "
+                  + f"{entry['max_rss'] / 2**20:10.1f} "
+                  + f"{entry['n_files'] / entry['wall']:10.2f}")
+
+
+def compare_results(results, baseline, tolerance=0.2, min_time=0.01):
+    """Print the ratio of each measurement with respect to a baseline.
+
+    Returns
+    -------
+    regressions : list
+        Measurements that are more than ``tolerance`` worse than the
+        baseline. Steps faster than ``min_time`` seconds are not compared.
+    """
+    regressions = []
+    print(f"\nComparison with the baseline of {baseline['metadata']['date']}"
+          + f" ({baseline['metadata']['commit'][:8]})")
+    for group, keys in (("tests", ("time", "peak_memory")),
+                        ("qc_main", ("wall", "max_rss"))):
+        for name, entry in results[group].items():
+            reference = baseline[group].get(name)
+            if reference is None:
+                continue
+            for key in keys:
+                if not entry.get(key) or not reference.get(key):
+                    continue
+                if key == "time" and max(entry[key], reference[key]) < min_time:
+                    # Too short to be measured reliably
+                    continue
+                ratio = entry[key] / reference[key]
+                flag = ""
+                if ratio > 1 + tolerance:
+                    flag = "  <-- REGRESSION"
+                    regressions.append((name, key, ratio))
+                print(f"{name + ' ' + key:<52} {ratio:6.2f}{flag}")
+    return regressions
+
+
+def main(args):
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix="ifs_tools_bench_")
+    output_dir = os.path.join(data_dir, "qc_output")
+    os.makedirs(output_dir, exist_ok=True)
+    print(f"Writing synthetic data in {data_dir}")
+    start = time.perf_counter()
+    raw_files, cube_files = make_dataset(
+        data_dir, n_raw=args.n_raw, n_cubes=args.n_cubes,
+        raw_shape=tuple(args.raw_shape), cube_shape=tuple(args.cube_shape),
+        seed=args.seed)
+    print(f"Synthetic data written in {time.perf_counter() - start:.1f} s")
+
+    results = {"metadata": get_metadata(args), "tests": {}, "qc_main": {}}
+    for data_level, files in (("raw", raw_files), ("cube", cube_files)):
+        if not files:
+            continue
+        qc_class = get_qc_class("weave", data_level)
+        tests = sorted(get_test_specs(qc_class))
+        print(f"\nTiming the {data_level} tests: {', '.join(tests)}")
+        test_dir = os.path.join(output_dir, f"tests_{data_level}")
+        os.makedirs(test_dir, exist_ok=True)
+        test_results = time_qc_tests("weave", data_level, files[0], test_dir,
+                                     tests=tests, repeat=args.repeat,
+                                     memory=args.memory)
+        for step, entry in test_results.items():
+            entry["file_size"] = os.path.getsize(files[0])
+            results["tests"][f"weave/{data_level}/{step}"] = entry
+        if args.qc_main:
+            print(f"Running qc_main on {len(files)} {data_level} files")
+            run_results = run_qc_main(
+                files, "weave", data_level, tests,
+                os.path.join(output_dir, f"qc_main_{data_level}"),
+                extra_args=args.qc_main_args.split())
+            run_results["n_files"] = len(files)
+            results["qc_main"][f"weave/{data_level}"] = run_results
+
+    print_results(results)
+    if args.save is not None:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=1)
+        print(f"\nResults saved in {args.save}")
+    regressions = []
+    if args.compare is not None:
+        with open(args.compare, "r") as f:
+            regressions = compare_results(results, json.load(f),
+                                          tolerance=args.tolerance)
+    if args.data_dir is None:
+        shutil.rmtree(data_dir, ignore_errors=True)
+    return regressions
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(
+        description="Benchmark the WEAVE QC on synthetic data")
+    parser.add_argument("--data_dir", type=str, default=None,
+                        help="Directory for the synthetic data and QC products (default is a temporary directory, removed at the end)")
+    parser.add_argument("--n_raw", type=int, default=3,
+                        help="Number of raw frames (default=3)")
+    parser.add_argument("--n_cubes", type=int, default=2,
+                        help="Number of cubes (default=2)")
+    parser.add_argument("--raw_shape", type=int, nargs=2,
+                        default=(6144, 6144),
+                        help="Shape of each CCD image (default=6144 6144)")
+    parser.add_argument("--cube_shape", type=int, nargs=3,
+                        default=(1500, 120, 120),
+                        help="Shape of the cubes (default=1500 120 120)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="Number of timed runs of each test (default=3)")
+    parser.add_argument("--memory", action=argparse.BooleanOptionalAction,
+                        default=True,
+                        help="Measure the peak memory of each test (default=True)")
+    parser.add_argument("--qc_main", action=argparse.BooleanOptionalAction,
+                        default=True,
+                        help="Time full qc_main runs (default=True)")
+    parser.add_argument("--qc_main_args", type=str, default="",
+                        help="Extra arguments of the qc_main runs, e.g. --qc_main_args=\"--workers 4\"")
+    parser.add_argument("--save", type=str, default=None,
+                        help="Save the results in a JSON file")
+    parser.add_argument("--compare", type=str, default=None,
+                        help="JSON file of a previous run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Relative slowdown reported as a regression (default=0.2)")
+    args = parser.parse_args()
+    regressions = main(args)
+    sys.exit(1 if regressions else 0)
@@ -0,0 +1,270 @@
+"""
+Synthetic WEAVE-like FITS files.
+
+The files follow the layout expected by the WEAVE readers and QC tests, so
+the QC can be run (and benchmarked) without real survey data:
+
+- Raw frames: a primary header and the images of the two CCDs (16-bit
+  unsigned integers) in HDUs 1 and 2. Each CCD image contains a bias level
+  with read noise, fibre traces along the dispersion axis with sky lines, an
+  overscan strip at each side, hot pixels, cosmic rays and a few saturated
+  pixels.
+- LIFU cubes: flux in HDU 1, inverse variance in HDU 2, the flux and inverse
+  variance without sky subtraction in HDUs 3 and 4, the sensitivity function
+  in HDU 5 and the white light image in HDU 6, with celestial and spectral
+  WCS.
+
+Primary headers provide every keyword checked by the files in
+``ifs_tools/QC/weave/qc_params``.
+"""
+
+import os
+import warnings
+
+import numpy as np
+from astropy.io import fits
+
+# Realistic values of the keywords checked by the QC
+PRIMARY_KEYWORDS = {
+    "INSTRUME": "WEAVE", "DETECTOR": "WEAVEBLUE", "CAMERA": "WEAVEBLUE",
+    "CCDSPEED": "SLOW", "CCDTEMP": -110.0, "READMODE": "FULL",
+    "STORMODE": "NORMAL", "VPH": "LR-B", "CENWAVE": 4900.0,
+    "OBSTYPE": "OBJECT", "IMAGETYP": "object", "EXPOSED": 1200.0,
+    "EXPTIME": 1200.0, "UT": "22:00:00.0", "CAT-NAME": "SYNTHETIC",
+    "CAT-RA": 150.0, "CAT-DEC": 2.0, "PM-RA": 0.0, "PM-DEC": 0.0,
+    "ZDSTART": 20.0, "ZDEND": 25.0, "AIRMASS": 1.1, "IFUPA1": 0.0,
+    "SEEINGB": 1.0, "SEEINGE": 1.1, "AGBBUNDLE": "LIFU",
+    "OBTITLE": "Synthetic observation", "OBCLASS": "SCIENCE",
+    "TRIMESTE": "2024A1", "PROGTEMP": "41331", "OBSTEMP": "DACEB",
+    "INFILE": "synthetic.xml", "CASUID": "synthetic", "CASUDATE": "2024-01-01",
+    "CASUVERS": "1.0", "DATAMVER": "8.00", "CFGVER": "1.0"}
+
+# Extensions of the WEAVE LIFU cubes
+CUBE_EXTENSIONS = ("DATA", "IVAR", "DATA_NOSS", "IVAR_NOSS", "SENSFUNC",
+                   "DATA_COLLAPSE3")
+
+
+def primary_header(date_obs="2024-01-01T22:00:00.0", run=1000000, **keywords):
+    """Primary header of a synthetic WEAVE file."""
+    header = fits.Header()
+    for key, value in dict(PRIMARY_KEYWORDS, **keywords).items():
+        if len(key) > 8:
+            key = f"HIERARCH {key}"
+        header[key] = value
+    header["DATE-OBS"] = date_obs
+    header["RUN"] = run
+    return header
+
+
+def celestial_header(nx, ny, ra=150.0, dec=2.0, pixel_scale=0.5):
+    """TAN projection centred on the image, with ``pixel_scale`` arcsec."""
+    header = fits.Header()
+    header["CTYPE1"], header["CTYPE2"] = "RA---TAN", "DEC--TAN"
+    header["CUNIT1"], header["CUNIT2"] = "deg", "deg"
+    header["CRVAL1"], header["CRVAL2"] = ra, dec
+    header["CRPIX1"], header["CRPIX2"] = (nx + 1) / 2, (ny + 1) / 2
+    header["CDELT1"] = -pixel_scale / 3600
+    header["CDELT2"] = pixel_scale / 3600
+    return header
+
+
+def raw_ccd_image(shape, rng, bias=1000.0, read_noise=4.0, overscan=50,
+                  fibre_spacing=10, n_cosmics=2000, n_hot=200, n_saturated=20,
+                  block_rows=512):
+    """Image of a raw CCD (16-bit unsigned integers)."""
+    ny, nx = shape
+    x = np.arange(nx)
+    y = np.arange(ny)
+    # Fibre traces along the columns (dispersion along y)
+    centres = np.arange(overscan + fibre_spacing, nx - overscan, fibre_spacing)
+    offsets = x[:, np.newaxis] - centres[np.newaxis, :]
+    profile = np.exp(-0.5 * (offsets / 1.5)**2) @ rng.uniform(
+        0.5, 1.5, centres.size)
+    profile[:overscan] = 0
+    profile[nx - overscan:] = 0
+    # Continuum and sky lines along the dispersion axis
+    continuum = 2000 * (1 + 0.5 * np.sin(np.pi * y / ny))
+    for line in rng.uniform(0, ny, 20):
+        continuum += 5000 * np.exp(-0.5 * ((y - line) / 2.0)**2)
+
+    image = np.empty(shape, dtype=np.uint16)
+    for start in range(0, ny, block_rows):
+        stop = min(start + block_rows, ny)
+        block = np.outer(continuum[start:stop], profile).astype(np.float32)
+        block = rng.poisson(block).astype(np.float32)
+        block += bias + read_noise * rng.standard_normal(
+            block.shape, dtype=np.float32)
+        image[start:stop] = np.clip(block, 0, 65535)
+    # Defects
+    hot = (rng.integers(0, ny, n_hot), rng.integers(0, nx, n_hot))
+    image[hot] = rng.integers(5000, 20000, n_hot)
+    cosmics = (rng.integers(0, ny, n_cosmics), rng.integers(0, nx, n_cosmics))
+    image[cosmics] = rng.integers(10000, 60000, n_cosmics)
+    saturated = (rng.integers(0, ny, n_saturated),
+                 rng.integers(0, nx, n_saturated))
+    image[saturated] = 65535
+    return image
+
+
+def make_raw_frame(path, shape=(6144, 6144), seed=0,
+                   date_obs="2024-01-01T22:00:00.0", run=1000000,
+                   overwrite=True):
+    """Write a synthetic WEAVE raw frame.
+
+    Parameters
+    ----------
+    path : str
+        Path to the output file.
+    shape : tuple, optional
+        Shape (rows, columns) of each CCD image.
+    seed : int, optional
+        Seed of the random generator.
+    date_obs : str, optional
+        Start of the exposure (DATE-OBS).
+    run : int, optional
+        Run number.
+
+    Returns
+    -------
+    path : str
+    """
+    rng = np.random.default_rng(seed)
+    hdus = [fits.PrimaryHDU(header=primary_header(date_obs, run))]
+    for name in ("WEAVEBLUE1", "WEAVEBLUE2"):
+        header = fits.Header()
+        header["BUNIT"] = "ADU"
+        header["CCDNAME"] = name
+        hdus.append(fits.ImageHDU(raw_ccd_image(shape, rng), header=header,
+                                  name=name))
+    fits.HDUList(hdus).writeto(path, overwrite=overwrite)
+    return path
+
+
+def make_cube(path, shape=(1500, 120, 120), seed=0,
+              date_obs="2024-01-01T22:00:00.0", run=1000000,
+              wave_range=(3660e-10, 6060e-10), noss=True, overwrite=True):
+    """Write a synthetic WEAVE LIFU datacube.
+
+    Parameters
+    ----------
+    path : str
+        Path to the output file.
+    shape : tuple, optional
+        Shape (wavelength, y, x) of the cube.
+    seed : int, optional
+        Seed of the random generator.
+    date_obs : str, optional
+        Start of the exposure (DATE-OBS).
+    run : int, optional
+        Run number.
+    wave_range : tuple, optional
+        Wavelength (m) of the first and last slices.
+    noss : bool, optional
+        If True, HDUs 3 and 4 (no sky subtraction) have the size of the
+        cube, otherwise they are small placeholders.
+
+    Returns
+    -------
+    path : str
+    """
+    rng = np.random.default_rng(seed)
+    n_wave, ny, nx = shape
+    wavelength = np.linspace(*wave_range, n_wave)
+    # Exponential disc with a continuum and a few emission lines
+    yy, xx = np.mgrid[:ny, :nx]
+    radius = np.hypot(xx - nx / 2, yy - ny / 2)
+    disc = np.exp(-radius / (0.15 * max(nx, ny))).astype(np.float32)
+    spectrum = 1 + 0.3 * (wavelength - wavelength[0]) / np.ptp(wavelength)
+    for line in (4861e-10, 5007e-10, 3727e-10):
+        spectrum += 3 * np.exp(-0.5 * ((wavelength - line) / 2e-10)**2)
+    sigma = 0.05 + 0.02 * rng.random((n_wave, 1, 1), dtype=np.float32)
+    flux = np.empty(shape, dtype=np.float32)
+    for i in range(n_wave):
+        flux[i] = spectrum[i] * disc + sigma[i] * rng.standard_normal(
+            (ny, nx), dtype=np.float32)
+    ivar = np.broadcast_to(1 / sigma**2, shape).astype(np.float32)
+    # Spaxels outside the footprint of the LIFU (approximated by a circle)
+    outside = radius > 0.5 * min(nx, ny)
+    flux[:, outside] = np.nan
+    ivar[:, outside] = 0
+
+    header = celestial_header(nx, ny)
+    header["CTYPE3"], header["CUNIT3"] = "AWAV", "m"
+    header["CRVAL3"], header["CRPIX3"] = wavelength[0], 1
+    header["CDELT3"] = wavelength[1] - wavelength[0]
+    header["BUNIT"] = "1e-18 erg/(s cm2 Angstrom)"
+    header_noss = header if noss else None
+    placeholder = np.zeros((2, 2), np.float32)
+    extensions = {"DATA": (flux, header), "IVAR": (ivar, header),
+                  "DATA_NOSS": (flux if noss else placeholder, header_noss),
+                  "IVAR_NOSS": (ivar if noss else placeholder, header_noss),
+                  "SENSFUNC": (spectrum.astype(np.float32), None)}
+    hdus = [fits.PrimaryHDU(header=primary_header(date_obs, run))]
+    for name in CUBE_EXTENSIONS[:-1]:
+        data, ext_header = extensions[name]
+        hdus.append(fits.ImageHDU(data, header=ext_header,
+                                  name=f"BLUE_{name}"))
+    white_header = celestial_header(nx, ny)
+    white_header["CHIPNAME"] = "WEAVEBLUE"
+    white_header["BUNIT"] = header["BUNIT"]
+    with warnings.catch_warnings():
+        # Spaxels outside the footprint
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        white_image = np.nanmean(flux, axis=0)
+    hdus.append(fits.ImageHDU(white_image, header=white_header,
+                              name=f"BLUE_{CUBE_EXTENSIONS[-1]}"))
+    fits.HDUList(hdus).writeto(path, overwrite=overwrite)
+    return path
+
+
+def make_dataset(output_dir, n_raw=3, n_cubes=2, raw_shape=(6144, 6144),
+                 cube_shape=(1500, 120, 120), seed=0):
+    """Write a set of synthetic raw frames and cubes.
+
+    Files are spread over two observing nights.
+
+    Returns
+    -------
+    raw_files, cube_files : list of str
+    """
+    raw_dir = os.path.join(output_dir, "raw")
+    cube_dir = os.path.join(output_dir, "cube")
+    os.makedirs(raw_dir, exist_ok=True)
+    os.makedirs(cube_dir, exist_ok=True)
+    raw_files, cube_files = [], []
+    for i in range(n_raw):
+        raw_files.append(make_raw_frame(
+            os.path.join(raw_dir, f"r{1000000 + i}.fit"), shape=raw_shape,
+            seed=seed + i, date_obs=f"2024-01-0{1 + i % 2}T22:{i % 60:02d}:00.0",
+            run=1000000 + i))
+    for i in range(n_cubes):
+        cube_files.append(make_cube(
+            os.path.join(cube_dir, f"stackcube_{1000000 + i}.fit"),
+            shape=cube_shape, seed=seed + n_raw + i,
+            date_obs=f"2024-01-0{1 + i % 2}T23:{i % 60:02d}:00.0",
+            run=1000000 + i))
+    return raw_files, cube_files
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(
+        description="Write synthetic WEAVE raw frames and LIFU cubes")
+    parser.add_argument("output", type=str, help="Output directory")
+    parser.add_argument("--n_raw", type=int, default=3,
+                        help="Number of raw frames (default=3)")
+    parser.add_argument("--n_cubes", type=int, default=2,
+                        help="Number of cubes (default=2)")
+    parser.add_argument("--raw_shape", type=int, nargs=2,
+                        default=(6144, 6144),
+                        help="Shape of each CCD image (default=6144 6144)")
+    parser.add_argument("--cube_shape", type=int, nargs=3,
+                        default=(1500, 120, 120),
+                        help="Shape of the cubes (default=1500 120 120)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    raw_files, cube_files = make_dataset(
+        args.output, n_raw=args.n_raw, n_cubes=args.n_cubes,
+        raw_shape=tuple(args.raw_shape), cube_shape=tuple(args.cube_shape),
+        seed=args.seed)
+    print("\n".join(raw_files + cube_files))
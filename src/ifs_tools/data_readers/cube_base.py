@@ -0,0 +1,30 @@
+"""
+Base reader of IFS datacubes.
+"""
+
+import numpy as np
+
+from ifs_tools.data_readers.reader_base import ReaderBase
+
+
+class CubeBase(ReaderBase):
+    """Reader of datacubes stored as (wavelength, y, x) extensions."""
+
+    def read_spectrum(self, hdul_idx, y, x):
+        """Spectrum of a single spaxel."""
+        return self.read_section(hdul_idx, (slice(None), y, x))
+
+    def read_wavelength_slab(self, hdul_idx, start, stop):
+        """Images of the wavelength slices ``start:stop``."""
+        return self.read_section(hdul_idx, slice(start, stop))
+
+    def read_spaxels(self, hdul_idx, y_slice, x_slice):
+        """Spectra of a rectangular region of spaxels."""
+        return self.read_section(hdul_idx, (slice(None), y_slice, x_slice))
+
+    def get_wavelength(self, hdul_idx):
+        """Wavelength of each slice of a cube, in the units of the WCS."""
+        return self.memoize(
+            ("wavelength", hdul_idx),
+            lambda: self.get_wcs(hdul_idx).spectral.array_index_to_world_values(
+                np.arange(0, self.get_header(hdul_idx)['NAXIS3'])))
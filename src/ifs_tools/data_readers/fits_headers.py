@@ -0,0 +1,96 @@
+"""
+Fast access to FITS headers without reading the data units.
+
+Headers are parsed block by block straight from the file and the data units
+are skipped using the size declared in each header, so no HDUList or data
+array is ever built. The headers of tile-compressed images are returned as
+the headers of the uncompressed images.
+"""
+
+import gzip
+
+import numpy as np
+from astropy.io import fits
+
+from ifs_tools.data_readers.tile_compression import image_header
+
+BLOCK_SIZE = 2880
+END_CARD = b"END" + b" " * 77
+
+
+def open_fits_file(path):
+    """Open a (possibly gzip-compressed) FITS file in binary mode."""
+    if str(path).endswith(".gz"):
+        return gzip.open(path, "rb")
+    return open(path, "rb")
+
+
+def data_size(header):
+    """Size in bytes of the data unit described by a header, including padding."""
+    naxis = header.get("NAXIS", 0)
+    if naxis == 0:
+        return 0
+    n_elements = np.prod([header[f"NAXIS{i}"] for i in range(1, naxis + 1)],
+                         dtype=np.int64)
+    size = (abs(header["BITPIX"]) // 8 * header.get("GCOUNT", 1)
+            * (header.get("PCOUNT", 0) + n_elements))
+    return int(-(-size // BLOCK_SIZE) * BLOCK_SIZE)
+
+
+def read_header(fileobj):
+    """Read the header starting at the current position of a file.
+
+    Returns
+    -------
+    header : astropy.io.fits.Header or None
+        The header, or None if the end of the file was reached.
+    """
+    blocks = []
+    while True:
+        block = fileobj.read(BLOCK_SIZE)
+        if len(block) < BLOCK_SIZE:
+            if blocks:
+                raise OSError("Truncated FITS header")
+            return None
+        blocks.append(block)
+        # Cards are 80 bytes long, END must be at the start of a card
+        if any(block[i:i + 80] == END_CARD
+               for i in range(0, BLOCK_SIZE, 80)):
+            break
+    return fits.Header.fromstring(b"".join(blocks).decode("ascii"))
+
+
+def iter_fits_headers(path):
+    """Iterate over the headers of a FITS file, skipping the data units."""
+    with open_fits_file(path) as f:
+        while True:
+            header = read_header(f)
+            if header is None:
+                return
+            yield header
+            f.seek(data_size(header), 1)
+
+
+def read_fits_headers(path, hdul_idx=0):
+    """Read the headers of a FITS file up to the HDU ``hdul_idx``.
+
+    Parameters
+    ----------
+    path : str
+        Path to the FITS file.
+    hdul_idx : int
+        Index of the last HDU whose header is needed. The rest of the file
+        is never read.
+
+    Returns
+    -------
+    headers : list of astropy.io.fits.Header
+    """
+    headers = []
+    for header in iter_fits_headers(path):
+        headers.append(image_header(header))
+        if len(headers) > hdul_idx:
+            break
+    if len(headers) <= hdul_idx:
+        raise IndexError(f"HDU {hdul_idx} not found in {path}")
+    return headers
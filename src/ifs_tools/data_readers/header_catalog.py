@@ -0,0 +1,252 @@
+"""
+Persistent catalog of the primary headers of the files of an archive.
+
+The catalog is a SQLite database with one row per file, storing its size and
+modification time, its observing night, the most common keywords in indexed
+columns and (optionally) the whole primary header as JSON. Headers are parsed
+straight from the files (see ``ifs_tools.data_readers.fits_headers``), and
+updates only read the files that are new or whose size or modification time
+changed.
+
+Files are selected with SQL conditions on the columns, where the dashes of
+the keyword names are replaced by underscores, e.g.
+``OBSTYPE = 'BIAS' AND night = '20240101'``. Keywords without column can be
+accessed with ``json_extract(header, '$."OBSTEMP"')``.
+"""
+
+import fnmatch
+import json
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+from ifs_tools.data_readers.fits_headers import read_fits_headers
+from ifs_tools.html_tools.master_index import get_night
+
+# Keywords stored in their own (indexed) columns
+CATALOG_KEYWORDS = ("OBSTYPE", "IMAGETYP", "DATE-OBS", "VPH", "CAMERA",
+                    "OBCLASS", "DETECTOR", "INSTRUME", "RUN", "EXPTIME",
+                    "CAT-NAME", "PROGTEMP", "OBSTEMP", "TRIMESTE")
+INDEXED_KEYWORDS = ("OBSTYPE", "IMAGETYP", "DATE-OBS", "VPH", "CAMERA",
+                    "OBCLASS")
+# Number of files inserted per transaction
+BATCH_SIZE = 500
+# Version of the format of the rows (user_version pragma)
+SCHEMA_VERSION = 1
+
+
+def column_name(keyword):
+    return keyword.replace("-", "_")
+
+
+def header_to_dict(header):
+    """JSON serialisable content of a header (without COMMENT and HISTORY)."""
+    content = {}
+    for key, value in header.items():
+        if key in ("COMMENT", "HISTORY", ""):
+            continue
+        if not isinstance(value, (str, bool, int, float)):
+            value = None
+        content[key] = value
+    return content
+
+
+def iter_files(paths, pattern="*.fit*"):
+    """Files matching a pattern within directories (recursively) or paths."""
+    for path in paths:
+        if not os.path.isdir(path):
+            yield os.path.abspath(path)
+            continue
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                if fnmatch.fnmatch(name, pattern):
+                    yield os.path.abspath(os.path.join(root, name))
+
+
+class HeaderCatalog(object):
+    """SQLite catalog of FITS primary headers.
+
+    Parameters
+    ----------
+    path : str
+        Path to the database, created if it does not exist.
+    store_header : bool, optional
+        If True, the whole primary header is stored as JSON.
+    """
+    def __init__(self, path, store_header=True):
+        self.path = path
+        self.store_header = store_header
+        self.columns = [column_name(key) for key in CATALOG_KEYWORDS]
+        self.connection = sqlite3.connect(path)
+        # Readers are not blocked during updates
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.create_tables()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def create_tables(self):
+        columns = ", ".join(f'"{column}"' for column in self.columns)
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, "
+                + f"size INTEGER, mtime REAL, night TEXT, {columns}, "
+                + "header TEXT)")
+            for column in ["night"] + [column_name(key)
+                                       for key in INDEXED_KEYWORDS]:
+                self.connection.execute(
+                    f'CREATE INDEX IF NOT EXISTS "idx_{column}" '
+                    + f'ON files ("{column}")')
+            self.connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def close(self):
+        self.connection.close()
+
+    def __len__(self):
+        return self.connection.execute(
+            "SELECT COUNT(*) FROM files").fetchone()[0]
+
+    def make_row(self, path, stat):
+        """Catalog row of a file (None if its header cannot be read)."""
+        try:
+            header = read_fits_headers(path)[0]
+        except Exception as error:
+            print(f"[WARNING] Could not read the header of {path}: {error}")
+            return None
+        values = [header.get(key, None) for key in CATALOG_KEYWORDS]
+        values = [value if isinstance(value, (str, bool, int, float))
+                  else None for value in values]
+        content = None
+        if self.store_header:
+            content = json.dumps(header_to_dict(header))
+        return (path, stat.st_size, stat.st_mtime,
+                get_night(header.get("DATE-OBS", None), header.get("UT", None)),
+                *values, content)
+
+    def update(self, paths, pattern="*.fit*", workers=8, prune=True):
+        """Add the new or modified files of a set of directories.
+
+        Parameters
+        ----------
+        paths : list of str
+            Directories (searched recursively) or files.
+        pattern : str, optional
+            Pattern of the file names within the directories.
+        workers : int, optional
+            Number of threads reading headers.
+        prune : bool, optional
+            If True, files of the given directories that no longer exist are
+            removed from the catalog.
+
+        Returns
+        -------
+        n_updated, n_removed : int
+            Number of files added or updated, and removed.
+        """
+        known = {path: (size, mtime) for path, size, mtime in
+                 self.connection.execute(
+                     "SELECT path, size, mtime FROM files")}
+        found = set()
+        changed = []
+        for path in iter_files(paths, pattern):
+            found.add(path)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if known.get(path) != (stat.st_size, stat.st_mtime):
+                changed.append((path, stat))
+        print(f"Catalog: {len(found)} files found, {len(changed)} new or "
+              + "modified")
+
+        placeholders = ", ".join(["?"] * (len(self.columns) + 5))
+        columns = ", ".join(f'"{column}"' for column in self.columns)
+        query = (f"INSERT OR REPLACE INTO files (path, size, mtime, night, "
+                 + f"{columns}, header) VALUES ({placeholders})")
+        n_updated = 0
+        # Headers are read by several threads (I/O bound)
+        with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+            for start in range(0, len(changed), BATCH_SIZE):
+                batch = changed[start:start + BATCH_SIZE]
+                rows = [row for row in executor.map(
+                    lambda item: self.make_row(*item), batch)
+                        if row is not None]
+                with self.connection:
+                    self.connection.executemany(query, rows)
+                n_updated += len(rows)
+
+        n_removed = 0
+        if prune:
+            roots = [os.path.join(os.path.abspath(path), "")
+                     for path in paths if os.path.isdir(path)]
+            removed = [(path,) for path in known
+                       if path not in found
+                       and any(path.startswith(root) for root in roots)]
+            with self.connection:
+                self.connection.executemany(
+                    "DELETE FROM files WHERE path = ?", removed)
+            n_removed = len(removed)
+        return n_updated, n_removed
+
+    def select(self, where=None, params=(), order_by='"DATE_OBS", path'):
+        """Paths of the files fulfilling an SQL condition.
+
+        Parameters
+        ----------
+        where : str, optional
+            SQL condition, e.g. ``"OBSTYPE = 'BIAS' AND night = ?"``.
+        params : tuple, optional
+            Values of the placeholders of the condition.
+        order_by : str, optional
+            Ordering of the files (by default, by DATE-OBS).
+
+        Returns
+        -------
+        paths : list of str
+        """
+        query = "SELECT path FROM files"
+        if where:
+            query += f" WHERE {where}"
+        if order_by:
+            query += f" ORDER BY {order_by}"
+        return [path for path, in self.connection.execute(query, params)]
+
+    def get_row(self, path):
+        """Catalog entry of a file as a dictionary (None if not found)."""
+        cursor = self.connection.execute("SELECT * FROM files WHERE path = ?",
+                                         (os.path.abspath(path),))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        entry = dict(zip([d[0] for d in cursor.description], row))
+        if entry["header"] is not None:
+            entry["header"] = json.loads(entry["header"])
+        return entry
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(
+        description="Update or query a catalog of FITS headers")
+    parser.add_argument("catalog", type=str, help="Path to the catalog")
+    parser.add_argument("--update", type=str, nargs="+", default=None,
+                        help="Directories (or files) to add to the catalog")
+    parser.add_argument("--pattern", type=str, default="*.fit*",
+                        help="Pattern of the file names (default=*.fit*)")
+    parser.add_argument("--workers", type=int, default=8,
+                        help="Number of threads reading headers (default=8)")
+    parser.add_argument("--select", type=str, default=None,
+                        help="SQL condition, e.g. \"OBSTYPE = 'BIAS'\"")
+    args = parser.parse_args()
+    with HeaderCatalog(args.catalog) as catalog:
+        if args.update is not None:
+            n_updated, n_removed = catalog.update(
+                args.update, pattern=args.pattern, workers=args.workers)
+            print(f"{n_updated} files updated and {n_removed} removed, "
+                  + f"{len(catalog)} files in the catalog")
+        if args.select is not None:
+            print("\n".join(catalog.select(args.select)))
@@ -0,0 +1,184 @@
+"""
+Base reader of data products stored as binary tables.
+
+Columns are read straight from the file: the layout of the rows is derived
+from the table header (TFORMn, TTYPEn, TDIMn), the table is memory-mapped
+as an array of records and only the requested columns and rows are copied
+(and scaled with TSCALn/TZEROn). No FITS_rec is built, so the memory used
+is that of the columns read. Rows are stored contiguously, so the pages of
+a file read from disk are those of the requested rows, except for wide rows
+(e.g. with vector columns), where the pages holding only other columns are
+skipped.
+
+Tables of gzip-compressed files, or with variable-length or bit columns, are
+read through astropy.
+"""
+
+import numpy as np
+
+from ifs_tools.data_readers.reader_base import ReaderBase
+from ifs_tools.profiling.recorder import instrumented
+from ifs_tools.stats_tools.cube_stats import DEFAULT_MAX_MEMORY
+
+# numpy type of each FITS binary table format
+TFORM_DTYPES = {"L": "i1", "B": "u1", "I": ">i2", "J": ">i4", "K": ">i8",
+                "E": ">f4", "D": ">f8", "C": ">c8", "M": ">c16"}
+# TZEROn of the integer columns storing unsigned values
+UNSIGNED_ZERO = {"I": 2**15, "J": 2**31, "K": 2**63}
+
+
+def parse_tform(tform):
+    """Repeat count and format code of a TFORM value, e.g. ``"3E"``."""
+    tform = tform.strip()
+    digits = len(tform) - len(tform.lstrip("0123456789"))
+    repeat = int(tform[:digits]) if digits else 1
+    return repeat, tform[digits:digits + 1]
+
+
+def table_dtype(header):
+    """Structured dtype of the rows of a binary table.
+
+    Returns
+    -------
+    dtype : np.dtype or None
+        None if some column can not be memory-mapped (variable-length
+        arrays or bits).
+    """
+    names, formats = [], []
+    for i in range(1, header["TFIELDS"] + 1):
+        repeat, code = parse_tform(header[f"TFORM{i}"])
+        name = header.get(f"TTYPE{i}", f"COL{i}")
+        if code == "A":
+            fmt = f"S{repeat}"
+        elif code in TFORM_DTYPES:
+            fmt = TFORM_DTYPES[code]
+            shape = (repeat,)
+            if f"TDIM{i}" in header:
+                # TDIM gives the shape in Fortran order
+                shape = tuple(int(n) for n in reversed(
+                    header[f"TDIM{i}"].strip("() ").split(",")))
+            if repeat != 1:
+                fmt = (fmt, shape)
+        else:
+            return None
+        names.append(name)
+        formats.append(fmt)
+    dtype = np.dtype({"names": names, "formats": formats})
+    if dtype.itemsize != header["NAXIS1"]:
+        return None
+    return dtype
+
+
+class ProdBase(ReaderBase):
+    """Reader of products stored as binary tables, read column by column."""
+
+    def __init__(self, *args, **kwargs):
+        # Memory-mapped records of each table
+        self.tables = {}
+        super().__init__(*args, **kwargs)
+
+    def get_table_hdus(self):
+        """Indices of the binary table extensions."""
+        return [i for i, hdu in enumerate(self.hdul)
+                if hdu.header.get("XTENSION", "").strip() == "BINTABLE"]
+
+    def get_column_names(self, hdul_idx):
+        header = self.get_header(hdul_idx)
+        return [header.get(f"TTYPE{i}", f"COL{i}")
+                for i in range(1, header["TFIELDS"] + 1)]
+
+    def get_n_rows(self, hdul_idx):
+        return self.get_header(hdul_idx)["NAXIS2"]
+
+    def get_column_format(self, hdul_idx, name):
+        """TFORM, TSCAL, TZERO and TUNIT of a column."""
+        header = self.get_header(hdul_idx)
+        i = self.get_column_names(hdul_idx).index(name) + 1
+        return {"tform": header[f"TFORM{i}"],
+                "tscal": header.get(f"TSCAL{i}", 1),
+                "tzero": header.get(f"TZERO{i}", 0),
+                "tunit": header.get(f"TUNIT{i}", "")}
+
+    def get_table(self, hdul_idx):
+        """Memory-mapped records of a table (None if it can't be mapped)."""
+        if hdul_idx in self.tables:
+            return self.tables[hdul_idx]
+        header = self.get_header(hdul_idx)
+        dtype = table_dtype(header)
+        table = None
+        if (dtype is not None and self.memmap
+                and not str(self.data_path).endswith(".gz")):
+            offset = self.hdul.fileinfo(hdul_idx)["datLoc"]
+            table = np.memmap(self.data_path, dtype=dtype, mode="r",
+                              offset=offset, shape=(header["NAXIS2"],))
+        self.tables[hdul_idx] = table
+        return table
+
+    @instrumented()
+    def read_columns(self, hdul_idx, columns, rows=slice(None)):
+        """Read some columns of a table, optionally for a range of rows.
+
+        Only the requested columns are read from disk. Scaled columns
+        (TSCALn/TZEROn) are returned as float64 (or unsigned integers for
+        the usual offsets), logical columns as booleans and character
+        columns as strings.
+
+        Returns
+        -------
+        data : dict
+            Array of values of each column.
+        """
+        table = self.get_table(hdul_idx)
+        if table is None:
+            data = self.get_data(hdul_idx)
+            return {name: np.asarray(data[name][rows]) for name in columns}
+        output = {}
+        for name in columns:
+            values = table[name][rows]
+            fmt = self.get_column_format(hdul_idx, name)
+            code = parse_tform(fmt["tform"])[1]
+            if code == "L":
+                values = values == ord("T")
+            elif code == "A":
+                values = np.char.rstrip(np.char.decode(values, "ascii"))
+            else:
+                values = values.astype(values.dtype.newbyteorder("="))
+                tscal, tzero = fmt["tscal"], fmt["tzero"]
+                if tscal == 1 and tzero == UNSIGNED_ZERO.get(code):
+                    # Unsigned integers: flip the sign bit
+                    unsigned = values.dtype.str.replace("i", "u")
+                    values = values.view(unsigned) ^ np.array(
+                        tzero, dtype=unsigned)
+                elif tscal != 1 or tzero != 0:
+                    values = values * float(tscal) + float(tzero)
+            output[name] = np.asarray(values)
+        return output
+
+    def iter_row_chunks(self, hdul_idx, columns, max_memory=DEFAULT_MAX_MEMORY):
+        """Iterate over the rows of some columns in chunks within a memory cap.
+
+        Yields
+        ------
+        rows : slice
+        data : dict
+            See ``read_columns``.
+        """
+        table = self.get_table(hdul_idx)
+        n_rows = self.get_n_rows(hdul_idx)
+        if table is not None:
+            row_bytes = sum(table.dtype[name].itemsize for name in columns)
+        else:
+            row_bytes = self.get_header(hdul_idx)["NAXIS1"]
+        # Scaled values are converted to float64
+        chunk = max(int(max_memory // (4 * max(row_bytes, 1))), 1)
+        for start in range(0, n_rows, chunk):
+            rows = slice(start, min(start + chunk, n_rows))
+            yield rows, self.read_columns(hdul_idx, columns, rows)
+
+    def release_hdu(self, hdul_idx):
+        self.tables.pop(hdul_idx, None)
+        super().release_hdu(hdul_idx)
+
+    def close_hdul(self):
+        self.tables.clear()
+        super().close_hdul()
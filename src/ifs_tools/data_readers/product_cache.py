@@ -0,0 +1,105 @@
+"""
+Memoization of products derived from the data of a file.
+
+Products (WCS objects, wavelength grids, statistics maps, previews,
+histograms...) are stored in a least-recently-used cache with a memory
+budget, so that several QC tests applied to the same file share them.
+"""
+
+from collections import OrderedDict
+import sys
+
+import numpy as np
+
+# Default memory budget (bytes) of the products of a file
+DEFAULT_CACHE_BYTES = 512 * 2**20
+
+
+def estimate_nbytes(obj):
+    """Approximate memory used by a product."""
+    if isinstance(obj, np.ndarray):
+        return obj.nbytes
+    if isinstance(obj, dict):
+        return sum(estimate_nbytes(k) + estimate_nbytes(v)
+                   for k, v in obj.items())
+    if isinstance(obj, (list, tuple)):
+        return sum(estimate_nbytes(v) for v in obj)
+    if hasattr(obj, "nbytes"):
+        return int(obj.nbytes)
+    return sys.getsizeof(obj)
+
+
+class ProductCache(object):
+    """LRU cache of derived products with a memory budget.
+
+    Keys are tuples whose second element, when present, is the index of the
+    HDU the product was derived from (e.g. ``("wcs", 1)``).
+
+    Parameters
+    ----------
+    max_bytes : int, optional
+        Memory budget. The least recently used products are evicted when it
+        is exceeded.
+    """
+    def __init__(self, max_bytes=None):
+        self.max_bytes = max_bytes or DEFAULT_CACHE_BYTES
+        self.products = OrderedDict()
+        self.sizes = {}
+        self.nbytes = 0
+
+    def __contains__(self, key):
+        return key in self.products
+
+    def get(self, key, default=None):
+        if key not in self.products:
+            return default
+        self.products.move_to_end(key)
+        return self.products[key]
+
+    def put(self, key, value):
+        """Store a product, evicting older ones if needed.
+
+        Products larger than the budget are not stored.
+        """
+        self.pop(key)
+        size = estimate_nbytes(value)
+        if size > self.max_bytes:
+            return value
+        self.products[key] = value
+        self.sizes[key] = size
+        self.nbytes += size
+        self._evict()
+        return value
+
+    def refresh(self, key):
+        """Update the size of a product that was modified in place."""
+        if key in self.products:
+            self.put(key, self.products[key])
+
+    def get_or_compute(self, key, func, *args, **kwargs):
+        if key in self.products:
+            return self.get(key)
+        return self.put(key, func(*args, **kwargs))
+
+    def pop(self, key):
+        if key in self.products:
+            self.nbytes -= self.sizes.pop(key)
+            return self.products.pop(key)
+        return None
+
+    def release_hdu(self, hdul_idx):
+        """Remove all the products derived from an HDU."""
+        for key in [k for k in self.products
+                    if isinstance(k, tuple) and len(k) > 1
+                    and k[1] == hdul_idx]:
+            self.pop(key)
+
+    def clear(self):
+        self.products.clear()
+        self.sizes.clear()
+        self.nbytes = 0
+
+    def _evict(self):
+        while self.nbytes > self.max_bytes and self.products:
+            key = next(iter(self.products))
+            self.pop(key)
@@ -0,0 +1,19 @@
+"""
+Base reader of raw detector frames.
+"""
+
+from ifs_tools.data_readers.reader_base import ReaderBase
+
+
+class RawBase(ReaderBase):
+    """Reader of raw frames stored as 2D (row, column) extensions."""
+
+    def read_row_band(self, hdul_idx, start, stop):
+        """Rows ``start:stop`` of a frame."""
+        return self.read_section(hdul_idx, slice(start, stop))
+
+    def read_row(self, hdul_idx, row):
+        return self.read_section(hdul_idx, (row, slice(None)))
+
+    def read_column(self, hdul_idx, column):
+        return self.read_section(hdul_idx, (slice(None), column))
@@ -0,0 +1,248 @@
+"""
+Base reader of FITS files shared by all data levels.
+
+Extensions are accessed lazily: the file is opened without reading any data,
+headers are read only up to the requested HDU, data arrays are memory-mapped
+and sections of an extension can be read without loading it entirely.
+Tile-compressed images are decompressed in parallel, and only the tiles
+covering the requested sections (see ``tile_compression``).
+"""
+
+import numpy as np
+from astropy.io import fits
+from astropy.wcs import WCS
+
+from ifs_tools.data_readers.fits_headers import read_fits_headers
+from ifs_tools.data_readers.product_cache import ProductCache
+from ifs_tools.data_readers.tile_compression import (
+    DEFAULT_WORKERS, TileDecompressor, decompressed_copy, is_compressed)
+from ifs_tools.profiling.recorder import instrumented
+
+
+class ReaderBase(object):
+    """Lazy reader of a FITS file.
+
+    Parameters
+    ----------
+    path : str
+        Path to the FITS file.
+    load_hdul : bool, optional
+        If True, the file is opened when creating the reader. Otherwise it
+        is opened the first time it is needed.
+    header_only : bool, optional
+        If True, headers are parsed directly from the file and no HDUList is
+        built (see ``ifs_tools.data_readers.fits_headers``).
+    memmap : bool, optional
+        Use memory-mapped data arrays whenever possible (scaled integer data
+        can not be memory-mapped).
+    cache_bytes : int, optional
+        Memory budget of the cache of derived products (see ``memoize``).
+    recorder : RunRecorder, optional
+        If provided, the operations reading the file are measured (see
+        ``ifs_tools.profiling.recorder``).
+    decompress_workers : int, optional
+        Number of threads decompressing tile-compressed images.
+    decompressed_cache : str, optional
+        Directory where uncompressed copies of tile-compressed files are
+        written, and read instead of the original files.
+
+    The reader can be used as a context manager, which closes the file on
+    exit.
+    """
+    def __init__(self, path, load_hdul=True, header_only=False, memmap=True,
+                 cache_bytes=None, recorder=None,
+                 decompress_workers=DEFAULT_WORKERS, decompressed_cache=None):
+        self.path = path
+        # File actually read (a decompressed copy of path, if requested)
+        self.data_path = path
+        self.recorder = recorder
+        self.decompress_workers = decompress_workers or DEFAULT_WORKERS
+        self.decompressed_cache = decompressed_cache
+        self._decompressor = None
+        self.header_only = header_only
+        self.memmap = memmap
+        self.headers = []
+        self._hdul = None
+        self.products = ProductCache(max_bytes=cache_bytes)
+        # Data arrays read in advance (see preload)
+        self.preloaded = {}
+        self.verbose(f"File path: {self.path}")
+        if load_hdul and not header_only:
+            self.load_hdul()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close_hdul()
+
+    def verbose(self, mssg, lvl='INFO'):
+        print(f"[{lvl}] {mssg}")
+
+    @instrumented()
+    def load_hdul(self):
+        self.verbose("Loading HDUL")
+        if self.decompressed_cache is not None:
+            self.data_path = decompressed_copy(
+                self.path, self.decompressed_cache,
+                workers=self.decompress_workers)
+        # memmap=None lets astropy read scaled data without memory-mapping
+        self._hdul = fits.open(self.data_path,
+                               memmap=None if self.memmap else False,
+                               lazy_load_hdus=True)
+
+    @property
+    def hdul(self):
+        if self._hdul is None:
+            self.load_hdul()
+        return self._hdul
+
+    def get_hdu(self, hdul_idx):
+        return self.hdul[hdul_idx]
+
+    def get_header(self, hdul_idx=0):
+        if not self.header_only:
+            return self.hdul[hdul_idx].header
+        if len(self.headers) <= hdul_idx:
+            self.read_headers(hdul_idx)
+        return self.headers[hdul_idx]
+
+    @instrumented()
+    def read_headers(self, hdul_idx):
+        """Parse the headers up to ``hdul_idx`` without building the HDUList."""
+        self.verbose(f"Reading headers up to HDU {hdul_idx}")
+        self.headers = read_fits_headers(self.path, hdul_idx=hdul_idx)
+
+    def get_from_header(self, list_of_kw, hdul_idx=0):
+        header = self.get_header(hdul_idx)
+        results = {}
+        for kw in list_of_kw:
+            results[kw] = header.get(kw, None)
+        return results
+
+    def get_shape(self, hdul_idx):
+        """Shape of the data of an extension, without reading it."""
+        return self.get_hdu(hdul_idx).shape
+
+    @instrumented()
+    def get_data(self, hdul_idx):
+        """Data of an extension (memory-mapped when possible).
+
+        Compressed images are decompressed in parallel and kept in memory
+        until the extension is released.
+        """
+        if hdul_idx in self.preloaded:
+            return self.preloaded[hdul_idx]
+        hdu = self.get_hdu(hdul_idx)
+        if is_compressed(hdu):
+            self.preload(hdul_idx)
+            return self.preloaded[hdul_idx]
+        return hdu.data
+
+    @property
+    def decompressor(self):
+        if self._decompressor is None:
+            self._decompressor = TileDecompressor(
+                self.data_path, workers=self.decompress_workers)
+        return self._decompressor
+
+    def get_section(self, hdul_idx):
+        """Sliceable view of the data of an extension that reads lazily."""
+        if hdul_idx in self.preloaded:
+            return self.preloaded[hdul_idx]
+        hdu = self.get_hdu(hdul_idx)
+        if is_compressed(hdu):
+            return self.decompressor.section(hdu, hdul_idx)
+        if hasattr(hdu, "section"):
+            return hdu.section
+        return hdu.data
+
+    @instrumented()
+    def read_section(self, hdul_idx, slices):
+        """Read a section of an extension without loading the full data."""
+        return np.asarray(self.get_section(hdul_idx)[slices])
+
+    def get_data_size(self, hdul_idx):
+        """Size (bytes) of the data of an extension once read."""
+        header = self.get_header(hdul_idx)
+        if header.get("NAXIS", 0) == 0:
+            return 0
+        n_values = 1
+        for axis in range(1, header["NAXIS"] + 1):
+            n_values *= header[f"NAXIS{axis}"]
+        itemsize = abs(header["BITPIX"]) // 8
+        if (header["BITPIX"] > 0 and header.get("XTENSION") != "BINTABLE"
+                and (header.get("BSCALE", 1) != 1
+                     or header.get("BZERO", 0) not in (0, 2**(8 * itemsize - 1)))):
+            # Scaled integers are read as floats
+            itemsize = 4 if itemsize <= 2 else 8
+        return n_values * itemsize
+
+    @instrumented()
+    def preload(self, hdul_idx, max_bytes=None):
+        """Read the data of an extension into memory.
+
+        Subsequent reads of the extension (``get_data``, ``get_section``,
+        ``read_section``) use the array in memory.
+
+        Parameters
+        ----------
+        max_bytes : int, optional
+            The extension is not read if its data is larger, and it is
+            read lazily instead.
+
+        Returns
+        -------
+        nbytes : int
+            Size of the data read.
+        """
+        if hdul_idx in self.preloaded:
+            return 0
+        if max_bytes is not None and self.get_data_size(hdul_idx) > max_bytes:
+            self.verbose(f"HDU {hdul_idx} does not fit in the preload budget,"
+                         + " it will be read lazily")
+            return 0
+        self.preloaded[hdul_idx] = self.read_section(hdul_idx, Ellipsis)
+        return self.preloaded[hdul_idx].nbytes
+
+    def memoize(self, key, func, *args, **kwargs):
+        """Return a derived product, computing it only if not cached.
+
+        Parameters
+        ----------
+        key : tuple
+            Product identifier, e.g. ``("wcs", hdul_idx)``. The second element
+            should be the index of the HDU it derives from.
+        func : callable
+            Function computing the product from ``*args`` and ``**kwargs``.
+        """
+        return self.products.get_or_compute(key, func, *args, **kwargs)
+
+    def get_wcs(self, hdul_idx):
+        return self.memoize(("wcs", hdul_idx), WCS, self.get_header(hdul_idx))
+
+    def release_hdu(self, hdul_idx):
+        """Free the data and derived products of an extension.
+
+        They will be read again if needed.
+        """
+        self.products.release_hdu(hdul_idx)
+        self.preloaded.pop(hdul_idx, None)
+        if self._hdul is None:
+            return
+        hdu = self._hdul[hdul_idx]
+        if "data" in hdu.__dict__:
+            self.verbose(f"Releasing data of HDU {hdul_idx}")
+            del hdu.data
+
+    def close_hdul(self):
+        self.products.clear()
+        self.preloaded.clear()
+        if self._decompressor is not None:
+            self._decompressor.close()
+            self._decompressor = None
+        if self._hdul is None:
+            return
+        self.verbose("Closing HDUL")
+        self._hdul.close()
+        self._hdul = None
@@ -0,0 +1,254 @@
+"""
+Access to tile-compressed FITS images (e.g. fpacked ``.fz`` files).
+
+Tile-compressed images are stored as binary tables where each row holds a
+compressed tile (Rice, GZIP, ...) of the image, by default one image row.
+astropy decompresses only the tiles covering a section, but always in the
+calling thread. ``TiledSection`` splits the sections spanning many tiles
+into bands of whole tiles that are decompressed by a pool of threads (the
+codecs release the GIL), each one with its own handle of the file since
+HDULists are not thread safe.
+
+Files re-QC'd often can also be decompressed once into a cache directory
+(``decompressed_copy``), whose uncompressed copies are then read like any
+other FITS file.
+"""
+
+import glob
+import hashlib
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from astropy.io import fits
+
+DEFAULT_WORKERS = min(8, os.cpu_count() or 1)
+# Keywords describing the binary table of a compressed image
+COMPRESSION_KEYWORDS = ("ZIMAGE", "ZCMPTYPE", "ZBITPIX", "ZNAXIS", "ZPCOUNT",
+                        "ZGCOUNT", "ZSIMPLE", "ZTENSION", "ZEXTEND",
+                        "ZBLOCKED", "ZQUANTIZ", "ZDITHER0", "ZHECKSUM",
+                        "ZDATASUM", "ZBLANK", "TFIELDS", "THEAP")
+INDEXED_COMPRESSION_KEYWORDS = ("ZNAXIS", "ZTILE", "ZNAME", "ZVAL", "TTYPE",
+                                "TFORM", "TUNIT", "TSCAL", "TZERO", "TNULL",
+                                "TDIM")
+
+
+def is_compressed(hdu):
+    return isinstance(hdu, fits.CompImageHDU)
+
+
+def is_compressed_header(header):
+    return bool(header.get("ZIMAGE", False))
+
+
+def image_header(header):
+    """Header of the image stored in a compressed binary table header.
+
+    Headers that do not describe a compressed image are returned unchanged.
+    """
+    if not is_compressed_header(header):
+        return header
+    image = header.copy()
+    naxis = header["ZNAXIS"]
+    image["XTENSION"] = header.get("ZTENSION", "IMAGE")
+    image["BITPIX"] = header["ZBITPIX"]
+    image["NAXIS"] = naxis
+    for i in range(1, max(naxis, header["NAXIS"]) + 1):
+        if i <= naxis:
+            image[f"NAXIS{i}"] = header[f"ZNAXIS{i}"]
+        else:
+            del image[f"NAXIS{i}"]
+    image["PCOUNT"] = header.get("ZPCOUNT", 0)
+    image["GCOUNT"] = header.get("ZGCOUNT", 1)
+    for key in list(image.keys()):
+        if key in COMPRESSION_KEYWORDS or (
+                key.rstrip("0123456789") in INDEXED_COMPRESSION_KEYWORDS
+                and key[-1].isdigit()):
+            del image[key]
+    return image
+
+
+class TileDecompressor(object):
+    """Pool of threads decompressing the tiles of the images of a file.
+
+    Parameters
+    ----------
+    path : str
+        Path to the FITS file.
+    workers : int, optional
+        Number of threads.
+    """
+    def __init__(self, path, workers=DEFAULT_WORKERS):
+        self.path = path
+        self.workers = max(workers or 1, 1)
+        self._local = threading.local()
+        self._handles = []
+        self._lock = threading.Lock()
+        self._pool = None
+
+    @property
+    def pool(self):
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self.workers)
+        return self._pool
+
+    def thread_hdul(self):
+        """HDUList of the file owned by the current thread."""
+        hdul = getattr(self._local, "hdul", None)
+        if hdul is None:
+            hdul = fits.open(self.path, lazy_load_hdus=True)
+            self._local.hdul = hdul
+            with self._lock:
+                self._handles.append(hdul)
+        return hdul
+
+    def read_band(self, hdul_idx, start, stop, key):
+        """Rows ``start:stop`` of an image, then indexed by ``key``."""
+        return np.asarray(self.thread_hdul()[hdul_idx].section[
+            (slice(start, stop),) + key])
+
+    def section(self, hdu, hdul_idx):
+        return TiledSection(self, hdu, hdul_idx)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+        with self._lock:
+            for hdul in self._handles:
+                hdul.close()
+            self._handles = []
+        self._local = threading.local()
+
+
+class TiledSection(object):
+    """Sliceable view of a compressed image decompressing in parallel.
+
+    Sections covering less than two tiles per thread are decompressed in
+    the calling thread. Larger ones are split into bands along the first
+    axis, aligned with the tiles, that are decompressed and indexed by the
+    threads, so the memory used is that of the output plus one band per
+    thread.
+    """
+    def __init__(self, decompressor, hdu, hdul_idx):
+        self.decompressor = decompressor
+        self.hdu = hdu
+        self.hdul_idx = hdul_idx
+        self.shape = hdu.shape
+        self.ndim = len(self.shape)
+        self.tile_rows = int(hdu.tile_shape[0])
+        self._dtype = None
+
+    @property
+    def dtype(self):
+        if self._dtype is None:
+            self._dtype = np.asarray(
+                self.hdu.section[(slice(0, 1),)]).dtype
+        return self._dtype
+
+    def bands(self, start, stop):
+        """Ranges of rows, aligned with the tiles, of each thread."""
+        n_tiles = (-(-stop // self.tile_rows) - start // self.tile_rows)
+        tiles_per_band = -(-n_tiles // self.decompressor.workers)
+        edges = list(range(
+            (start // self.tile_rows + tiles_per_band) * self.tile_rows,
+            stop, tiles_per_band * self.tile_rows))
+        edges = [start] + edges + [stop]
+        return list(zip(edges[:-1], edges[1:]))
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        if key == (Ellipsis,) or key == ():
+            key = (slice(None),)
+        first, rest = key[0], key[1:]
+        if not isinstance(first, slice):
+            # A single row (or fancy indexing) of the first axis
+            return self.hdu.section[key]
+        start, stop, step = first.indices(self.shape[0])
+        if (step < 0 or stop - start < 2 * self.tile_rows
+                * self.decompressor.workers):
+            return self.hdu.section[key]
+        bands = self.bands(start, stop)
+        parts = list(self.decompressor.pool.map(
+            lambda band: self.decompressor.read_band(
+                self.hdul_idx, *band, rest), bands))
+        # Apply the step from the first row of the section
+        output = np.concatenate(parts, axis=0)
+        return output[::step] if step > 1 else output
+
+
+def copy_stem(path):
+    """Name shared by the decompressed copies of a file (basename and a
+    short hash of its absolute path)."""
+    name = os.path.basename(path)
+    for suffix in (".fz", ".fits", ".fit"):
+        if name.endswith(suffix):
+            name = name[:-len(suffix)]
+    path_hash = hashlib.sha1(os.path.abspath(path).encode()).hexdigest()[:8]
+    return f"{name}_{path_hash}"
+
+
+def copy_name(path):
+    """Name of the decompressed copy of a file in the cache directory."""
+    stat = os.stat(path)
+    version = f"{stat.st_size}:{stat.st_mtime_ns}"
+    return (f"{copy_stem(path)}_"
+            + f"{hashlib.sha1(version.encode()).hexdigest()[:12]}.fits")
+
+
+def remove_stale_copies(path, cache_dir):
+    """Remove the copies of previous versions of a file."""
+    current = copy_name(path)
+    pattern = glob.escape(copy_stem(path)) + "_" + "[0-9a-f]" * 12 + ".fits"
+    for stale in glob.glob(os.path.join(cache_dir, pattern)):
+        if os.path.basename(stale) == current:
+            continue
+        try:
+            os.remove(stale)
+            print(f"[INFO] Removed outdated decompressed copy {stale}")
+        except OSError:
+            # Removed by a concurrent run
+            pass
+
+
+def decompressed_copy(path, cache_dir, workers=DEFAULT_WORKERS):
+    """Path to an uncompressed copy of a file, written if needed.
+
+    Copies are identified by the path, size and modification time of the
+    original file, so modified files are decompressed again, and the copies
+    of their previous versions are removed. Files without compressed images
+    are not copied (their own path is returned).
+    """
+    copy_path = os.path.join(cache_dir, copy_name(path))
+    if os.path.isfile(copy_path):
+        return copy_path
+    # Imported here, fits_headers uses the header conversion of this module
+    from ifs_tools.data_readers.fits_headers import iter_fits_headers
+    # Headers are parsed without building the HDUList
+    if not any(header.get("ZIMAGE", False)
+               for header in iter_fits_headers(path)):
+        return path
+    with fits.open(path, lazy_load_hdus=False) as hdul:
+        print(f"[INFO] Writing a decompressed copy of {path} in {cache_dir}")
+        decompressor = TileDecompressor(path, workers=workers)
+        try:
+            hdus = []
+            for hdul_idx, hdu in enumerate(hdul):
+                if is_compressed(hdu):
+                    hdus.append(fits.ImageHDU(
+                        data=decompressor.section(hdu, hdul_idx)[...],
+                        header=hdu.header))
+                else:
+                    hdus.append(hdu)
+            os.makedirs(cache_dir, exist_ok=True)
+            # Written under a temporary name so that concurrent runs never
+            # read an incomplete copy
+            tmp_path = f"{copy_path}.{os.getpid()}.tmp"
+            fits.HDUList(hdus).writeto(tmp_path, overwrite=True)
+            os.replace(tmp_path, copy_path)
+        finally:
+            decompressor.close()
+    remove_stale_copies(path, cache_dir)
+    return copy_path
@@ -0,0 +1,18 @@
+"""
+This module provides the basic utilities to manipulate WEAVE L2 products.
+"""
+
+from ifs_tools.data_readers.prod_base import ProdBase
+
+class WEAVEProd(ProdBase):
+    """WEAVE L2 product, with the fitted quantities of each spaxel or target
+    stored in binary table extensions.
+    """
+
+if __name__ == "__main__":
+    import sys
+    prod = WEAVEProd(sys.argv[1])
+
+    for hdul_idx in prod.get_table_hdus():
+        print(prod.get_hdu(hdul_idx).name, prod.get_n_rows(hdul_idx),
+              prod.get_column_names(hdul_idx))
@@ -0,0 +1,139 @@
+"""
+Incremental master index of the QC reports of an output directory.
+
+Every report is appended as a JSON line to the shard of its observing night
+(``index_entries/<night>.jsonl``) as soon as it is completed, so adding a file
+does not depend on the size of the archive. The HTML view is made of one
+page per night (``index_<night>.html``) plus a top ``index.html`` linking all
+nights, and only the nights that received new entries need to be rendered.
+"""
+
+from datetime import datetime, timedelta
+from glob import glob
+import json
+import os
+import re
+
+from ifs_tools.html_tools.utils import HTMLPage
+
+ENTRIES_DIR = "index_entries"
+UNKNOWN_NIGHT = "unknown"
+# Links of the HTML pages written without JSON sidecar
+LINK_PATTERN = re.compile(r"""<a\s+href=["']([^"']*)["']\s*>(.*?)</a>""",
+                          re.IGNORECASE | re.DOTALL)
+
+
+def get_night(date_obs, ut=None):
+    """Observing night (date at the start of the night) of a DATE-OBS value.
+
+    If DATE-OBS is only a date, it is completed with the UT keyword value.
+    Frames taken before noon are assigned to the previous night.
+    """
+    if not date_obs:
+        return UNKNOWN_NIGHT
+    date_obs = str(date_obs).strip()
+    if "T" not in date_obs and ut:
+        date_obs = f"{date_obs}T{str(ut).strip()}"
+    try:
+        date = datetime.fromisoformat(date_obs)
+    except ValueError:
+        return UNKNOWN_NIGHT
+    if "T" not in date_obs:
+        # Only the date is available
+        return date.strftime("%Y%m%d")
+    return (date - timedelta(hours=12)).strftime("%Y%m%d")
+
+
+class MasterIndex(object):
+    """Append-only index of the QC reports stored in an output directory."""
+    def __init__(self, output_dir, title="QC reports"):
+        self.output_dir = output_dir
+        self.title = title
+        self.entries_dir = os.path.join(output_dir, ENTRIES_DIR)
+        self.updated_nights = set()
+
+    def shard_path(self, night):
+        return os.path.join(self.entries_dir, f"{night}.jsonl")
+
+    def nights(self):
+        return sorted(os.path.basename(path)[:-6] for path in
+                      glob(os.path.join(self.entries_dir, "*.jsonl")))
+
+    def is_empty(self):
+        return len(self.nights()) == 0
+
+    def add(self, file_path, href, name, night=UNKNOWN_NIGHT):
+        """Append the report of a file to the index."""
+        os.makedirs(self.entries_dir, exist_ok=True)
+        entry = {"file": os.path.abspath(file_path), "href": href,
+                 "name": name, "night": night}
+        with open(self.shard_path(night), "a") as f:
+            f.write(json.dumps(entry) + "\n")
+        self.updated_nights.add(night)
+
+    def import_page(self, page):
+        """Add the references of a previous master HTMLPage.
+
+        The links of pages saved without JSON sidecar (loaded as raw HTML)
+        are parsed from their body.
+        """
+        references = []
+        for section in page.sections:
+            if section["type"] == "reference":
+                references.append((section["path"], section["name"]))
+            elif section["type"] == "html":
+                references.extend(LINK_PATTERN.findall(section["content"]))
+        for href, name in references:
+            self.add(os.path.join(self.output_dir, href), href, name.strip())
+
+    def load_night(self, night):
+        """Entries of a night, keeping only the latest one of each file.
+
+        Shards containing duplicated entries are compacted.
+        """
+        entries = {}
+        n_lines = 0
+        with open(self.shard_path(night), "r") as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    entries[entry["file"]] = entry
+                    n_lines += 1
+        entries = [entries[k] for k in sorted(entries)]
+        if n_lines > len(entries):
+            tmp_path = self.shard_path(night) + ".tmp"
+            with open(tmp_path, "w") as f:
+                f.writelines(json.dumps(entry) + "\n" for entry in entries)
+            os.replace(tmp_path, self.shard_path(night))
+        return entries
+
+    def render(self, nights=None):
+        """Write the HTML pages of the given nights and the top index.
+
+        By default, only the nights updated since the index was created are
+        rendered.
+        """
+        if nights is None:
+            nights = sorted(self.updated_nights)
+        for night in nights:
+            page = HTMLPage(title=f"{self.title} (night {night})")
+            for entry in self.load_night(night):
+                page.add_reference(entry["href"], entry["name"])
+            page.save_page(os.path.join(self.output_dir,
+                                        f"index_{night}.html"))
+        page = HTMLPage(title=self.title)
+        for night in self.nights():
+            page.add_reference(f"index_{night}.html", f"Night {night}")
+        page.save_page(os.path.join(self.output_dir, "index.html"))
+        self.updated_nights.clear()
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(
+        description="Rebuild the HTML view of a QC master index")
+    parser.add_argument("output", type=str,
+                        help="Output directory of the QC runs")
+    args = parser.parse_args()
+    master_index = MasterIndex(args.output)
+    master_index.render(master_index.nights())
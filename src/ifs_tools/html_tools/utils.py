@@ -1,3 +1,7 @@
+import json
+import os
+
+import numpy as np
 
 def create_html_image(image_path):
     return f'<img src="{image_path}" alt="Image">'
@@ -11,14 +15,16 @@ def create_html_section(title, contents):
     </section>"""
 
 def create_html_table(data):
-    html = "<table style=\"border:1px solid black;border-collapse:collapse; width:60%\">\n"
+    rows = ["<table style=\"border:1px solid black;border-collapse:collapse; width:60%\">\n"]
     for row in data:
-        html +="<tr style=\"border:1px solid black\">"
-        for entry in row:
-            html += f"<td>{entry}</td>"
-        html += "</tr>\n"
-    html += "</table>"
-    return html
+        rows.append("<tr style=\"border:1px solid black\">"
+                    + "".join(f"<td>{entry}</td>" for entry in row)
+                    + "</tr>\n")
+    rows.append("</table>")
+    return "".join(rows)
+
+def create_html_reference(path, name):
+    return f"<a href=\"{path}\">{name}</a><br />\n"
 
 def create_html_page(title="UNKNOWN", content=""):
     html_template = f'''
@@ -35,49 +41,93 @@ def create_html_page(title="UNKNOWN", content=""):
     '''
     return html_template
 
+def get_sidecar_path(path):
+    """Path to the JSON file storing the content of an HTML page."""
+    return os.path.splitext(path)[0] + ".json"
+
+def to_json_entry(entry):
+    """Convert a table entry into a JSON serializable value."""
+    if entry is None or isinstance(entry, (str, bool, int, float)):
+        return entry
+    if isinstance(entry, np.generic):
+        return entry.item()
+    return str(entry)
+
+def render_section(section):
+    """Render a section of an HTMLPage."""
+    if section["type"] == "table":
+        return create_html_section(section["title"],
+                                   create_html_table(section["data"]))
+    elif section["type"] == "plot":
+        return create_html_section(section["title"],
+                                   create_html_image(section["img_path"]))
+    elif section["type"] == "reference":
+        return create_html_reference(section["path"], section["name"])
+    elif section["type"] == "html":
+        return section["content"]
+    raise ValueError(f"Unknown section type: {section['type']}")
+
 class HTMLPage(object):
+    """HTML report made of an ordered list of sections.
+
+    The page is only rendered when saved, together with a JSON sidecar file
+    containing its sections, which is used to reopen the page.
+    """
     def __init__(self, path=None, title="", content="") -> None:
+        self.title = title
+        self.sections = []
         if path is not None:
             self.load_page(path)
-        else:
-            self.title = title
-            self.page_src = create_html_page(title, content)
+        elif content:
+            self.add_content(content)
+
+    @property
+    def page_src(self):
+        return create_html_page(
+            self.title, "".join(render_section(s) for s in self.sections))
 
     def load_page(self, path):
         print(f"Loading HTML page: {path}")
-        f = open(path, "r")
-        self.page_src = f.read()
-
-        title_pos_ini = self.page_src.find("<title>")
-        title_pos_end = self.page_src.find("</title>")
-        self.title = self.page_src[title_pos_ini + 7:title_pos_end]
+        sidecar_path = get_sidecar_path(path)
+        if os.path.isfile(sidecar_path):
+            with open(sidecar_path, "r") as f:
+                content = json.load(f)
+            self.title = content["title"]
+            self.sections = content["sections"]
+            return
+        # Pages without sidecar: keep the body as raw HTML
+        with open(path, "r") as f:
+            page_src = f.read()
+        title_pos_ini = page_src.find("<title>")
+        title_pos_end = page_src.find("</title>")
+        self.title = page_src[title_pos_ini + 7:title_pos_end]
+        body_pos_ini = page_src.find("</h1>") + 5
+        body_pos_end = page_src.find("</body>")
+        self.sections = []
+        self.add_content(page_src[body_pos_ini:body_pos_end])
 
     def add_reference(self, path, name="name"):
-        print("Including reference {path}")
-        pos = self.page_src.find("</body>")
-        self.page_src = (self.page_src[:pos]
-                         + f"<a href=\"{path}\">{name}</a><br />\n"
-                         + self.page_src[pos:])
-    
+        print(f"Including reference {path}")
+        self.sections.append({"type": "reference", "path": path,
+                              "name": name})
+
     def add_table_section(self, title, data, desc=""):
-        pos = self.page_src.find("</body>")
-        table_html = create_html_table(data)
-        section_html = create_html_section(
-            title, table_html)
-        self.page_src = (self.page_src[:pos]
-                         + section_html
-                         + self.page_src[pos:])
+        self.sections.append({
+            "type": "table", "title": title,
+            "data": [[to_json_entry(entry) for entry in row]
+                     for row in data]})
 
     def add_plot_section(self, title, img_path, desc=""):
-        pos = self.page_src.find("</body>")
-        plot_html = create_html_image(img_path)
-        section_html = create_html_section(
-            title, plot_html)
-        self.page_src = (self.page_src[:pos]
-                         + section_html
-                         + self.page_src[pos:])
+        self.sections.append({"type": "plot", "title": title,
+                              "img_path": img_path})
+
+    def add_content(self, html):
+        """Include raw HTML content at the end of the page."""
+        self.sections.append({"type": "html", "content": html})
 
     def save_page(self, output_path):
         print(f"Saving page as {output_path}")
         with open(output_path, "w") as f:
             f.write(self.page_src)
+        with open(get_sidecar_path(output_path), "w") as f:
+            json.dump({"title": self.title, "sections": self.sections}, f)
@@ -0,0 +1,232 @@
+"""
+Figures of the QC tests.
+
+Each function draws a QC figure on an empty ``matplotlib.figure.Figure``
+using only the plot data computed by the test (numpy arrays, scalars and
+strings), so figures can be rendered in a different thread or process than
+the one that computed the data. pyplot is not used.
+"""
+
+import numpy as np
+from matplotlib.colors import LogNorm
+
+
+def plot_raw_display(fig, panels):
+    """Image of each raw extension with the profiles of some rows and columns.
+
+    Parameters
+    ----------
+    panels : list of dict
+        One dictionary per extension with ``name``, ``image``, ``extent``,
+        ``shape``, ``vmin``, ``vmax``, ``label`` and the ``rows`` and
+        ``columns`` profiles (lists of ``(index, profile, color)``).
+    """
+    axs = fig.subplots(nrows=len(panels), ncols=1,
+                       gridspec_kw=dict(wspace=0.5))
+    for ax, panel in zip(np.atleast_1d(axs), panels):
+        ax.set_title(panel["name"])
+        mappable = ax.imshow(panel["image"], cmap='nipy_spectral',
+                             norm=LogNorm(vmin=panel["vmin"],
+                                          vmax=panel["vmax"]),
+                             origin='lower', extent=panel["extent"])
+        if panel["extent"] is not None:
+            ax.set_xlim(-0.5, panel["shape"][1] - 0.5)
+            ax.set_ylim(-0.5, panel["shape"][0] - 0.5)
+
+        for index, _, color in panel["rows"]:
+            ax.axhline(index, color=color, ls='--', lw=2)
+        for index, _, color in panel["columns"]:
+            ax.axvline(index, color=color, ls='--', lw=2)
+
+        for i, (_, column, color) in enumerate(panel["columns"]):
+            inax = ax.inset_axes((1.05 + 0.2 * i, 0, 0.15, 1))
+            inax.plot(column, np.arange(column.size), c=color, lw=0.7)
+            inax.set_ylim(ax.get_ylim())
+            inax.set_yticklabels([])
+
+        for i, (_, row, color) in enumerate(panel["rows"]):
+            inax = ax.inset_axes((0, 1.05 + 0.2 * i, 1, 0.15))
+            inax.plot(row, c=color, lw=0.7)
+            inax.set_xlim(ax.get_ylim())
+            inax.set_xticklabels([])
+
+        fig.colorbar(mappable, ax=ax, label=panel["label"], location='left')
+
+
+def plot_raw_profiles(fig, panels):
+    """Collapsed column and row profiles of each raw extension.
+
+    Parameters
+    ----------
+    panels : list of dict
+        One dictionary per extension with ``name``, ``method``, the
+        ``column_profile`` and ``row_profile``, and the indices of the
+        ``bad_columns`` and ``bad_rows``.
+    """
+    axs = fig.subplots(nrows=len(panels), ncols=2, squeeze=False)
+    for ax_pair, panel in zip(axs, panels):
+        for ax, axis in zip(ax_pair, ("column", "row")):
+            profile = panel[f"{axis}_profile"]
+            bad = panel[f"bad_{axis}s"]
+            ax.plot(profile, c="k", lw=0.5)
+            ax.plot(bad, profile[bad], "o", c="r", mfc="none",
+                    label=f"{len(bad)} bad {axis}s")
+            ax.set_xlabel(axis.capitalize())
+            ax.set_ylabel(f"{panel['method']} (ADU)")
+            ax.set_title(f"{panel['name']} {axis} profile")
+            ax.legend(loc="upper right", fontsize=8)
+
+
+def plot_histograms(fig, panels):
+    """Full and zoomed histogram of each extension.
+
+    Parameters
+    ----------
+    panels : list of dict
+        One dictionary per extension with the ``coarse`` and ``zoom``
+        histograms (``(counts, edges)``), ``percentiles``, ``mean``,
+        ``sigma`` and ``nsigma``.
+    """
+    axs = fig.subplots(nrows=len(panels), ncols=2)
+    for ax_pair, panel in zip(np.atleast_2d(axs), panels):
+        ax = ax_pair[0]
+        h, xedges = panel["coarse"]
+        ax.hist(xedges[:-1], bins=xedges, weights=h, log=True)
+        ax.set_title(", ".join(f"P{q}={p:.1f}" for q, p in
+                               panel["percentiles"].items()))
+        ax.set_xlabel("Counts/ADU")
+
+        mean, sigma = panel["mean"], panel["sigma"]
+        inax = ax_pair[1]
+        inax.set_title(f"mean={mean:.1f} +- {panel['nsigma']}*{sigma:.1f}")
+        h, xedges = panel["zoom"]
+        inax.hist(xedges[:-1], bins=xedges, weights=h, log=True)
+        if np.isfinite(mean) and sigma > 0:
+            inax.set_xlim(mean - 5 * sigma, mean + 5 * sigma)
+        inax.set_xlabel("Counts/ADU")
+        inax.set_yscale('log')
+
+
+def plot_white_image(fig, image, wcs, title, label):
+    """White image of a cube in celestial coordinates."""
+    ax = fig.add_subplot(111, projection=wcs)
+    ax.set_title(title)
+    mappable = ax.imshow(image, cmap='Spectral', norm=LogNorm())
+    fig.colorbar(mappable, ax=ax, label=label)
+
+
+def plot_ranked_spectra(fig, wavelength, spectra):
+    """Spectra of the spaxels at several percentiles of the median flux.
+
+    Parameters
+    ----------
+    wavelength : np.ndarray
+    spectra : list
+        List of ``(percentile, flux, ivar)``.
+    """
+    axs = fig.subplots(nrows=len(spectra), ncols=1, sharex=True)
+    for (pct, flux, ivar), ax in zip(spectra, np.atleast_1d(axs)):
+        ax.fill_between(wavelength, flux - 1/ivar**0.5,
+                        flux + 1/ivar**0.5, alpha=0.5, color='r')
+        ax.plot(wavelength, flux, lw=0.7, color="k")
+        ax.axhline(np.nanmedian(flux), c='k', alpha=0.3)
+        ax.set_ylabel(f"Flux [{pct}]", fontsize=8)
+        ax.annotate(f"Rank: {pct}", xy=(0.05, 0.95),
+                    xycoords='axes fraction', va='top', ha='left')
+
+
+def _unix_to_datetime(time):
+    time = np.asarray(time, dtype=float)
+    dates = np.full(time.shape, np.datetime64("NaT"), dtype="datetime64[ms]")
+    finite = np.isfinite(time)
+    dates[finite] = (time[finite] * 1e3).astype("int64").astype(
+        "datetime64[ms]")
+    return dates
+
+
+def plot_metric_trends(fig, time, metrics, title=""):
+    """Scalar QC metrics of a night against time.
+
+    Parameters
+    ----------
+    time : np.ndarray
+        Unix time of each file.
+    metrics : list
+        List of ``(name, values, flags)``, where ``flags`` is True for the
+        outliers.
+    """
+    dates = _unix_to_datetime(time)
+    if not np.isfinite(np.asarray(time, dtype=float)).any():
+        # Without observation times, files are shown in order
+        dates = np.arange(len(time))
+    axs = fig.subplots(nrows=len(metrics), ncols=1, sharex=True)
+    for (name, values, flags), ax in zip(metrics, np.atleast_1d(axs)):
+        ax.plot(dates, values, ".-", color="k", lw=0.5)
+        ax.plot(dates[flags], values[flags], "o", color="r", mfc="none",
+                label="Outlier")
+        ax.axhline(np.nanmedian(values) if np.isfinite(values).any()
+                   else 0, c="k", alpha=0.3)
+        ax.set_ylabel(name, fontsize=8)
+    np.atleast_1d(axs)[0].set_title(title)
+    fig.autofmt_xdate()
+
+
+def plot_metric_history(fig, nights, metrics, title=""):
+    """Nightly median of the scalar QC metrics.
+
+    Parameters
+    ----------
+    nights : np.ndarray
+        Date of each night (``datetime64``).
+    metrics : list
+        List of ``(name, median, sigma)`` with the values of every night.
+    """
+    axs = fig.subplots(nrows=len(metrics), ncols=1, sharex=True)
+    for (name, median, sigma), ax in zip(metrics, np.atleast_1d(axs)):
+        ax.errorbar(nights, median, yerr=sigma, fmt="o-", color="k",
+                    lw=0.5, ms=3, capsize=2)
+        ax.set_ylabel(name, fontsize=8)
+    np.atleast_1d(axs)[0].set_title(title)
+    fig.autofmt_xdate()
+
+
+def plot_error_distributions(fig, edges, panels, title=""):
+    """Distribution of the errors of some table columns and of their S/N.
+
+    Parameters
+    ----------
+    edges : np.ndarray
+        Edges (log10) of the histograms.
+    panels : list of dict
+        One dictionary per column with its ``name``, ``error_name`` and the
+        ``error_hist`` and ``snr_hist`` histograms.
+    """
+    axs = fig.subplots(nrows=len(panels), ncols=2,
+                       gridspec_kw=dict(hspace=0.4))
+    for ax_pair, panel in zip(np.atleast_2d(axs), panels):
+        for ax, key, label in zip(ax_pair, ("error_hist", "snr_hist"),
+                                  (panel["error_name"],
+                                   f"|{panel['name']}| / {panel['error_name']}")):
+            counts = panel[key]
+            used = np.flatnonzero(counts)
+            if used.size == 0:
+                ax.set_xlabel(label)
+                continue
+            # Only the range of the bins with counts
+            lo, hi = used[0], used[-1] + 2
+            ax.stairs(counts[lo:hi - 1], 10**edges[lo:hi], fill=True,
+                      color="k", alpha=0.5)
+            ax.set_xscale("log")
+            ax.set_xlabel(label)
+    np.atleast_2d(axs)[0][0].set_title(title)
+
+
+# Figures that can be requested through ``PlotRenderer.submit``
+PLOTS = {"raw_display": plot_raw_display,
+         "raw_profiles": plot_raw_profiles,
+         "histograms": plot_histograms,
+         "white_image": plot_white_image,
+         "ranked_spectra": plot_ranked_spectra,
+         "metric_trends": plot_metric_trends,
+         "metric_history": plot_metric_history,
+         "error_distributions": plot_error_distributions}
@@ -0,0 +1,153 @@
+"""
+Rendering of the QC figures outside of the tests.
+
+QC tests compute the data of their figures and submit it to a
+``PlotRenderer``, which draws and encodes the PNG files with the Agg backend
+in a pool of worker processes. The tests (and the following files) continue
+while the earlier figures are still being written.
+"""
+
+import os
+import traceback
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
+
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+from ifs_tools.plot_tools.qc_plots import PLOTS
+
+# Figures kept for reuse by the current process, by (kind, figsize)
+_figures = {}
+
+
+def _get_figure(kind, figsize, reuse):
+    if not reuse:
+        fig = Figure(figsize=figsize)
+        FigureCanvasAgg(fig)
+        return fig
+    fig = _figures.get((kind, figsize))
+    if fig is None:
+        fig = Figure(figsize=figsize)
+        FigureCanvasAgg(fig)
+        _figures[(kind, figsize)] = fig
+    else:
+        fig.clear()
+    return fig
+
+
+def render_plot(kind, output, figsize, data, dpi=None, compress_level=None,
+                reuse_figure=False, **savefig_kwargs):
+    """Draw a QC figure and save it as a PNG file.
+
+    Parameters
+    ----------
+    kind : str
+        Name of the figure (see ``ifs_tools.plot_tools.qc_plots.PLOTS``).
+    output : str
+        Path to the PNG file.
+    figsize : tuple
+        Size of the figure in inches.
+    data : dict
+        Keyword arguments of the plotting function.
+    dpi : float, optional
+        Resolution of the PNG file. Default is the figure resolution.
+    compress_level : int, optional
+        zlib compression level (0-9) of the PNG file. Lower levels are
+        faster to encode but produce larger files.
+    reuse_figure : bool, optional
+        If True, the figure object is kept and cleared for the next figure of
+        the same kind and size, instead of creating a new one.
+    **savefig_kwargs :
+        Extra arguments of ``Figure.savefig`` (e.g. ``bbox_inches``).
+
+    Returns
+    -------
+    output : str
+    """
+    fig = _get_figure(kind, tuple(figsize), reuse_figure)
+    PLOTS[kind](fig, **data)
+    if dpi is not None:
+        savefig_kwargs["dpi"] = dpi
+    if compress_level is not None:
+        savefig_kwargs["pil_kwargs"] = {"compress_level": compress_level}
+    fig.savefig(output, **savefig_kwargs)
+    if reuse_figure:
+        fig.clear()
+    return output
+
+
+class PlotRenderer(object):
+    """Pool of processes rendering QC figures.
+
+    Parameters
+    ----------
+    workers : int, optional
+        Number of rendering processes. If 0, figures are rendered as soon as
+        they are submitted, in the calling thread.
+    dpi : float, optional
+        Resolution of the PNG files.
+    compress_level : int, optional
+        zlib compression level (0-9) of the PNG files.
+    reuse_figures : bool, optional
+        Reuse the figure objects across files.
+    """
+    def __init__(self, workers=1, dpi=None, compress_level=None,
+                 reuse_figures=False):
+        self.workers = workers
+        self.render_kwargs = dict(dpi=dpi, compress_level=compress_level,
+                                  reuse_figure=reuse_figures)
+        self.executor = None
+        if workers > 0:
+            # Workers are spawned since the QC may already run other threads
+            self.executor = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn"))
+
+    def submit(self, kind, output, figsize, savefig_kwargs=None, **data):
+        """Request a figure.
+
+        Returns
+        -------
+        future : concurrent.futures.Future
+            Future returning the path to the PNG file.
+        """
+        if savefig_kwargs is None:
+            savefig_kwargs = {}
+        args = (kind, output, figsize, data)
+        kwargs = dict(self.render_kwargs, **savefig_kwargs)
+        if self.executor is not None:
+            return self.executor.submit(render_plot, *args, **kwargs)
+        future = Future()
+        try:
+            future.set_result(render_plot(*args, **kwargs))
+        except Exception as error:
+            future.set_exception(error)
+        return future
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+
+
+def wait_plots(futures):
+    """Wait until the figures are written.
+
+    Returns
+    -------
+    failed : list
+        Paths to the figures that could not be rendered.
+    """
+    failed = []
+    for output, future in futures:
+        try:
+            future.result()
+        except Exception as error:
+            traceback.print_exception(type(error), error,
+                                      error.__traceback__)
+            print(f"[ERROR] Could not render figure {output}")
+            failed.append(output)
+            if os.path.isfile(output):
+                os.remove(output)
+    return failed
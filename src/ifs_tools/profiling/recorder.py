@@ -0,0 +1,250 @@
+"""
+Instrumentation of the QC runs.
+
+A ``RunRecorder`` measures blocks of code, i.e. the QC tests and the
+operations of the readers decorated with ``instrumented``. Each measurement
+records:
+
+- ``wall`` and ``cpu`` time (s). CPU time is that of the whole process, so
+  it includes any thread running meanwhile (e.g. in pipeline mode).
+- ``rss_increase``: increase of the peak resident memory of the process
+  (bytes). It is zero unless the block sets a new peak.
+- ``io_read`` and ``disk_read``: bytes read through system calls (including
+  those served by the page cache) and bytes fetched from storage, from
+  ``/proc/self/io`` (Linux only). Memory-mapped data only contributes to
+  ``disk_read``.
+- ``data_bytes``: size of the arrays returned by the reader operations (for
+  tests, the sum of their reader operations).
+
+Optionally, each test can also be profiled with cProfile.
+"""
+
+import cProfile
+import contextlib
+import json
+import os
+import sys
+import threading
+import time
+from functools import wraps
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+
+IO_COUNTERS_PATH = "/proc/self/io"
+
+
+def get_max_rss():
+    """Peak resident memory of the process in bytes (None if unknown)."""
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is given in kB (bytes on macOS)
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+def get_io_counters():
+    """Bytes read by the process (``rchar``, ``read_bytes``) or Nones."""
+    try:
+        with open(IO_COUNTERS_PATH, "r") as f:
+            counters = dict(line.split(":") for line in f)
+        return int(counters["rchar"]), int(counters["read_bytes"])
+    except (OSError, KeyError, ValueError):
+        return None, None
+
+
+def _difference(end, start):
+    if end is None or start is None:
+        return None
+    return end - start
+
+
+class RunRecorder(object):
+    """Measurements of the QC of a single file.
+
+    Parameters
+    ----------
+    profile_dir : str, optional
+        If provided, tests measured with ``profile=True`` are profiled with
+        cProfile and their statistics are dumped in this directory as
+        ``profile_<test>.prof``.
+    """
+    def __init__(self, profile_dir=None):
+        self.profile_dir = profile_dir
+        self.records = []
+        self.start_wall = time.perf_counter()
+        self.start_cpu = time.process_time()
+        self._local = threading.local()
+
+    @property
+    def stack(self):
+        """Measurements in progress in the current thread."""
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    def active(self, kind):
+        """Whether a measurement of this kind is in progress in this thread."""
+        return any(record["kind"] == kind for record in self.stack)
+
+    @contextlib.contextmanager
+    def measure(self, kind, name, profile=False):
+        """Measure a block of code.
+
+        Parameters
+        ----------
+        kind : str
+            Type of operation (e.g. "test" or "reader").
+        name : str
+            Name of the operation.
+        profile : bool, optional
+            Profile the block with cProfile (see ``profile_dir``).
+
+        Yields
+        ------
+        record : dict
+            Measurements, filled when the block exits.
+        """
+        stack = self.stack
+        record = {"kind": kind, "name": name,
+                  "parent": stack[-1]["name"] if stack else None,
+                  "start": time.time(), "data_bytes": 0}
+        profiler = None
+        if profile and self.profile_dir is not None:
+            profiler = cProfile.Profile()
+        rss = get_max_rss()
+        io_read, disk_read = get_io_counters()
+        cpu = time.process_time()
+        wall = time.perf_counter()
+        stack.append(record)
+        if profiler is not None:
+            profiler.enable()
+        try:
+            yield record
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            stack.pop()
+            record["wall"] = time.perf_counter() - wall
+            record["cpu"] = time.process_time() - cpu
+            record["rss_increase"] = _difference(get_max_rss(), rss)
+            end_io_read, end_disk_read = get_io_counters()
+            record["io_read"] = _difference(end_io_read, io_read)
+            record["disk_read"] = _difference(end_disk_read, disk_read)
+            if stack:
+                stack[-1]["data_bytes"] += record["data_bytes"]
+            if profiler is not None:
+                record["profile"] = os.path.join(self.profile_dir,
+                                                 f"profile_{name}.prof")
+                profiler.dump_stats(record["profile"])
+            self.records.append(record)
+
+    def add_cached(self, name):
+        """Record a test whose results were taken from the cache."""
+        self.records.append({"kind": "test", "name": name, "parent": None,
+                             "start": time.time(), "cached": True,
+                             "wall": 0.0, "cpu": 0.0, "data_bytes": 0,
+                             "rss_increase": 0, "io_read": 0,
+                             "disk_read": 0})
+
+    def summary_table(self):
+        """Table summarising the measurements.
+
+        Tests are listed individually, the rest of operations are grouped by
+        kind and name. The last row gives the totals since the recorder was
+        created.
+        """
+        def megabytes(value):
+            return "-" if value is None else f"{value / 2**20:.1f}"
+
+        def row(name, records):
+            rss = [r["rss_increase"] for r in records
+                   if r["rss_increase"] is not None]
+            io_read = [r["io_read"] for r in records
+                       if r["io_read"] is not None]
+            disk_read = [r["disk_read"] for r in records
+                         if r["disk_read"] is not None]
+            return [name, len(records),
+                    f"{sum(r['wall'] for r in records):.3f}",
+                    f"{sum(r['cpu'] for r in records):.3f}",
+                    megabytes(sum(rss) if rss else None),
+                    megabytes(sum(io_read) if io_read else None),
+                    megabytes(sum(disk_read) if disk_read else None)]
+
+        table = [["Operation", "Calls", "Wall (s)", "CPU (s)",
+                  "Peak RSS increase (MB)", "Read (MB)", "Disk read (MB)"]]
+        groups = {}
+        for record in self.records:
+            if record["kind"] == "test":
+                name = record["name"]
+                if record.get("cached"):
+                    name += " (cached)"
+                table.append(row(name, [record]))
+            else:
+                groups.setdefault(f"{record['kind']}: {record['name']}",
+                                  []).append(record)
+        for name, records in groups.items():
+            table.append(row(name, records))
+        table.append([f"Total (process peak RSS: {megabytes(get_max_rss())} MB)",
+                      "", f"{time.perf_counter() - self.start_wall:.3f}",
+                      f"{time.process_time() - self.start_cpu:.3f}",
+                      "", "", ""])
+        return table
+
+    def write_log(self, path, **info):
+        """Append the measurements to a JSON-lines run log.
+
+        Parameters
+        ----------
+        path : str
+            Path to the run log.
+        **info :
+            Fields added to every line (e.g. the run and file names).
+        """
+        lines = "".join(json.dumps(dict(info, **record)) + "\n"
+                        for record in self.records)
+        # A single write on a file opened in append mode, so lines of files
+        # processed by other processes are not interleaved
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, lines.encode())
+        finally:
+            os.close(fd)
+
+
+def measure(recorder, kind, name, profile=False):
+    """``recorder.measure`` or a context doing nothing if recorder is None."""
+    if recorder is None:
+        return contextlib.nullcontext()
+    return recorder.measure(kind, name, profile=profile)
+
+
+def instrumented(kind="reader"):
+    """Decorator measuring a method with the ``recorder`` of its instance.
+
+    Operations nested within another of the same kind are not recorded.
+    """
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self, *args, **kwargs):
+            recorder = getattr(self, "recorder", None)
+            if recorder is None or recorder.active(kind):
+                return method(self, *args, **kwargs)
+            with recorder.measure(kind, method.__name__) as record:
+                output = method(self, *args, **kwargs)
+                if isinstance(output, int):
+                    # Number of bytes read (e.g. ReaderBase.preload)
+                    record["data_bytes"] = output
+                elif isinstance(output, dict):
+                    # Arrays of several columns (e.g. ProdBase.read_columns)
+                    record["data_bytes"] = sum(
+                        getattr(value, "nbytes", 0)
+                        for value in output.values())
+                else:
+                    record["data_bytes"] = getattr(output, "nbytes", 0)
+            return output
+        return wrapper
+    return decorator
@@ -0,0 +1,112 @@
+"""
+Bounded-memory statistics of IFS datacubes.
+
+The cube is streamed in spatial tiles (all wavelengths of a band of rows) so
+that only a small fraction of it is held in memory at any time, while every
+spaxel summary is computed in a single pass over the data.
+"""
+
+import warnings
+
+import numpy as np
+
+# Default memory cap (bytes) used when reading a cube
+DEFAULT_MAX_MEMORY = 256 * 2**20
+# Approximate number of temporary copies of a tile made while computing
+# the statistics (data section, NaN mask, nanmedian copy...)
+TILE_MEMORY_FACTOR = 4
+
+
+def read_section(data, slices):
+    """Read a section of an HDU, or array, without loading the full data."""
+    if hasattr(data, "section"):
+        return np.asarray(data.section[slices])
+    return np.asarray(data[slices])
+
+
+def iter_spatial_tiles(shape, itemsize, max_memory=DEFAULT_MAX_MEMORY,
+                       n_arrays=1):
+    """Split the spatial dimensions of a cube into tiles within a memory cap.
+
+    Tiles are bands of full rows when possible, which keeps the reads
+    contiguous. If a single row does not fit, rows are split along x.
+
+    Parameters
+    ----------
+    shape : tuple
+        Cube shape (nwave, ny, nx).
+    itemsize : int
+        Number of bytes per element.
+    max_memory : int
+        Maximum number of bytes used by the tiles.
+    n_arrays : int
+        Number of cubes read simultaneously for each tile.
+
+    Yields
+    ------
+    slices : tuple
+        y and x slices of each tile.
+    """
+    nwave, ny, nx = shape
+    spaxel_bytes = nwave * itemsize * n_arrays * TILE_MEMORY_FACTOR
+    n_spaxels = max(int(max_memory // spaxel_bytes), 1)
+    if n_spaxels >= nx:
+        n_rows = min(n_spaxels // nx, ny)
+        for y0 in range(0, ny, n_rows):
+            yield slice(y0, min(y0 + n_rows, ny)), slice(0, nx)
+    else:
+        for y0 in range(ny):
+            for x0 in range(0, nx, n_spaxels):
+                yield slice(y0, y0 + 1), slice(x0, min(x0 + n_spaxels, nx))
+
+
+def cube_spaxel_statistics(flux_hdu, ivar_hdu=None,
+                           max_memory=DEFAULT_MAX_MEMORY):
+    """Compute per-spaxel summaries of a datacube in a single pass.
+
+    Parameters
+    ----------
+    flux_hdu : astropy.io.fits.ImageHDU or array-like
+        Flux cube with shape (nwave, ny, nx). Arrays, or any sliceable object
+        with ``shape`` and ``dtype``, can also be used.
+    ivar_hdu : astropy.io.fits.ImageHDU or array-like, optional
+        Inverse variance cube used to compute the S/N.
+    max_memory : int
+        Maximum number of bytes used while reading the cube.
+
+    Returns
+    -------
+    stats : dict
+        Maps with the ``median``, ``mean``, ``nan_fraction`` and, if
+        ``ivar_hdu`` is provided, the median ``snr`` of each spaxel.
+    """
+    shape = flux_hdu.shape
+    if hasattr(flux_hdu, "header"):
+        itemsize = abs(flux_hdu.header["BITPIX"]) // 8
+    else:
+        itemsize = np.dtype(flux_hdu.dtype).itemsize
+    n_arrays = 1 if ivar_hdu is None else 2
+    stats = {"median": np.full(shape[1:], np.nan),
+             "mean": np.full(shape[1:], np.nan),
+             "nan_fraction": np.ones(shape[1:])}
+    if ivar_hdu is not None:
+        stats["snr"] = np.full(shape[1:], np.nan)
+
+    with warnings.catch_warnings():
+        # Fully masked spaxels are expected (e.g. outside the FoV)
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        for sy, sx in iter_spatial_tiles(shape, itemsize, max_memory,
+                                         n_arrays=n_arrays):
+            flux = read_section(flux_hdu, (slice(None), sy, sx))
+            finite = np.isfinite(flux)
+            stats["nan_fraction"][sy, sx] = 1 - finite.mean(axis=0)
+            stats["mean"][sy, sx] = np.nanmean(flux, axis=0)
+            stats["median"][sy, sx] = np.nanmedian(flux, axis=0)
+            if ivar_hdu is not None:
+                ivar = read_section(ivar_hdu, (slice(None), sy, sx))
+                snr = flux * np.sqrt(np.clip(ivar, 0, None))
+                snr[~finite] = np.nan
+                stats["snr"][sy, sx] = np.nanmedian(snr, axis=0)
+                del ivar, snr
+            del flux, finite
+    return stats
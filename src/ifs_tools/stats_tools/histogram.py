@@ -0,0 +1,363 @@
+"""
+Histograms and moments of 2D frames read in blocks of rows.
+
+The frame is read once, accumulating a fine histogram from which the coarse
+and zoomed histograms and the percentiles are derived. For 8 and 16-bit
+integer frames (e.g. raw CCD frames) the fine histogram has one bin per ADU,
+so every derived quantity is exact after this single pass.
+
+For other frames, the mean, standard deviation and coarse histogram are
+exact after the first pass (the fine bins are nested within the coarse
+ones), but the zoomed histogram and the percentiles are not: the zoom range
+is only known at the end, and the fine bins can be wider than the zoomed
+ones. A second pass over the frame gives them exactly: the zoomed histogram
+is computed on the pixel values, and so are the percentiles from the values
+of the fine bins that contain them. Without the second pass, or if more than
+``MAX_BRACKET_VALUES`` pixels fall in the fine bin of a percentile, they are
+estimated from a regular subsample of the pixels kept in the first pass.
+"""
+
+import numpy as np
+
+from ifs_tools.stats_tools.cube_stats import DEFAULT_MAX_MEMORY
+from ifs_tools.stats_tools.preview import DEFAULT_MAX_SAMPLES
+
+# Number of fine bins per coarse bin used for non-integer frames
+FINE_BINS_PER_BIN = 640
+# Approximate number of temporary copies of a block of rows
+BLOCK_MEMORY_FACTOR = 4
+# Maximum number of values kept in the second pass to locate a percentile
+MAX_BRACKET_VALUES = DEFAULT_MAX_SAMPLES
+
+
+def iter_row_blocks(data, max_memory=DEFAULT_MAX_MEMORY, itemsize=8):
+    """Iterate over blocks of rows of a 2D array within a memory cap.
+
+    ``data`` can be any sliceable object with a ``shape``, such as an array,
+    a memory-mapped array or an HDU ``section``.
+    """
+    nrows, ncols = data.shape
+    block_rows = max(int(max_memory
+                         // (ncols * itemsize * BLOCK_MEMORY_FACTOR)), 1)
+    for r0 in range(0, nrows, block_rows):
+        yield np.asarray(data[r0:r0 + block_rows])
+
+
+def _exact_histogram(values, counts, bins, hist_range):
+    """Histogram of a set of discrete values with their number of counts."""
+    return np.histogram(values, bins=bins, range=hist_range, weights=counts)
+
+
+def _percentiles_from_counts(values, counts, q):
+    """Percentiles (linear interpolation) of sorted values with counts."""
+    cum = np.cumsum(counts)
+    n = cum[-1]
+    rank = np.asarray(q, dtype=float) / 100 * (n - 1)
+    lower = np.floor(rank)
+    v_lo = values[np.searchsorted(cum, lower + 1)]
+    v_hi = values[np.searchsorted(cum, np.minimum(lower + 2, n))]
+    return v_lo + (rank - lower) * (v_hi - v_lo)
+
+
+class FrameHistogram(object):
+    """Accumulator of the fine histogram and moments of a frame.
+
+    Blocks of the frame are added with ``update``, and accumulators of
+    different parts of a frame (e.g. computed by several threads) are
+    combined with ``merge``. For non-integer frames, if ``needs_second_pass``,
+    the blocks can then be read again after ``start_second_pass``: the
+    contribution of each block is computed with ``second_pass`` and added
+    with ``add_second_pass``.
+
+    Parameters
+    ----------
+    dtype : np.dtype
+        Type of the frame.
+    bins : int
+        Number of bins of the coarse and zoomed histograms.
+    hist_range : tuple
+        Range of the coarse histogram.
+    """
+    def __init__(self, dtype, bins=100, hist_range=(-1000, 70000)):
+        dtype = np.dtype(dtype)
+        self.bins = bins
+        self.hist_range = hist_range
+        self.integer = (np.issubdtype(dtype, np.integer)
+                        and dtype.itemsize <= 2)
+        if self.integer:
+            self.offset = int(np.iinfo(dtype).min)
+            self.fine_counts = np.zeros(2**(8 * dtype.itemsize),
+                                        dtype=np.int64)
+        else:
+            self.fine_counts = np.zeros(bins * FINE_BINS_PER_BIN,
+                                        dtype=np.int64)
+        # Number of finite values, mean and sum of squared deviations
+        self.n, self.mean, self.m2 = 0, 0.0, 0.0
+        # Finite values below and above hist_range, and subsample of every
+        # sample_step values, for the percentiles
+        self.n_below, self.n_above = 0, 0
+        self.sample_step = 1
+        self.samples = []
+        # State of the second pass
+        self.refinement = None
+
+    @property
+    def nbytes(self):
+        return self.fine_counts.nbytes + sum(s.nbytes for s in self.samples)
+
+    def _add_samples(self, samples, step):
+        """Add samples taken every ``step`` values (a power of 2)."""
+        if step > self.sample_step:
+            self.samples = [s[::step // self.sample_step].copy()
+                            for s in self.samples]
+            self.sample_step = step
+        self.samples.append(samples[::self.sample_step // step].copy())
+        while sum(s.size for s in self.samples) > DEFAULT_MAX_SAMPLES:
+            self.samples = [s[::2].copy() for s in self.samples]
+            self.sample_step *= 2
+
+    def update(self, block):
+        block = np.asarray(block)
+        if self.integer:
+            if self.offset == 0:
+                self.fine_counts += np.bincount(
+                    block.ravel(), minlength=self.fine_counts.size)
+            else:
+                self.fine_counts += np.bincount(
+                    block.ravel().astype(np.int32) - self.offset,
+                    minlength=self.fine_counts.size)
+            return
+        block = block[np.isfinite(block)].astype(float)
+        if block.size == 0:
+            return
+        mean = block.mean()
+        # Sums of deviations from the block mean avoid cancellation errors
+        self._combine(block.size, mean, np.sum((block - mean)**2))
+        counts = np.histogram(block, bins=self.fine_counts.size,
+                              range=self.hist_range)[0]
+        self.fine_counts += counts
+        n_below = np.count_nonzero(block < self.hist_range[0])
+        self.n_below += n_below
+        self.n_above += block.size - counts.sum() - n_below
+        self._add_samples(block[::self.sample_step], self.sample_step)
+
+    def _combine(self, n, mean, m2):
+        total = self.n + n
+        delta = mean - self.mean
+        self.mean += delta * n / total
+        self.m2 += m2 + delta**2 * self.n * n / total
+        self.n = total
+
+    def merge(self, other):
+        self.fine_counts += other.fine_counts
+        if other.n:
+            self._combine(other.n, other.mean, other.m2)
+        self.n_below += other.n_below
+        self.n_above += other.n_above
+        for samples in other.samples:
+            self._add_samples(samples, other.sample_step)
+        return self
+
+    @property
+    def needs_second_pass(self):
+        """Whether a second pass is needed for the exact zoomed histogram and
+        percentiles."""
+        return not self.integer and self.n > 0
+
+    def start_second_pass(self, nsigma=3, percentiles=(1, 5, 50, 95, 99)):
+        """Prepare the second pass, after every block has been added.
+
+        ``result`` is then exact for the same ``nsigma`` and ``percentiles``.
+        """
+        sigma = np.sqrt(self.m2 / self.n)
+        # Order statistics needed by the percentiles (linear interpolation)
+        rank = np.asarray(percentiles, dtype=float) / 100 * (self.n - 1)
+        lower = np.floor(rank).astype(np.int64)
+        orders = np.unique(np.concatenate(
+            [lower, np.minimum(lower + 1, self.n - 1)]))
+        # Bin of each one in the fine histogram, with an underflow (0) and an
+        # overflow (last) bin
+        counts = np.concatenate([[self.n_below], self.fine_counts,
+                                 [self.n_above]])
+        order_bins = np.searchsorted(np.cumsum(counts), orders, side="right")
+        edges = np.linspace(*self.hist_range, self.fine_counts.size + 1)
+        # Margin for the rounding of the bins of np.histogram: the values
+        # below each bracket are counted, so any bracket containing the bin
+        # gives the exact order statistics
+        margin = 1e-6 * (edges[1] - edges[0])
+        edges = np.concatenate([[-np.inf], edges, [np.inf]])
+        brackets = {}
+        for b in np.unique(order_bins):
+            if counts[b] <= MAX_BRACKET_VALUES:
+                brackets[int(b)] = (edges[b] - margin, edges[b + 1] + margin)
+        self.refinement = {
+            "nsigma": nsigma, "percentiles": tuple(percentiles),
+            "zoom_range": (self.mean - nsigma * sigma,
+                           self.mean + nsigma * sigma),
+            "zoom": np.zeros(self.bins, dtype=np.int64),
+            "zoom_edges": np.histogram_bin_edges(
+                [], bins=self.bins, range=(self.mean - nsigma * sigma,
+                                           self.mean + nsigma * sigma)),
+            "orders": dict(zip(orders.tolist(), order_bins.tolist())),
+            "brackets": brackets,
+            "n_below": dict.fromkeys(brackets, 0),
+            "values": {b: [] for b in brackets}}
+
+    def second_pass(self, block):
+        """Contribution of a block to the second pass.
+
+        It does not modify the accumulator, so that blocks can be processed
+        by several threads.
+        """
+        block = np.asarray(block)
+        block = block[np.isfinite(block)].astype(float)
+        refinement = self.refinement
+        zoom = np.histogram(block, bins=self.bins,
+                            range=refinement["zoom_range"])[0]
+        brackets = {}
+        for b, (lo, hi) in refinement["brackets"].items():
+            brackets[b] = (np.count_nonzero(block < lo),
+                           block[(block >= lo) & (block <= hi)])
+        return zoom, brackets
+
+    def add_second_pass(self, contribution):
+        zoom, brackets = contribution
+        refinement = self.refinement
+        refinement["zoom"] += zoom
+        for b, (n_below, values) in brackets.items():
+            refinement["n_below"][b] += n_below
+            refinement["values"][b].append(values)
+
+    def _exact_percentiles(self, percentiles):
+        """Percentiles from the order statistics found in the second pass.
+
+        Those that can not be located are None.
+        """
+        refinement = self.refinement
+        if "order_values" not in refinement:
+            # Only the order statistics are kept once they are located
+            order_values = {}
+            for order, b in refinement["orders"].items():
+                if b not in refinement["brackets"]:
+                    continue
+                values = np.sort(np.concatenate(refinement["values"][b]))
+                position = order - refinement["n_below"][b]
+                if 0 <= position < values.size:
+                    order_values[order] = values[position]
+            refinement["order_values"] = order_values
+            del refinement["values"], refinement["n_below"]
+        order_values = refinement["order_values"]
+        exact = {}
+        for q in percentiles:
+            rank = q / 100 * (self.n - 1)
+            lower = int(np.floor(rank))
+            upper = min(lower + 1, self.n - 1)
+            if lower in order_values and upper in order_values:
+                v_lo, v_hi = order_values[lower], order_values[upper]
+                exact[q] = v_lo + (rank - lower) * (v_hi - v_lo)
+            else:
+                exact[q] = None
+        return exact
+
+    def result(self, nsigma=3, percentiles=(1, 5, 50, 95, 99)):
+        """Histograms and statistics of the frame.
+
+        See ``frame_statistics``. For non-integer frames, the zoomed
+        histogram and the percentiles are estimated from the subsample of
+        the pixels unless the second pass has been done with the same
+        ``nsigma`` and ``percentiles`` (see the module documentation).
+        """
+        bins, hist_range = self.bins, self.hist_range
+        fine_counts = self.fine_counts
+        stats = {}
+        n = fine_counts.sum() if self.integer else self.n
+        if n == 0:
+            # No finite pixels
+            edges = np.linspace(*hist_range, bins + 1)
+            stats["coarse"] = (np.zeros(bins, dtype=np.int64), edges)
+            stats["zoom"] = (np.zeros(bins, dtype=np.int64), edges.copy())
+            stats["mean"], stats["sigma"], stats["n_pixels"] = (
+                np.nan, np.nan, 0)
+            stats["percentiles"] = dict.fromkeys(percentiles, np.nan)
+            return stats
+        if self.integer:
+            values = np.arange(fine_counts.size) + self.offset
+            mean = np.sum(fine_counts * values.astype(float)) / n
+            sigma = np.sqrt(np.sum(fine_counts * (values - mean)**2) / n)
+            stats["coarse"] = _exact_histogram(values, fine_counts, bins,
+                                               hist_range)
+            stats["zoom"] = _exact_histogram(values, fine_counts, bins,
+                                             (mean - nsigma * sigma,
+                                              mean + nsigma * sigma))
+            stats["percentiles"] = dict(zip(
+                percentiles, _percentiles_from_counts(values, fine_counts,
+                                                      percentiles)))
+        else:
+            mean = self.mean
+            sigma = np.sqrt(self.m2 / n)
+            # Fine histogram bins are nested within the coarse ones
+            stats["coarse"] = (
+                fine_counts.reshape(bins, FINE_BINS_PER_BIN).sum(axis=1),
+                np.linspace(*hist_range, bins + 1))
+            refinement = self.refinement
+            zoom_range = (mean - nsigma * sigma, mean + nsigma * sigma)
+            samples = np.concatenate(self.samples)
+            if refinement is not None and refinement["nsigma"] == nsigma:
+                stats["zoom"] = (refinement["zoom"].copy(),
+                                 refinement["zoom_edges"].copy())
+            else:
+                counts, edges = np.histogram(samples, bins=bins,
+                                             range=zoom_range)
+                stats["zoom"] = (counts * n / samples.size, edges)
+            exact = {}
+            if refinement is not None:
+                exact = self._exact_percentiles(percentiles)
+            estimated = [q for q in percentiles if exact.get(q) is None]
+            if estimated:
+                exact.update(zip(estimated,
+                                 np.percentile(samples, estimated)))
+            stats["percentiles"] = {q: exact[q] for q in percentiles}
+        stats["mean"], stats["sigma"], stats["n_pixels"] = mean, sigma, n
+        return stats
+
+
+def frame_statistics(data, bins=100, hist_range=(-1000, 70000), nsigma=3,
+                     percentiles=(1, 5, 50, 95, 99),
+                     max_memory=DEFAULT_MAX_MEMORY):
+    """Compute histograms and statistics of a frame.
+
+    Integer frames of 8 or 16 bits are read once, other frames twice (see
+    the module documentation), and every result is exact.
+
+    Parameters
+    ----------
+    data : array-like
+        2D frame. It is only accessed through row slices.
+    bins : int
+        Number of bins of the coarse and zoomed histograms.
+    hist_range : tuple
+        Range of the coarse histogram.
+    nsigma : float
+        Half width of the zoomed histogram range in units of sigma.
+    percentiles : tuple
+        Percentiles to compute.
+    max_memory : int
+        Maximum number of bytes used by each block of rows.
+
+    Returns
+    -------
+    stats : dict
+        ``mean``, ``sigma``, ``n_pixels`` (finite), ``percentiles`` (dict),
+        and the ``coarse`` and ``zoom`` histograms as (counts, edges) pairs.
+    """
+    histogram = None
+    for block in iter_row_blocks(data, max_memory=max_memory):
+        if histogram is None:
+            histogram = FrameHistogram(block.dtype, bins=bins,
+                                       hist_range=hist_range)
+        histogram.update(block)
+    if histogram.needs_second_pass:
+        histogram.start_second_pass(nsigma=nsigma, percentiles=percentiles)
+        for block in iter_row_blocks(data, max_memory=max_memory):
+            histogram.add_second_pass(histogram.second_pass(block))
+    return histogram.result(nsigma=nsigma, percentiles=percentiles)
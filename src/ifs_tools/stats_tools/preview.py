@@ -0,0 +1,150 @@
+"""
+Downsampled previews of large images used for plotting.
+
+Images are block-reduced to (about) the display resolution before being sent
+to matplotlib, and the colour limits are computed on a regular subsample of
+the image. Previews of an image are organised as a pyramid of reduction
+factors (powers of 2), so coarser levels are derived from finer ones
+whenever possible.
+"""
+
+import warnings
+
+import numpy as np
+
+from ifs_tools.stats_tools.cube_stats import DEFAULT_MAX_MEMORY
+
+# Default maximum number of pixels along each axis of a preview
+DEFAULT_PREVIEW_SIZE = 1024
+# Default maximum number of pixels used to compute percentiles
+DEFAULT_MAX_SAMPLES = 10**6
+
+REDUCE_FUNCTIONS = {"mean": np.nanmean, "max": np.nanmax,
+                    "median": np.nanmedian}
+
+
+def get_reduction_factor(shape, preview_size=DEFAULT_PREVIEW_SIZE):
+    """Smallest power of 2 reducing an image to at most preview_size pixels per axis."""
+    factor = 1
+    while max(shape) / factor > preview_size:
+        factor *= 2
+    return factor
+
+
+def block_reduce(data, factor, method="mean", max_memory=DEFAULT_MAX_MEMORY):
+    """Reduce a 2D image by combining blocks of factor x factor pixels.
+
+    The image is read in bands of rows, so ``data`` can also be an HDU
+    ``section``. Incomplete blocks at the edges are padded with NaN.
+
+    Parameters
+    ----------
+    data : array-like
+        2D image.
+    factor : int
+        Size of the blocks.
+    method : str
+        Reduction applied to each block: "mean", "max" or "median" (NaN
+        values are ignored).
+    max_memory : int
+        Approximate maximum number of bytes read at once.
+
+    Returns
+    -------
+    reduced : np.ndarray
+    """
+    if factor == 1:
+        return np.asarray(data[:], dtype=float)
+    reduce = REDUCE_FUNCTIONS[method]
+    ny, nx = data.shape
+    out_ny, out_nx = -(-ny // factor), -(-nx // factor)
+    reduced = np.full((out_ny, out_nx), np.nan)
+    # Number of output rows computed per band of input rows
+    band_rows = max(int(max_memory // (factor * out_nx * factor * 8 * 2)), 1)
+    with warnings.catch_warnings():
+        # Fully masked blocks are expected
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        for j0 in range(0, out_ny, band_rows):
+            j1 = min(j0 + band_rows, out_ny)
+            band = np.full(((j1 - j0) * factor, out_nx * factor), np.nan)
+            values = np.asarray(data[j0 * factor:j1 * factor])
+            band[:values.shape[0], :nx] = values
+            band = band.reshape(j1 - j0, factor, out_nx, factor)
+            reduced[j0:j1] = reduce(band, axis=(1, 3))
+    return reduced
+
+
+def subsample_percentile(data, q, max_samples=DEFAULT_MAX_SAMPLES):
+    """Percentiles of a 2D image estimated on a regular subsample.
+
+    The image is sampled every ``step`` pixels along each axis, with the
+    step chosen so that at most ``max_samples`` pixels are used.
+    """
+    ny, nx = data.shape
+    step = max(int(np.ceil(np.sqrt(ny * nx / max_samples))), 1)
+    # Sampled rows are read whole: strided reads of HDU sections are done
+    # element by element
+    sample = np.array([np.asarray(data[j])[::step]
+                       for j in range(0, ny, step)], dtype=float)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        return np.nanpercentile(sample, q)
+
+
+class PreviewPyramid(object):
+    """Cache of the reduced versions of an image.
+
+    Parameters
+    ----------
+    data : array-like
+        2D image (array, memory-mapped array or HDU ``section``).
+    max_memory : int
+        Approximate maximum number of bytes read at once.
+    """
+    def __init__(self, data, max_memory=DEFAULT_MAX_MEMORY):
+        self.data = data
+        self.shape = data.shape
+        self.max_memory = max_memory
+        self.levels = {}
+        self.percentiles = {}
+
+    @property
+    def nbytes(self):
+        return sum(level.nbytes for level in self.levels.values())
+
+    def get_level(self, factor, method="mean"):
+        """Image reduced by ``factor`` (a power of 2)."""
+        key = (factor, method)
+        if key not in self.levels:
+            finer = factor // 2
+            if method != "median" and factor > 1 and (
+                    (finer, method) in self.levels):
+                # Combine 2 x 2 blocks of the previous level (NaN values
+                # and the edges are not weighted, mean is approximate)
+                self.levels[key] = block_reduce(
+                    self.levels[(finer, method)], 2, method=method)
+            else:
+                self.levels[key] = block_reduce(
+                    self.data, factor, method=method,
+                    max_memory=self.max_memory)
+        return self.levels[key]
+
+    def get_preview(self, preview_size=DEFAULT_PREVIEW_SIZE, method="mean"):
+        """Preview with at most ``preview_size`` pixels per axis.
+
+        Returns
+        -------
+        preview : np.ndarray
+        factor : int
+            Reduction factor of the preview.
+        """
+        factor = get_reduction_factor(self.shape, preview_size)
+        return self.get_level(factor, method), factor
+
+    def get_percentiles(self, q, max_samples=DEFAULT_MAX_SAMPLES):
+        """Percentiles of the full resolution image (estimated on a subsample)."""
+        key = (tuple(np.atleast_1d(q)), max_samples)
+        if key not in self.percentiles:
+            self.percentiles[key] = subsample_percentile(
+                self.data, q, max_samples=max_samples)
+        return self.percentiles[key]
@@ -0,0 +1,433 @@
+"""
+Statistics of raw CCD frames.
+
+The frame is split into regions (strips of rows or columns) processed by a
+pool of threads, numpy releasing the GIL in the heavy operations, to compute:
+
+- the collapse of every row and column (median or sigma-clipped mean), and
+  the rows and columns deviating from their neighbours (bad columns),
+- the bias level and noise of the overscan, and the median level of the
+  data section, of each amplifier,
+- the number of hot pixels and cosmic-ray pixels. A single frame can not
+  tell them apart: pixels well above the mean of their four neighbours are
+  outliers, isolated outliers are counted as hot pixel candidates and those
+  with outlying neighbours as cosmic-ray pixels,
+- the fraction of saturated pixels,
+- optionally, the histogram of the pixel values and a block-reduced preview
+  of the frame (see ``raw_frame_statistics``).
+
+Each strip of rows is processed in a single pass (profile, defects,
+histogram and preview). Non-finite pixels are ignored by the medians, and
+rows or columns without finite pixels have NaN profiles. Frames that do not
+fit in memory are read lazily, in strips within a memory budget. Only the histograms of non-integer frames need a
+second pass over the rows (see ``ifs_tools.stats_tools.histogram``).
+"""
+
+import os
+import re
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from ifs_tools.stats_tools.histogram import FrameHistogram
+from ifs_tools.stats_tools.preview import block_reduce
+
+DEFAULT_WORKERS = min(8, os.cpu_count() or 1)
+# Default layout: amplifiers side by side along the columns, each with an
+# overscan strip on its outer edge
+DEFAULT_AMPLIFIERS = 2
+DEFAULT_OVERSCAN = 50
+# Header keywords giving the number of amplifiers of a CCD
+AMPLIFIER_KEYWORDS = ("NAMPS", "NUMAMPS", "NAMP", "AMPLIFIE")
+MAX_AMPLIFIERS = 16
+# Number of regions per thread, for load balancing
+REGIONS_PER_WORKER = 4
+# Window (pixels) of the running median of the row and column profiles
+PROFILE_WINDOW = 15
+# Pixels used to estimate the noise of a region
+NOISE_SAMPLE_STEP = 7
+# Approximate number of bytes used per pixel of a strip being processed
+# (float32 copies and masks)
+STRIP_BYTES_PER_PIXEL = 32
+
+
+def finite_median(values, axis=None, keepdims=False):
+    """Median of the finite values (NaN if there are none)."""
+    finite = np.isfinite(values)
+    if finite.all():
+        return np.median(values, axis=axis, keepdims=keepdims)
+    with warnings.catch_warnings():
+        # Rows or columns without finite pixels are expected (e.g. masked)
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        return np.nanmedian(np.where(finite, values, np.nan), axis=axis,
+                            keepdims=keepdims)
+
+
+def robust_sigma(values):
+    values = values[np.isfinite(values)]
+    if values.size == 0:
+        return np.nan
+    return 1.4826 * np.median(np.abs(values - np.median(values)))
+
+
+def parse_section(section):
+    """Slices of an IRAF-style section ``[x1:x2,y1:y2]`` (1-based)."""
+    match = re.fullmatch(r"\s*\[(\d+):(\d+),(\d+):(\d+)\]\s*", str(section))
+    if match is None:
+        raise ValueError(f"Invalid section {section}")
+    x1, x2, y1, y2 = (int(v) for v in match.groups())
+    return (slice(min(y1, y2) - 1, max(y1, y2)),
+            slice(min(x1, x2) - 1, max(x1, x2)))
+
+
+def read_rows(data, rows, columns=slice(None), step=1, chunk_rows=None):
+    """Every ``step`` rows of a region of a frame.
+
+    If ``chunk_rows`` is given, the region is read in chunks of about that
+    many rows, which bounds the memory used to read lazy sections.
+    """
+    start, stop, _ = rows.indices(data.shape[0])
+    if chunk_rows is None or stop <= start:
+        return np.asarray(data[start:stop, columns])[::step]
+    chunk_rows = max(chunk_rows // step, 1) * step
+    return np.concatenate([
+        np.asarray(data[r0:min(r0 + chunk_rows, stop), columns])[::step]
+        for r0 in range(start, stop, chunk_rows)])
+
+
+def amplifier_layout(shape, header=None, n_amplifiers=DEFAULT_AMPLIFIERS,
+                     overscan=DEFAULT_OVERSCAN):
+    """Data and overscan regions of the amplifiers of a CCD.
+
+    The layout is read from the header when possible:
+
+    - indexed sections, DATASECn and BIASSECn (n = 1, 2...) or DATASECx and
+      BIASSECx (x = A, B...), one pair per amplifier,
+    - DATASEC and BIASSEC, for a single amplifier unless the header gives a
+      larger number of amplifiers (``AMPLIFIER_KEYWORDS``).
+
+    Otherwise, the layout is guessed: ``n_amplifiers`` amplifiers (or the
+    number given by the header) read adjacent strips of columns, with
+    ``overscan`` columns on their outer edge (left for the first half of
+    the amplifiers, right for the rest).
+
+    Returns
+    -------
+    amplifiers : list of dict
+        ``name``, ``data`` and ``overscan`` (tuples of slices) of each one,
+        and ``guessed`` (True if the layout is not given by the header).
+    """
+    if header is None:
+        header = {}
+    for suffixes in (range(1, MAX_AMPLIFIERS + 1),
+                     [chr(ord("A") + i) for i in range(MAX_AMPLIFIERS)]):
+        amplifiers = []
+        for i, suffix in enumerate(suffixes):
+            data = header.get(f"DATASEC{suffix}")
+            bias = header.get(f"BIASSEC{suffix}")
+            if not data or not bias:
+                break
+            amplifiers.append({"name": chr(ord("A") + i),
+                               "data": parse_section(data),
+                               "overscan": parse_section(bias),
+                               "guessed": False})
+        if amplifiers:
+            return amplifiers
+
+    header_amplifiers = None
+    for key in AMPLIFIER_KEYWORDS:
+        value = header.get(key)
+        if isinstance(value, int) and not isinstance(value, bool) \
+                and value > 0:
+            header_amplifiers = value
+            break
+    if (header.get("DATASEC") and header.get("BIASSEC")
+            and (header_amplifiers is None or header_amplifiers == 1)):
+        return [{"name": "A", "data": parse_section(header["DATASEC"]),
+                 "overscan": parse_section(header["BIASSEC"]),
+                 "guessed": False}]
+    if header_amplifiers is not None:
+        n_amplifiers = header_amplifiers
+    ny, nx = shape
+    edges = np.linspace(0, nx, n_amplifiers + 1).astype(int)
+    amplifiers = []
+    for i, (c0, c1) in enumerate(zip(edges[:-1], edges[1:])):
+        width = min(overscan, (c1 - c0) // 2)
+        if i < n_amplifiers / 2:
+            data, bias = slice(c0 + width, c1), slice(c0, c0 + width)
+        else:
+            data, bias = slice(c0, c1 - width), slice(c1 - width, c1)
+        amplifiers.append({"name": chr(ord("A") + i),
+                           "data": (slice(None), data),
+                           "overscan": (slice(None), bias),
+                           "guessed": True})
+    return amplifiers
+
+
+def collapse(block, axis, method="median", nsigma=3):
+    """Median or sigma-clipped mean of the finite values of a block along an
+    axis."""
+    block = np.asarray(block, dtype=np.float32)
+    median = finite_median(block, axis=axis, keepdims=True)
+    if method == "median":
+        return np.squeeze(median, axis=axis)
+    if method != "clipped_mean":
+        raise ValueError(f"Unknown collapse method {method}")
+    sigma = 1.4826 * finite_median(np.abs(block - median), axis=axis,
+                                   keepdims=True)
+    # Comparisons with NaN are False, non-finite values are never kept
+    keep = np.abs(block - median) <= nsigma * np.maximum(sigma, 1e-6)
+    n_kept = np.sum(keep, axis=axis)
+    return np.where(n_kept > 0, np.sum(np.where(keep, block, 0), axis=axis)
+                    / np.maximum(n_kept, 1), np.nan)
+
+
+def profile_deviation(profile, window=PROFILE_WINDOW):
+    """Deviation of a profile from its running median (robust sigma).
+
+    NaN values of the profile have no deviation.
+    """
+    half = window // 2
+    padded = np.pad(profile, half, mode="edge")
+    trend = finite_median(np.lib.stride_tricks.sliding_window_view(
+        padded, window), axis=1)
+    residual = profile - trend
+    finite = np.isfinite(residual)
+    sigma = robust_sigma(residual)
+    if not sigma > 0 and finite.any():
+        # Quantised profiles (e.g. medians of integer frames)
+        sigma = np.std(residual[finite])
+    if not sigma > 0:
+        return np.zeros_like(residual)
+    return np.where(finite, residual / sigma, 0)
+
+
+def pixel_defects(data, r0, r1, bias=0., read_noise=1., gain=1., nsigma=5,
+                  contrast=2, saturation=np.inf):
+    """Outliers and saturated pixels of the rows ``r0:r1`` of a frame.
+
+    A pixel is an outlier if it exceeds the mean of its four neighbours by
+    more than ``nsigma`` times the expected noise (read noise and Poisson
+    noise of the neighbours) and, above the bias, is at least ``contrast``
+    times brighter than them, which rejects resolved features such as
+    fibre traces or sky lines.
+
+    Returns
+    -------
+    n_hot, n_cosmic, n_saturated : int
+    """
+    ny = data.shape[0]
+    # Two rows of margin: the outliers of the rows next to the strip (for the
+    # neighbour counts) are detected with their own neighbours
+    lo, hi = max(r0 - 2, 0), min(r1 + 2, ny)
+    block = np.asarray(data[lo:hi], dtype=np.float32)
+    strip = block[r0 - lo:r1 - lo]
+    n_saturated = int(np.count_nonzero((strip >= saturation)
+                                       & np.isfinite(strip)))
+    padded = np.pad(block, 1, mode="edge")
+    neighbours = (padded[:-2, 1:-1] + padded[2:, 1:-1]
+                  + padded[1:-1, :-2] + padded[1:-1, 2:]) / 4 - bias
+    signal = np.maximum(neighbours, 0)
+    # Noise of the difference between a pixel and the mean of four others
+    noise = np.sqrt(1.25 * (read_noise**2 + signal / gain))
+    excess = block - bias
+    # Non-finite pixels and their neighbours are never outliers
+    with np.errstate(invalid="ignore"):
+        outlier = ((excess - neighbours > nsigma * noise)
+                   & (excess > contrast * np.maximum(signal, noise))
+                   & (block < saturation))
+    padded = np.pad(outlier, 1).astype(np.uint8)
+    n_neighbours = sum(padded[1 + dy:padded.shape[0] - 1 + dy,
+                              1 + dx:padded.shape[1] - 1 + dx]
+                       for dy in (-1, 0, 1) for dx in (-1, 0, 1)
+                       if dy or dx)
+    rows = slice(r0 - lo, r1 - lo)
+    outlier, n_neighbours = outlier[rows], n_neighbours[rows]
+    n_hot = int(np.count_nonzero(outlier & (n_neighbours == 0)))
+    n_cosmic = int(np.count_nonzero(outlier & (n_neighbours > 0)))
+    return n_hot, n_cosmic, n_saturated
+
+
+def raw_frame_statistics(data, header=None, method="median", nsigma=5,
+                         contrast=2, saturation=None,
+                         n_amplifiers=DEFAULT_AMPLIFIERS,
+                         overscan=DEFAULT_OVERSCAN, bad_nsigma=5,
+                         workers=DEFAULT_WORKERS, histogram=False,
+                         hist_bins=100, hist_range=(-1000, 70000),
+                         hist_nsigma=3,
+                         hist_percentiles=(1, 5, 50, 95, 99),
+                         preview_factor=None, max_memory=None):
+    """Row, column, amplifier and pixel statistics of a raw frame.
+
+    Parameters
+    ----------
+    data : array-like
+        2D frame. It is read in full unless ``max_memory`` is given.
+    header : astropy.io.fits.Header, optional
+        Header of the frame, used for the amplifier layout (see
+        ``amplifier_layout``), the saturation level (SATURATE) and the gain (GAIN,
+        e-/ADU, 1 by default).
+    method : str, optional
+        Collapse of rows and columns, "median" or "clipped_mean".
+    nsigma, contrast : float, optional
+        Detection thresholds of hot and cosmic-ray pixels (see
+        ``pixel_defects``). The bias and read noise are those of the
+        overscan.
+    saturation : float, optional
+        Saturation level. Default is SATURATE or the maximum of the integer
+        type of the data.
+    n_amplifiers, overscan : int, optional
+        Default amplifier layout (see ``amplifier_layout``).
+    bad_nsigma : float, optional
+        Deviation of a row or column profile from its running median above
+        which the row or column is flagged.
+    workers : int, optional
+        Number of threads.
+    histogram : bool, optional
+        If True, the histogram of the frame is accumulated with the rows
+        (see ``ifs_tools.stats_tools.histogram.FrameHistogram``), with
+        ``hist_bins`` bins within ``hist_range``. For non-integer frames,
+        the rows are read a second time so that its zoomed histogram
+        (``hist_nsigma``) and ``hist_percentiles`` are exact.
+    preview_factor : int, optional
+        If given, a preview of the frame reduced by this factor (mean of
+        blocks, see ``ifs_tools.stats_tools.preview.block_reduce``) is
+        built with the rows.
+    max_memory : int, optional
+        If given, ``data`` can be any sliceable object with a ``shape`` and
+        a ``dtype`` (e.g. an HDU ``section``), and it is read in strips such
+        that those processed at the same time by the threads use about this
+        many bytes at most. The data levels of the amplifiers whose data
+        section is larger are then the medians of a regular subset of its
+        rows.
+
+    Returns
+    -------
+    stats : dict
+        ``row_profile`` and ``column_profile``, ``bad_rows`` and
+        ``bad_columns`` (indices, sorted by deviation), ``amplifiers``
+        (``name``, ``overscan_level``, ``overscan_sigma``, ``data_level``
+        and ``guessed`` layout of each one), ``n_hot``, ``n_cosmic``,
+        ``n_saturated`` and ``saturated_fraction``. Also ``histogram``
+        (FrameHistogram) and ``preview`` if requested.
+    """
+    if max_memory is None:
+        data = np.asarray(data)
+    ny, nx = data.shape
+    if saturation is None:
+        saturation = header.get("SATURATE") if header is not None else None
+    if saturation is None:
+        saturation = (np.iinfo(data.dtype).max
+                      if np.issubdtype(data.dtype, np.integer) else np.inf)
+    workers = max(workers or 1, 1)
+    n_regions = workers * REGIONS_PER_WORKER
+    strip_pixels, chunk_rows = None, None
+    if max_memory is not None:
+        # Strips processed at the same time within max_memory
+        strip_pixels = max(int(max_memory)
+                           // (workers * STRIP_BYTES_PER_PIXEL), 1)
+        chunk_rows = max(strip_pixels // nx, 1)
+        n_regions = max(n_regions, -(-ny * nx // strip_pixels))
+    row_edges = np.linspace(0, ny, n_regions + 1).astype(int)
+    if preview_factor is not None:
+        # Strips of rows made of whole blocks of the preview
+        row_edges[:-1] -= row_edges[:-1] % preview_factor
+    row_edges = np.unique(row_edges)
+    col_edges = np.unique(np.linspace(0, nx, n_regions + 1).astype(int))
+    row_regions = list(zip(row_edges[:-1], row_edges[1:]))
+    col_regions = list(zip(col_edges[:-1], col_edges[1:]))
+    amplifiers = amplifier_layout((ny, nx), header, n_amplifiers, overscan)
+
+    def amplifier_levels(amplifier):
+        bias = read_rows(data, *amplifier["overscan"],
+                         chunk_rows=chunk_rows).astype(np.float32)
+        step = 1
+        if strip_pixels is not None:
+            rows, columns = (len(range(*region.indices(size))) for region, size
+                             in zip(amplifier["data"], (ny, nx)))
+            step = max(-(-rows * columns // strip_pixels), 1)
+        level = read_rows(data, *amplifier["data"], step=step,
+                          chunk_rows=chunk_rows)
+        return {"name": amplifier["name"],
+                "guessed": amplifier["guessed"],
+                "overscan_level": float(finite_median(bias)) if bias.size
+                else np.nan,
+                "overscan_sigma": float(robust_sigma(bias.ravel()[
+                    ::NOISE_SAMPLE_STEP])) if bias.size else np.nan,
+                "data_level": float(finite_median(level)) if level.size
+                else np.nan}
+
+    gain = header.get("GAIN", None) if header is not None else None
+    gain = gain if isinstance(gain, (int, float)) and gain > 0 else 1.
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        levels = list(executor.map(amplifier_levels, amplifiers))
+        bias = finite_median([a["overscan_level"] for a in levels])
+        read_noise = finite_median([a["overscan_sigma"] for a in levels])
+        if not np.isfinite(bias):
+            # No overscan, bias from the darkest pixels
+            step = NOISE_SAMPLE_STEP
+            if strip_pixels is not None:
+                step = max(step, -(-ny * nx // strip_pixels))
+            sample = read_rows(data, slice(None), step=step,
+                               chunk_rows=chunk_rows).astype(float)
+            sample = sample[np.isfinite(sample)]
+            bias = float(np.percentile(sample, 1)) if sample.size else 0.
+            read_noise = 1.
+        if not np.isfinite(read_noise):
+            read_noise = 1.
+
+        def row_pass(region):
+            r0, r1 = region
+            block = np.asarray(data[r0:r1])
+            results = {"profile": collapse(block, axis=1, method=method),
+                       "defects": pixel_defects(
+                           data, r0, r1, bias=bias,
+                           read_noise=max(read_noise, 1.), gain=gain,
+                           nsigma=nsigma, contrast=contrast,
+                           saturation=saturation)}
+            if histogram:
+                results["histogram"] = FrameHistogram(
+                    data.dtype, bins=hist_bins, hist_range=hist_range)
+                results["histogram"].update(block)
+            if preview_factor is not None:
+                results["preview"] = block_reduce(block, preview_factor)
+            return results
+
+        rows = list(executor.map(row_pass, row_regions))
+        columns = executor.map(
+            lambda c: collapse(read_rows(data, slice(None), slice(*c),
+                                         chunk_rows=chunk_rows),
+                               axis=0, method=method), col_regions)
+        stats = {"row_profile": np.concatenate([r["profile"] for r in rows]),
+                 "column_profile": np.concatenate(list(columns)),
+                 "amplifiers": levels}
+        n_hot, n_cosmic, n_saturated = np.sum([r["defects"] for r in rows],
+                                              axis=0)
+
+        if histogram:
+            frame_histogram = rows[0]["histogram"]
+            for r in rows[1:]:
+                frame_histogram.merge(r["histogram"])
+            if frame_histogram.needs_second_pass:
+                frame_histogram.start_second_pass(
+                    nsigma=hist_nsigma, percentiles=hist_percentiles)
+                for contribution in executor.map(
+                        lambda r: frame_histogram.second_pass(
+                            data[r[0]:r[1]]), row_regions):
+                    frame_histogram.add_second_pass(contribution)
+            stats["histogram"] = frame_histogram
+    if preview_factor is not None:
+        stats["preview"] = np.concatenate([r["preview"] for r in rows])
+
+    stats["method"] = method
+    for axis in ("row", "column"):
+        deviation = np.abs(profile_deviation(stats[f"{axis}_profile"]))
+        bad = np.flatnonzero(deviation > bad_nsigma)
+        stats[f"bad_{axis}s"] = bad[np.argsort(-deviation[bad])]
+        stats[f"worst_{axis}"] = int(np.argmax(deviation))
+    stats["n_hot"], stats["n_cosmic"] = int(n_hot), int(n_cosmic)
+    stats["n_saturated"] = int(n_saturated)
+    stats["saturated_fraction"] = n_saturated / (ny * nx)
+    return stats
@@ -0,0 +1,149 @@
+"""
+Statistics of the columns of binary tables.
+
+The columns are processed in chunks of rows (see
+``ProdBase.iter_row_chunks``), accumulating for each column, with vectorized
+operations over each chunk:
+
+- the number of values and of NaN (or infinite) values, the minimum, maximum
+  and mean of the finite values,
+- the number of finite values outside a valid range,
+- for error columns, the number of non-positive errors and a histogram of
+  the positive ones in logarithmic bins, from which the percentiles of the
+  errors are estimated, and a histogram of the signal-to-noise of their
+  value column.
+
+Vector columns (e.g. spectra) are flattened.
+"""
+
+import numpy as np
+
+# Logarithmic bins of the error and signal-to-noise histograms
+LOG_BINS = np.linspace(-10, 10, 801)
+ERROR_PERCENTILES = (5, 50, 95)
+
+
+def is_numeric(values):
+    return (np.issubdtype(values.dtype, np.number)
+            and not np.issubdtype(values.dtype, np.complexfloating))
+
+
+def log_histogram(values):
+    """Histogram of positive finite values in ``LOG_BINS``."""
+    values = values[np.isfinite(values) & (values > 0)]
+    return np.histogram(np.log10(values), bins=LOG_BINS)[0]
+
+
+def histogram_percentiles(counts, q=ERROR_PERCENTILES):
+    """Percentiles estimated from a histogram in ``LOG_BINS``."""
+    total = counts.sum()
+    if total == 0:
+        return {p: np.nan for p in q}
+    cumulative = np.concatenate([[0], np.cumsum(counts)]) / total
+    return {p: float(10**np.interp(p / 100, cumulative, LOG_BINS))
+            for p in q}
+
+
+def new_column_statistics():
+    return {"n": 0, "n_nan": 0, "n_out": 0, "min": np.inf, "max": -np.inf,
+            "sum": 0.}
+
+
+def update_column_statistics(stats, values, valid_range=None):
+    finite = np.isfinite(values)
+    n_finite = int(np.count_nonzero(finite))
+    stats["n"] += values.size
+    stats["n_nan"] += values.size - n_finite
+    if n_finite == 0:
+        return
+    if n_finite < values.size:
+        values = values[finite]
+    stats["min"] = min(stats["min"], float(np.min(values)))
+    stats["max"] = max(stats["max"], float(np.max(values)))
+    stats["sum"] += float(np.sum(values, dtype=np.float64))
+    if valid_range is not None:
+        lo, hi = valid_range
+        stats["n_out"] += int(np.count_nonzero((values < lo) | (values > hi)))
+
+
+def update_error_statistics(stats, errors, values=None):
+    if "error_hist" not in stats:
+        stats["n_nonpositive"] = 0
+        stats["error_hist"] = np.zeros(LOG_BINS.size - 1, dtype=np.int64)
+        stats["snr_hist"] = np.zeros(LOG_BINS.size - 1, dtype=np.int64)
+        stats["n_missing"] = 0
+    stats["n_nonpositive"] += int(np.count_nonzero(errors <= 0))
+    stats["error_hist"] += log_histogram(errors)
+    if values is None:
+        return
+    with np.errstate(divide="ignore", invalid="ignore"):
+        stats["snr_hist"] += log_histogram(np.abs(values) / errors)
+    # Values without a valid error
+    stats["n_missing"] += int(np.count_nonzero(
+        np.isfinite(values) & ~(np.isfinite(errors) & (errors > 0))))
+
+
+def finalize_column_statistics(stats):
+    n_finite = stats["n"] - stats["n_nan"]
+    stats["mean"] = stats["sum"] / n_finite if n_finite else np.nan
+    stats["nan_fraction"] = stats["n_nan"] / stats["n"] if stats["n"] else \
+        np.nan
+    stats["out_fraction"] = stats["n_out"] / n_finite if n_finite else np.nan
+    if not n_finite:
+        stats["min"] = stats["max"] = np.nan
+    if "error_hist" in stats:
+        stats["nonpositive_fraction"] = (stats["n_nonpositive"] / n_finite
+                                         if n_finite else np.nan)
+        stats["error_percentiles"] = histogram_percentiles(
+            stats["error_hist"])
+        stats["median_snr"] = histogram_percentiles(
+            stats["snr_hist"], q=(50,))[50]
+        stats["missing_fraction"] = (stats["n_missing"] / stats["n"]
+                                     if stats["n"] else np.nan)
+    return stats
+
+
+def table_column_statistics(chunks, ranges=None, errors=None):
+    """Statistics of the columns of a table in a single pass.
+
+    Parameters
+    ----------
+    chunks : iterable
+        Chunks of rows, as dictionaries with the values of each column
+        (e.g. ``ProdBase.iter_row_chunks``). Non-numeric columns are
+        ignored.
+    ranges : dict, optional
+        Valid range ``(lo, hi)`` of the values of some columns.
+    errors : dict, optional
+        Error column of some value columns. Error columns must be included
+        in the chunks.
+
+    Returns
+    -------
+    stats : dict
+        For each column, ``n``, ``n_nan``, ``nan_fraction``, ``min``,
+        ``max``, ``mean``, ``n_out`` and ``out_fraction`` (of the finite
+        values). Error columns also include ``nonpositive_fraction``,
+        ``error_percentiles`` (5, 50 and 95), ``median_snr`` and
+        ``missing_fraction`` (values without a positive finite error).
+    """
+    ranges = ranges or {}
+    errors = errors or {}
+    stats = {}
+    for chunk in chunks:
+        for name, values in chunk.items():
+            if not is_numeric(values):
+                continue
+            values = values.reshape(-1)
+            if name not in stats:
+                stats[name] = new_column_statistics()
+            update_column_statistics(stats[name], values, ranges.get(name))
+        for name, error_name in errors.items():
+            if name not in stats or error_name not in stats:
+                continue
+            values = chunk[name].reshape(-1)
+            error_values = chunk[error_name].reshape(-1)
+            update_error_statistics(
+                stats[error_name], error_values,
+                values if values.size == error_values.size else None)
+    return {name: finalize_column_statistics(s) for name, s in stats.items()}
@@ -0,0 +1,61 @@
+import warnings
+
+import numpy as np
+import pytest
+from astropy.io import fits
+
+from ifs_tools.stats_tools.cube_stats import (cube_spaxel_statistics,
+                                              iter_spatial_tiles)
+
+SHAPE = (40, 9, 13)
+
+
+@pytest.fixture
+def cube():
+    """Flux and inverse variance cubes with NaN values and empty spaxels."""
+    rng = np.random.default_rng(0)
+    flux = rng.normal(10, 3, SHAPE).astype(np.float32)
+    flux[rng.random(SHAPE) < 0.2] = np.nan
+    flux[:, 0, :4] = np.nan
+    flux[:30, 5, 7] = np.nan
+    ivar = rng.uniform(0.5, 2, SHAPE).astype(np.float32)
+    ivar[:, 3, 3] = -1
+    return flux, ivar
+
+
+@pytest.fixture
+def cube_hdul(cube, tmp_path):
+    flux, ivar = cube
+    path = tmp_path / "cube.fits"
+    fits.HDUList([fits.PrimaryHDU(), fits.ImageHDU(flux, name="FLUX"),
+                  fits.ImageHDU(ivar, name="IVAR")]).writeto(path)
+    with fits.open(path) as hdul:
+        yield hdul
+
+
+# Budgets giving single spaxels, parts of a row, single and several rows,
+# and the full cube in a single tile
+@pytest.mark.parametrize("max_memory", [1, 40 * 4 * 8 * 5, 40 * 4 * 8 * 13,
+                                        40 * 4 * 8 * 13 * 4, 2**30])
+def test_spaxel_statistics_match_numpy(cube, cube_hdul, max_memory):
+    flux, ivar = cube
+    stats = cube_spaxel_statistics(cube_hdul["FLUX"], cube_hdul["IVAR"],
+                                   max_memory=max_memory)
+    snr = flux * np.sqrt(np.clip(ivar, 0, None))
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        expected = {"median": np.nanmedian(flux, axis=0),
+                    "mean": np.nanmean(flux, axis=0),
+                    "nan_fraction": np.isnan(flux).mean(axis=0),
+                    "snr": np.nanmedian(snr, axis=0)}
+    for key, values in expected.items():
+        np.testing.assert_allclose(stats[key], values, rtol=1e-6,
+                                   equal_nan=True, err_msg=key)
+
+
+@pytest.mark.parametrize("max_memory", [1, 300, 2000, 10**4, 10**9])
+def test_spatial_tiles_cover_every_spaxel_once(max_memory):
+    covered = np.zeros(SHAPE[1:], dtype=int)
+    for sy, sx in iter_spatial_tiles(SHAPE, 4, max_memory):
+        covered[sy, sx] += 1
+    assert (covered == 1).all()
@@ -0,0 +1,78 @@
+import gzip
+import shutil
+
+import numpy as np
+import pytest
+from astropy.io import fits
+
+from ifs_tools.data_readers.fits_headers import (iter_fits_headers,
+                                                 read_fits_headers)
+
+
+@pytest.fixture
+def fits_path(tmp_path):
+    """File with image, table and tile-compressed image extensions."""
+    primary = fits.PrimaryHDU()
+    primary.header["OBSTYPE"] = "BIAS"
+    primary.header["DATE-OBS"] = "2024-01-01T22:00:00"
+    image = fits.ImageHDU(np.arange(35, dtype=np.int16).reshape(5, 7),
+                          name="IMAGE")
+    image.header["GAIN"] = 1.5
+    table = fits.BinTableHDU.from_columns(
+        [fits.Column(name="X", format="E", array=np.arange(3.))],
+        name="TABLE")
+    compressed = fits.CompImageHDU(
+        np.arange(600, dtype=np.int32).reshape(20, 30), name="COMP",
+        compression_type="RICE_1", tile_shape=(4, 30))
+    compressed.header["CAMERA"] = "WEAVEBLUE"
+    path = tmp_path / "file.fits"
+    fits.HDUList([primary, image, table, compressed]).writeto(path)
+    return path
+
+
+def assert_headers_equal(header, expected):
+    for key in ("XTENSION", "BITPIX", "NAXIS", "NAXIS1", "NAXIS2", "PCOUNT",
+                "GCOUNT", "EXTNAME", "OBSTYPE", "DATE-OBS", "GAIN",
+                "CAMERA", "TFIELDS", "TFORM1"):
+        assert header.get(key) == expected.get(key), key
+
+
+def test_read_fits_headers_matches_astropy(fits_path):
+    headers = read_fits_headers(fits_path, hdul_idx=3)
+    with fits.open(fits_path) as hdul:
+        assert len(headers) == len(hdul)
+        for header, hdu in zip(headers, hdul):
+            assert_headers_equal(header, hdu.header)
+    # Compressed images are described by the header of the image
+    assert "ZIMAGE" not in headers[3]
+
+
+def test_read_fits_headers_stops_at_index(fits_path):
+    headers = read_fits_headers(fits_path, hdul_idx=1)
+    assert len(headers) == 2
+    assert headers[0]["OBSTYPE"] == "BIAS"
+    with pytest.raises(IndexError):
+        read_fits_headers(fits_path, hdul_idx=4)
+
+
+def test_iter_fits_headers(fits_path):
+    headers = list(iter_fits_headers(fits_path))
+    with fits.open(fits_path) as hdul:
+        assert [h.get("EXTNAME") for h in headers] == [
+            hdu.header.get("EXTNAME") for hdu in hdul]
+
+
+def test_iter_fits_headers_keeps_compressed_headers(fits_path):
+    headers = list(iter_fits_headers(fits_path))
+    assert len(headers) == 4
+    assert headers[3]["ZIMAGE"]
+    assert headers[3]["XTENSION"] == "BINTABLE"
+
+
+def test_read_fits_headers_gzip(fits_path, tmp_path):
+    gz_path = tmp_path / "file.fits.gz"
+    with open(fits_path, "rb") as f, gzip.open(gz_path, "wb") as g:
+        shutil.copyfileobj(f, g)
+    for header, expected in zip(read_fits_headers(gz_path, hdul_idx=3),
+                                read_fits_headers(fits_path, hdul_idx=3)):
+        assert header == expected
@@ -0,0 +1,46 @@
+import os
+
+import pytest
+import yaml
+
+import ifs_tools.QC  # noqa: F401, registers the QC tests
+from ifs_tools.QC.qc_main import screen_headers
+from ifs_tools.QC.registry import get_qc_class
+from ifs_tools.QC.trends import TREND_KEYWORDS
+from ifs_tools.benchmarks.synthetic import PRIMARY_KEYWORDS, make_raw_frame
+
+RAW_RULES = os.path.join(os.path.dirname(ifs_tools.QC.__file__), "weave",
+                         "qc_params", "check_raw.yml")
+
+
+@pytest.fixture
+def raw_path(tmp_path):
+    return make_raw_frame(str(tmp_path / "raw.fit"), shape=(32, 48))
+
+
+def primary_table(qc_tests):
+    (section,) = [s for s in qc_tests.html_page.sections
+                  if s["title"] == "Primary Header checks"]
+    return section["data"]
+
+
+@pytest.mark.parametrize("screened", [False, True])
+def test_raw_header_metrics(raw_path, tmp_path, screened):
+    qc_class = get_qc_class("weave", "raw")
+    checks = None
+    if screened:
+        # Checks evaluated over a batch of files, before opening them
+        (file_checks,) = screen_headers(qc_class, ["check_primary"],
+                                        [raw_path])
+        checks = file_checks["check_primary"]
+    qc_tests = qc_class(raw_path, output=str(tmp_path), html=True,
+                        header_only=True)
+    qc_tests.check_primary(checks=checks)
+
+    # The trend keywords are recorded without being listed in the table
+    assert qc_tests.metrics == {key: PRIMARY_KEYWORDS[key]
+                                for key in TREND_KEYWORDS}
+    with open(RAW_RULES) as f:
+        rules = yaml.safe_load(f)
+    assert not set(TREND_KEYWORDS) & set(rules)
+    assert [row[0] for row in primary_table(qc_tests)] == list(rules)
@@ -0,0 +1,79 @@
+import glob
+import os
+
+import pytest
+import yaml
+from astropy.io import fits
+
+import ifs_tools.QC
+from ifs_tools.QC.header_rules import NO_RULE, load_rule_set
+
+QC_PARAMS = glob.glob(os.path.join(os.path.dirname(ifs_tools.QC.__file__),
+                                   "*", "qc_params", "check_*.yml"))
+
+RULES = """
+OBSTYPE: [BIAS, FLAT]
+VPH: [Blue, Red]
+CCDTEMP: [150, 170]
+AIRMASS: [1., 1.3]
+EXPTIME: [0, 3600.5]
+DETECTOR: None
+CAMERA: None
+"""
+
+HEADERS = [
+    {"OBSTYPE": "BIAS", "VPH": "Red", "CCDTEMP": 160, "AIRMASS": 1.1,
+     "EXPTIME": 0.0, "DETECTOR": "EEV", "CAMERA": "WEAVEBLUE"},
+    {"OBSTYPE": "FLAT", "VPH": "Blue", "CCDTEMP": 171.5, "AIRMASS": 1.3,
+     "EXPTIME": 3600, "DETECTOR": 2, "CAMERA": "WEAVERED"},
+    {"OBSTYPE": "ARC", "VPH": "Green", "CCDTEMP": "COLD", "AIRMASS": "1.1",
+     "EXPTIME": -1, "DETECTOR": "EEV", "CAMERA": ""},
+]
+
+
+def baseline_check_header(rules, header):
+    """Header checks of the original ``QCtestBase.check_header``."""
+    checks = []
+    for k, v in header.items():
+        if type(v) is not str and rules[k] != "None":
+            okey = rules[k][0] < v < rules[k][1]
+        elif type(v) is str and rules[k] != "None":
+            okey = v == rules[k][0]
+        else:
+            okey = "N/A"
+        checks.append((k, v, okey))
+    return checks
+
+
+@pytest.fixture
+def rules_path(tmp_path):
+    path = tmp_path / "check_mixed.yml"
+    path.write_text(RULES)
+    return str(path)
+
+
+@pytest.mark.parametrize("header", HEADERS)
+def test_compiled_rules_match_baseline(rules_path, header):
+    with open(rules_path) as f:
+        rules = yaml.safe_load(f)
+    header = fits.Header(header)
+    assert (load_rule_set(rules_path).check_header(header)
+            == baseline_check_header(rules, header))
+
+
+def test_string_bounds_never_accept_numbers(rules_path):
+    checks = dict((k, okay) for k, _, okay in load_rule_set(
+        rules_path).check_header({"OBSTYPE": 1.5, "VPH": "Blue"}))
+    assert checks["OBSTYPE"] is False
+    assert checks["VPH"] is True
+
+
+@pytest.mark.parametrize("path", QC_PARAMS)
+def test_qc_params_compile(path):
+    with open(path) as f:
+        rules = yaml.safe_load(f)
+    rule_set = load_rule_set(path)
+    headers = [{key: 1.2 if rule not in (NO_RULE, None) else "x"
+                for key, rule in rules.items()}]
+    assert [k for k, _, _ in rule_set.check_headers(headers)[0]] == list(
+        rules)
@@ -0,0 +1,110 @@
+import numpy as np
+import pytest
+
+from ifs_tools.stats_tools import histogram as histogram_module
+from ifs_tools.stats_tools.histogram import FrameHistogram, frame_statistics
+from ifs_tools.stats_tools.raw_stats import raw_frame_statistics
+
+BINS = 100
+HIST_RANGE = (-1000, 70000)
+NSIGMA = 3
+PERCENTILES = (0, 1, 5, 50, 95, 99, 100)
+
+
+def frames():
+    rng = np.random.default_rng(1)
+    shape = (300, 211)
+    level = rng.normal(1000, 30, shape)
+    level[50:60, 100] = 65000
+    floats = level.astype(np.float32)
+    floats[rng.random(shape) < 0.01] = np.nan
+    # Pixels outside the histogram range
+    high = level.copy()
+    high[:20] = 1e5
+    high[20:25] = -5000
+    return {"uint16": np.round(level).astype(np.uint16),
+            "int16": np.round(level - 1500).astype(np.int16),
+            "float32": floats, "float64_outside": high}
+
+
+def reference(data):
+    values = data[np.isfinite(data)].astype(float)
+    mean, sigma = values.mean(), values.std()
+    return {"mean": mean, "sigma": sigma, "n_pixels": values.size,
+            "coarse": np.histogram(values, bins=BINS, range=HIST_RANGE),
+            "zoom": np.histogram(values, bins=BINS,
+                                 range=(mean - NSIGMA * sigma,
+                                        mean + NSIGMA * sigma)),
+            "percentiles": np.percentile(values, PERCENTILES)}
+
+
+def assert_exact(stats, data):
+    expected = reference(data)
+    assert stats["n_pixels"] == expected["n_pixels"]
+    np.testing.assert_allclose(stats["mean"], expected["mean"], rtol=1e-12)
+    np.testing.assert_allclose(stats["sigma"], expected["sigma"], rtol=1e-9)
+    for key in ("coarse", "zoom"):
+        np.testing.assert_array_equal(stats[key][0], expected[key][0])
+        np.testing.assert_allclose(stats[key][1], expected[key][1],
+                                   rtol=1e-12)
+    np.testing.assert_allclose(
+        [stats["percentiles"][q] for q in PERCENTILES],
+        expected["percentiles"], rtol=1e-12)
+
+
+@pytest.mark.parametrize("name", ["uint16", "int16", "float32",
+                                  "float64_outside"])
+@pytest.mark.parametrize("max_memory", [1, 211 * 8 * 4 * 7, 2**30])
+def test_frame_statistics_match_numpy(name, max_memory):
+    data = frames()[name]
+    stats = frame_statistics(data, bins=BINS, hist_range=HIST_RANGE,
+                             nsigma=NSIGMA, percentiles=PERCENTILES,
+                             max_memory=max_memory)
+    assert_exact(stats, data)
+
+
+@pytest.mark.parametrize("name", ["uint16", "float32", "float64_outside"])
+def test_raw_frame_histogram_match_numpy(name):
+    data = frames()[name]
+    stats = raw_frame_statistics(data, workers=3, histogram=True,
+                                 hist_bins=BINS, hist_range=HIST_RANGE,
+                                 hist_nsigma=NSIGMA,
+                                 hist_percentiles=PERCENTILES)
+    assert_exact(stats["histogram"].result(nsigma=NSIGMA,
+                                           percentiles=PERCENTILES), data)
+
+
+def test_crowded_percentile_bins_are_estimated(monkeypatch):
+    # Percentiles falling in fine bins with too many values are estimated
+    # from the subsample
+    monkeypatch.setattr(histogram_module, "MAX_BRACKET_VALUES", 10)
+    data = frames()["float32"]
+    stats = frame_statistics(data, bins=BINS, hist_range=HIST_RANGE,
+                             nsigma=NSIGMA, percentiles=PERCENTILES)
+    expected = reference(data)
+    np.testing.assert_array_equal(stats["zoom"][0], expected["zoom"][0])
+    np.testing.assert_allclose([stats["percentiles"][q] for q in PERCENTILES],
+                               expected["percentiles"], atol=2)
+
+
+def test_float_estimates_without_second_pass():
+    data = frames()["float32"]
+    histogram = FrameHistogram(data.dtype, bins=BINS, hist_range=HIST_RANGE)
+    histogram.update(data)
+    assert histogram.needs_second_pass
+    stats = histogram.result(nsigma=NSIGMA, percentiles=PERCENTILES)
+    expected = reference(data)
+    np.testing.assert_array_equal(stats["coarse"][0], expected["coarse"][0])
+    np.testing.assert_allclose(stats["zoom"][0].sum(),
+                               expected["zoom"][0].sum(), rtol=1e-3)
+    np.testing.assert_allclose([stats["percentiles"][q] for q in PERCENTILES],
+                               expected["percentiles"], atol=2)
+
+
+def test_empty_frame():
+    stats = frame_statistics(np.full((10, 10), np.nan), bins=BINS,
+                             hist_range=HIST_RANGE, percentiles=PERCENTILES)
+    assert stats["n_pixels"] == 0
+    assert np.isnan(stats["mean"])
+    assert all(np.isnan(v) for v in stats["percentiles"].values())
+    assert stats["zoom"][0].sum() == 0
@@ -0,0 +1,102 @@
+import numpy as np
+import pytest
+from astropy.io import fits
+
+from ifs_tools.data_readers.prod_base import ProdBase, table_dtype
+
+
+@pytest.fixture
+def prod_path(tmp_path):
+    """L2-like product with a table using every supported column type."""
+    n_rows = 20
+    rng = np.random.default_rng(0)
+    columns = [
+        fits.Column(name="VEL", format="E", array=rng.normal(size=n_rows)),
+        fits.Column(name="Z", format="D", array=rng.normal(size=n_rows)),
+        fits.Column(name="SPEC", format="6E", dim="(3,2)",
+                    array=rng.normal(size=(n_rows, 2, 3))),
+        fits.Column(name="FLAG", format="J", bzero=2**31,
+                    array=rng.integers(0, 2**32, n_rows, dtype=np.uint32)),
+        fits.Column(name="MASK", format="I", bzero=2**15,
+                    array=rng.integers(0, 2**16, n_rows, dtype=np.uint16)),
+        fits.Column(name="ID", format="K", bzero=2**63,
+                    array=rng.integers(0, 2**63, n_rows, dtype=np.uint64)),
+        fits.Column(name="OK", format="L", array=rng.random(n_rows) > 0.5),
+        fits.Column(name="SCALED", format="I",
+                    array=np.arange(n_rows, dtype=np.int16)),
+        fits.Column(name="NAME", format="8A",
+                    array=[f"T{i}" for i in range(n_rows)]),
+    ]
+    path = tmp_path / "prod.fits"
+    fits.HDUList([fits.PrimaryHDU(),
+                  fits.BinTableHDU.from_columns(columns, name="TABLE")]
+                 ).writeto(path)
+    # Scaling of the stored integers (SCALED is column 8)
+    fits.setval(path, "TSCAL8", value=0.5, ext=1, after="TFORM8")
+    fits.setval(path, "TZERO8", value=3.0, ext=1, after="TSCAL8")
+    return path
+
+
+def assert_columns_equal(values, expected):
+    assert values.shape == expected.shape
+    if expected.dtype.kind in "US":
+        np.testing.assert_array_equal(values, expected.astype(str))
+    else:
+        np.testing.assert_array_equal(values, expected)
+
+
+def test_table_dtype_matches_row_size(prod_path):
+    header = fits.getheader(prod_path, 1)
+    dtype = table_dtype(header)
+    assert dtype is not None
+    assert dtype.itemsize == header["NAXIS1"]
+    assert dtype["SPEC"].shape == (2, 3)
+
+
+def test_scaled_column_fixture(prod_path):
+    np.testing.assert_array_equal(fits.getdata(prod_path, 1)["SCALED"],
+                                  3 + 0.5 * np.arange(20))
+
+
+def test_table_dtype_variable_length():
+    column = fits.Column(name="VAR", format="PE()",
+                         array=np.array([np.zeros(2), np.zeros(3)],
+                                        dtype=object))
+    header = fits.BinTableHDU.from_columns([column]).header
+    assert table_dtype(header) is None
+
+
+@pytest.mark.parametrize("rows", [slice(None), slice(3, 11), slice(0, 1)])
+def test_read_columns_matches_astropy(prod_path, rows):
+    expected = fits.getdata(prod_path, 1)
+    with ProdBase(str(prod_path)) as prod:
+        names = prod.get_column_names(1)
+        assert prod.get_table(1) is not None
+        data = prod.read_columns(1, names, rows)
+    for name in names:
+        assert_columns_equal(data[name], np.asarray(expected[name][rows]))
+    assert data["OK"].dtype == bool
+    assert data["FLAG"].dtype == np.uint32
+    assert data["MASK"].dtype == np.uint16
+    assert data["ID"].dtype == np.uint64
+
+
+def test_iter_row_chunks_covers_the_table(prod_path):
+    expected = fits.getdata(prod_path, 1)
+    with ProdBase(str(prod_path)) as prod:
+        chunks = list(prod.iter_row_chunks(1, ["VEL", "SCALED"],
+                                           max_memory=64))
+    assert len(chunks) > 1
+    for name in ("VEL", "SCALED"):
+        np.testing.assert_array_equal(
+            np.concatenate([data[name] for _, data in chunks]),
+            expected[name])
+
+
+def test_read_columns_without_memmap(prod_path):
+    expected = fits.getdata(prod_path, 1)
+    with ProdBase(str(prod_path), memmap=False) as prod:
+        assert prod.get_table(1) is None
+        data = prod.read_columns(1, ["SCALED", "FLAG"])
+    np.testing.assert_array_equal(data["SCALED"], expected["SCALED"])
+    np.testing.assert_array_equal(data["FLAG"], expected["FLAG"])
@@ -0,0 +1,88 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+import ifs_tools
+from ifs_tools.benchmarks.synthetic import make_raw_frame
+
+SRC_DIR = os.path.dirname(os.path.dirname(ifs_tools.__file__))
+
+
+def run_qc_main(*args):
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        [SRC_DIR] + [p for p in [env.get("PYTHONPATH")] if p])
+    result = subprocess.run(
+        [sys.executable, "-m", "ifs_tools.QC.qc_main", *args,
+         "--render_workers", "0"],
+        capture_output=True, text=True, env=env)
+    assert result.returncode == 0, result.stdout + result.stderr
+    return result.stdout
+
+
+def report_titles(output_dir, prefix="raw.fit_"):
+    (name,) = [d for d in os.listdir(output_dir) if d.startswith(prefix)]
+    with open(os.path.join(output_dir, name, "index_raw.json")) as f:
+        return [section["title"] for section in json.load(f)["sections"]]
+
+
+@pytest.fixture(scope="module")
+def raw_path(tmp_path_factory):
+    path = tmp_path_factory.mktemp("data") / "raw.fit"
+    return make_raw_frame(str(path), shape=(128, 160))
+
+
+def test_html_run_after_cached_run_without_html(raw_path, tmp_path):
+    args = [raw_path, "--survey", "weave", "--qcmode", "raw",
+            "--qctest", "check_primary", "check_histogram",
+            "--output", str(tmp_path)]
+    run_qc_main(*args, "--no-html")
+    stdout = run_qc_main(*args, "--html")
+    assert "Using cached" not in stdout
+    titles = report_titles(tmp_path)
+    assert "Primary Header checks" in titles
+    assert "Raw histogram" in titles
+
+    # Both tests are cached with their sections from now on
+    stdout = run_qc_main(*args, "--html")
+    assert stdout.count("Using cached") == 2
+    assert report_titles(tmp_path) == titles
+
+
+def read_reports(output_dir):
+    reports = {}
+    for name in sorted(os.listdir(output_dir)):
+        if not name.startswith("raw"):
+            continue
+        for report in ("index_raw.html", "index_raw.json"):
+            with open(os.path.join(output_dir, name, report)) as f:
+                reports[name, report] = f.read()
+    return reports
+
+
+def test_reports_do_not_depend_on_the_run(tmp_path):
+    paths = [make_raw_frame(str(tmp_path / f"raw{i}.fit"), shape=(64, 96),
+                            seed=i, run=1000000 + i) for i in range(2)]
+    args = [*paths, "--survey", "weave", "--qcmode", "raw",
+            "--qctest", "check_primary", "check_histogram"]
+    outputs = {}
+    for mode, extra in (("serial", []), ("workers", ["--workers", "2"]),
+                        ("pipeline", ["--pipeline"])):
+        outputs[mode] = str(tmp_path / mode)
+        run_qc_main(*args, "--output", outputs[mode], *extra)
+    reports = read_reports(outputs["serial"])
+    assert len(reports) == 4
+    assert read_reports(outputs["workers"]) == reports
+    assert read_reports(outputs["pipeline"]) == reports
+
+    # The measurements are only in the run log, unless requested
+    with open(os.path.join(outputs["serial"], "run_log.jsonl")) as f:
+        records = [json.loads(line) for line in f]
+    assert {"check_primary", "check_histogram"} <= {
+        r["name"] for r in records if r["kind"] == "test"}
+    assert "Performance" not in report_titles(outputs["serial"], "raw0.fit_")
+    run_qc_main(*args, "--output", outputs["serial"], "--performance_report")
+    assert "Performance" in report_titles(outputs["serial"], "raw0.fit_")
@@ -0,0 +1,158 @@
+import numpy as np
+import pytest
+from astropy.io import fits
+
+from ifs_tools.stats_tools.raw_stats import (amplifier_layout,
+                                             raw_frame_statistics)
+
+SHAPE = (120, 200)
+OVERSCAN = 20
+BIAS = (1000, 1100)
+LEVEL = (1500, 1800)
+HOT = [(10, 40), (30, 70), (55, 120), (80, 150), (100, 60), (115, 170)]
+# Diagonal tracks of two and three pixels (compact blobs are rejected as
+# resolved features)
+COSMICS = [(20, 100), (21, 101), (70, 30), (71, 31), (72, 32)]
+BAD_COLUMN = 130
+SATURATED = [(90, 90), (90, 91)]
+
+
+def layout_header():
+    """Two amplifiers with their overscan on their outer edge."""
+    ny, nx = SHAPE
+    half = nx // 2
+    header = fits.Header()
+    header["DATASEC1"] = f"[{OVERSCAN + 1}:{half},1:{ny}]"
+    header["BIASSEC1"] = f"[1:{OVERSCAN},1:{ny}]"
+    header["DATASEC2"] = f"[{half + 1}:{nx - OVERSCAN},1:{ny}]"
+    header["BIASSEC2"] = f"[{nx - OVERSCAN + 1}:{nx},1:{ny}]"
+    return header
+
+
+def make_frame(seed=0):
+    """Raw frame with known levels and defects."""
+    ny, nx = SHAPE
+    half = nx // 2
+    rng = np.random.default_rng(seed)
+    frame = np.empty(SHAPE)
+    frame[:, :OVERSCAN] = BIAS[0]
+    frame[:, OVERSCAN:half] = LEVEL[0]
+    frame[:, half:nx - OVERSCAN] = LEVEL[1]
+    frame[:, nx - OVERSCAN:] = BIAS[1]
+    frame += rng.normal(0, 5, SHAPE)
+    frame[:, BAD_COLUMN] += 300
+    for y, x in HOT + COSMICS:
+        frame[y, x] = 30000
+    frame = np.round(frame).astype(np.uint16)
+    for y, x in SATURATED:
+        frame[y, x] = 65535
+    return frame
+
+
+def test_header_layout():
+    amplifiers = amplifier_layout(SHAPE, layout_header())
+    assert [a["name"] for a in amplifiers] == ["A", "B"]
+    assert not any(a["guessed"] for a in amplifiers)
+    assert amplifiers[0]["data"] == (slice(0, 120), slice(20, 100))
+    assert amplifiers[1]["overscan"] == (slice(0, 120), slice(180, 200))
+
+    # Letter suffixes, and a single amplifier
+    header = fits.Header()
+    header["DATASECA"], header["BIASSECA"] = "[21:100,1:120]", "[1:20,1:120]"
+    header["DATASECB"] = "[101:180,1:120]"
+    header["BIASSECB"] = "[181:200,1:120]"
+    assert ([a["data"] for a in amplifier_layout(SHAPE, header)]
+            == [a["data"] for a in amplifiers])
+    header = fits.Header()
+    header["DATASEC"], header["BIASSEC"] = "[1:180,1:120]", "[181:200,1:120]"
+    (amplifier,) = amplifier_layout(SHAPE, header)
+    assert amplifier["overscan"] == (slice(0, 120), slice(180, 200))
+    assert not amplifier["guessed"]
+
+
+def test_guessed_layout():
+    amplifiers = amplifier_layout(SHAPE, None, n_amplifiers=2,
+                                  overscan=OVERSCAN)
+    assert all(a["guessed"] for a in amplifiers)
+    assert [a["overscan"][1] for a in amplifiers] == [slice(0, 20),
+                                                      slice(180, 200)]
+    assert [a["data"][1] for a in amplifiers] == [slice(20, 100),
+                                                  slice(100, 180)]
+    header = fits.Header()
+    header["NAMPS"] = 4
+    amplifiers = amplifier_layout(SHAPE, header, overscan=OVERSCAN)
+    assert [a["name"] for a in amplifiers] == ["A", "B", "C", "D"]
+    assert [a["overscan"][1] for a in amplifiers] == [
+        slice(0, 20), slice(50, 70), slice(130, 150), slice(180, 200)]
+
+
+@pytest.mark.parametrize("header", [layout_header(), None])
+@pytest.mark.parametrize("workers", [1, 3])
+def test_levels_and_defects(header, workers):
+    stats = raw_frame_statistics(make_frame(), header=header,
+                                 overscan=OVERSCAN, workers=workers)
+    for amplifier, bias, level in zip(stats["amplifiers"], BIAS, LEVEL):
+        assert amplifier["guessed"] == (header is None)
+        assert amplifier["overscan_level"] == pytest.approx(bias, abs=1)
+        assert amplifier["overscan_sigma"] == pytest.approx(5, rel=0.2)
+        assert amplifier["data_level"] == pytest.approx(level, abs=1)
+    assert stats["n_hot"] == len(HOT)
+    assert stats["n_cosmic"] == len(COSMICS)
+    assert stats["n_saturated"] == len(SATURATED)
+    assert stats["saturated_fraction"] == len(SATURATED) / np.prod(SHAPE)
+    assert list(stats["bad_columns"]) == [BAD_COLUMN]
+    assert stats["worst_column"] == BAD_COLUMN
+    assert len(stats["bad_rows"]) == 0
+
+
+def test_non_finite_pixels():
+    frame = make_frame().astype(np.float32)
+    frame[np.random.default_rng(1).random(SHAPE) < 0.05] = np.nan
+    frame[40] = np.nan
+    frame[:, 60] = np.inf
+    frame[:, :OVERSCAN][::3] = np.nan
+    for y, x in SATURATED:
+        frame[y, x] = 65535
+    for method in ("median", "clipped_mean"):
+        stats = raw_frame_statistics(frame, header=layout_header(),
+                                     method=method, saturation=65535,
+                                     workers=2)
+        for amplifier, bias, level in zip(stats["amplifiers"], BIAS, LEVEL):
+            assert amplifier["overscan_level"] == pytest.approx(bias, abs=1)
+            assert amplifier["data_level"] == pytest.approx(level, abs=2)
+        row_profile, column_profile = (stats["row_profile"],
+                                       stats["column_profile"])
+        assert np.isnan(row_profile[40])
+        assert np.isnan(column_profile[60])
+        assert np.isfinite(np.delete(row_profile, 40)).all()
+        assert np.isfinite(np.delete(column_profile, 60)).all()
+        assert stats["worst_column"] == BAD_COLUMN
+        assert stats["n_saturated"] == len(SATURATED)
+        # Pixels next to the masked row and column are not counted
+        assert stats["n_hot"] <= len(HOT)
+
+
+def test_lazy_section_within_memory_budget(tmp_path):
+    frame = make_frame()
+    path = tmp_path / "raw.fits"
+    fits.HDUList([fits.PrimaryHDU(),
+                  fits.ImageHDU(frame, header=layout_header())]).writeto(path)
+    kwargs = dict(header=layout_header(), workers=2, histogram=True,
+                  preview_factor=4)
+    expected = raw_frame_statistics(frame, **kwargs)
+    with fits.open(path) as hdul:
+        stats = raw_frame_statistics(hdul[1].section, max_memory=2**16,
+                                     **kwargs)
+    for key in ("row_profile", "column_profile", "bad_columns", "preview"):
+        np.testing.assert_array_equal(stats[key], expected[key])
+    for key in ("n_hot", "n_cosmic", "n_saturated", "worst_row"):
+        assert stats[key] == expected[key]
+    for amplifier, reference in zip(stats["amplifiers"],
+                                    expected["amplifiers"]):
+        assert amplifier["overscan_level"] == reference["overscan_level"]
+        # Median of a subset of the rows of the data section
+        assert amplifier["data_level"] == pytest.approx(
+            reference["data_level"], abs=1)
+    np.testing.assert_array_equal(
+        stats["histogram"].result()["coarse"][0],
+        expected["histogram"].result()["coarse"][0])
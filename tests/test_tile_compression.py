@@ -0,0 +1,80 @@
+import os
+
+import numpy as np
+import pytest
+from astropy.io import fits
+
+from ifs_tools.data_readers.tile_compression import (
+    TileDecompressor, copy_name, decompressed_copy)
+
+TILE_ROWS = 4
+
+
+@pytest.fixture
+def image():
+    return np.random.default_rng(0).integers(
+        0, 2**15, (103, 37)).astype(np.int32)
+
+
+@pytest.fixture
+def fz_path(tmp_path, image):
+    path = tmp_path / "frame.fit.fz"
+    fits.HDUList([fits.PrimaryHDU(), fits.CompImageHDU(
+        image, compression_type="RICE_1", tile_shape=(TILE_ROWS, 37))]
+    ).writeto(path)
+    return path
+
+
+@pytest.mark.parametrize("workers", [1, 2, 3, 8])
+@pytest.mark.parametrize("start,stop", [(0, 103), (5, 103), (0, 50),
+                                        (9, 10), (13, 87)])
+def test_bands_are_aligned_with_the_tiles(fz_path, workers, start, stop):
+    decompressor = TileDecompressor(str(fz_path), workers=workers)
+    with fits.open(fz_path) as hdul:
+        section = decompressor.section(hdul[1], 1)
+        bands = section.bands(start, stop)
+    decompressor.close()
+    assert bands[0][0] == start and bands[-1][1] == stop
+    assert len(bands) <= workers
+    for (_, stop_a), (start_b, stop_b) in zip(bands[:-1], bands[1:]):
+        assert stop_a == start_b
+        assert start_b % TILE_ROWS == 0
+        assert stop_b > start_b
+
+
+@pytest.mark.parametrize("key", [Ellipsis, slice(None), slice(7, 99),
+                                 (slice(2, 90, 3), slice(4, 30)),
+                                 (slice(10, 100), 5), 17])
+def test_section_matches_astropy(fz_path, image, key):
+    decompressor = TileDecompressor(str(fz_path), workers=3)
+    with fits.open(fz_path) as hdul:
+        values = np.asarray(decompressor.section(hdul[1], 1)[key])
+        expected = hdul[1].data[key]
+    decompressor.close()
+    np.testing.assert_array_equal(values, expected)
+    np.testing.assert_array_equal(values, image[key])
+
+
+def test_decompressed_copy(fz_path, image, tmp_path):
+    cache_dir = tmp_path / "cache"
+    copy_path = decompressed_copy(str(fz_path), str(cache_dir), workers=2)
+    assert os.path.basename(copy_path) == copy_name(str(fz_path))
+    with fits.open(copy_path) as hdul:
+        assert not isinstance(hdul[1], fits.CompImageHDU)
+        np.testing.assert_array_equal(hdul[1].data, image)
+    assert decompressed_copy(str(fz_path), str(cache_dir)) == copy_path
+
+    # A modified file replaces the copy of its previous version
+    stat = os.stat(fz_path)
+    os.utime(fz_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    new_copy_path = decompressed_copy(str(fz_path), str(cache_dir))
+    assert new_copy_path != copy_path
+    assert os.listdir(cache_dir) == [os.path.basename(new_copy_path)]
+
+
+def test_decompressed_copy_of_uncompressed_file(tmp_path, image):
+    path = tmp_path / "frame.fit"
+    fits.HDUList([fits.PrimaryHDU(), fits.ImageHDU(image)]).writeto(path)
+    cache_dir = tmp_path / "cache"
+    assert decompressed_copy(str(path), str(cache_dir)) == str(path)
+    assert not cache_dir.exists()